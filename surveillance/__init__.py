@@ -2,10 +2,12 @@ from importlib.metadata import version as pkgver
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
 from email.mime.text import MIMEText
-import threading
-import smtplib
+from surveillance.logs import LogWriter
+import atexit
 import json
 
+_writer = LogWriter()
+
 def version() -> str:
     """
     Return the current version of the project.
@@ -27,7 +29,8 @@ def version() -> str:
 
 def logger(message: str, code: str="INFO"):
     """
-    Logs messages to the terminal.
+    Logs messages to the terminal. The messages are written by a
+    background thread, so the caller never waits for the output.
 
     Parameters
     ----------
@@ -36,22 +39,49 @@ def logger(message: str, code: str="INFO"):
 
         code: str
             The type of message to log. Available codes are
-            "INFO", "SUCCESS", "WARNING", "ERROR".
+            "DEBUG", "INFO", "SUCCESS", "WARNING", "ERROR".
+    """
+    _writer.log(message, code)
+
+@atexit.register
+def _close_logging():
+    """
+    Writes the queued records of the current log writer at exit.
     """
-    print(f"\t - [{code.upper()}]: {message}")
-    if code.upper() == "ERROR":
-        exit(1)
-
-def send_email(
-        subject: str, 
-        body: str, 
-        sender: str, 
-        password: str, 
+    _writer.close()
+
+def configure_logging(configuration: dict):
+    """
+    Replaces the log writer with the settings of the "logging" section.
+
+    Parameters
+    ----------
+        configuration: dict
+            The "level", "json", "file", "max_mb", "backups",
+            "console" and "repeat_window" settings.
+    """
+    global _writer
+    previous = _writer
+    _writer = LogWriter(
+        level=configuration.get("level", "INFO"),
+        json_format=configuration.get("json", False),
+        path=configuration.get("file"),
+        max_bytes=int(configuration.get("max_mb", 10) * 1024 * 1024),
+        backups=configuration.get("backups", 3),
+        console=configuration.get("console", True),
+        repeat_window=configuration.get("repeat_window", 10.0),
+    )
+    previous.close()
+
+def build_message(
+        subject: str,
+        body: str,
+        sender: str,
         receivers: list,
-        img: bytes=None
-    ):
+        images: list=None
+    ) -> MIMEMultipart:
     """
-    Sends an email message.
+    Builds an HTML email message with inline images.
 
     Parameters
     ----------
@@ -59,51 +89,44 @@ def send_email(
             This is the email subject.
 
         body: str
-            This is the body message of the email.
+            This is the HTML body message of the email.
 
         sender: str
             This is the email to use to send.
 
-        password: str
-            This is the password of the email sender.
-
-        receivers: str
+        receivers: list
             These are the email addresses to receive.
 
-        img: bytes
-            The image showing motion.
+        images: list
+            The encoded images (bytes) to show below the body.
+
+    Returns
+    -------
+        msg: MIMEMultipart
+            The message ready to be sent.
+    """
+    msg = MIMEMultipart('related')
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = ', '.join(receivers)
+
+    images = images or []
+    # Each image is referenced in the HTML part by its Content-ID.
+    tags = "\n".join(f'<img src="cid:image{i}">' for i in range(len(images)))
+    html = f"""\
+    <html>
+        <body>
+            {body}\n
+            {tags}
+        </body>
+    </html>
     """
-    def email_thread():
-        msg = MIMEMultipart()
-        msg['Subject'] = subject
-        msg['From'] = sender
-        msg['To'] = ', '.join(receivers)
-
-        # write the HTML part
-        html = f"""\
-        <html>
-            <body>
-                {body}\n
-                <img src="cid:Mailtrapimage">
-            </body>
-        </html>
-        """
-        if img is not None:
-            msg.attach(MIMEText(html, "html"))
-            image = MIMEImage(img)
-            # Specify the  ID according to the img src in the HTML part
-            image.add_header('Content-ID', '<Mailtrapimage>')
-            msg.attach(image)
-
-        try:
-            with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-                server.login(sender, password)
-                server.send_message(msg)
-            logger("Email sent successfully!", code="SUCCESS")
-        except Exception as e:
-            logger(f"Failed to send email: {e}", code="WARNING")
-    thread = threading.Thread(target=email_thread)
-    thread.start()
+    msg.attach(MIMEText(html, "html"))
+    for i, img in enumerate(images):
+        image = MIMEImage(img)
+        image.add_header('Content-ID', f'<image{i}>')
+        msg.attach(image)
+    return msg
 
 def read_configuration(config_file: str) -> dict:
     """
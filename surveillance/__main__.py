@@ -1,26 +1,46 @@
-
-from surveillance.video.utils import show_time, convert_h264_to_mp4
-from surveillance import read_configuration, version, logger
+from surveillance.video.transcode import Transcoder
+from surveillance.video.broadcast import FrameBroadcaster, MetadataChannel
+from surveillance.video.tiers import DEFAULT_TIERS, build_tiers
+from surveillance.video.workers import CameraWorker
+from surveillance.video.recorder import EventRecorder
+from surveillance.video.sources import source_from_configuration
+from surveillance.video.motion import MotionDetector
+from surveillance.video.analysis import MotionProcess
+from surveillance.video.activity import ActivityIndex, activity_segments
+from surveillance.video.utils import probe_duration, show_time
+from surveillance.media import MediaIndex, parse_time
+from surveillance.events import BUCKETS, EventLog
+from surveillance.thumbnails import ThumbnailCache
+from surveillance.retention import RetentionManager, RetentionPolicy
+from surveillance.streaming import AsyncStreamServer
+from surveillance.metrics import metrics, stage
+from surveillance import read_configuration, configure_logging, version, logger
 from surveillance.credentials import Credentials
+from surveillance.control.servo import ServoController
+from surveillance.audio.sources import audio_source_from_configuration
+from surveillance.audio.service import AudioService
+from surveillance.notify import EmailNotifier
+from surveillance.jobs import JobQueue
 from surveillance.video.camera import Camera
-from picamera2.outputs import CircularOutput
-from picamera2.encoders import H264Encoder
 from flask_restful import Resource, Api
 from flask import (
     Flask, 
     Response,
+    abort,
     render_template, 
+    send_file,
     redirect, 
     jsonify, 
     request, 
     session, 
     url_for
 )
-from gpiozero import Servo
+from urllib.parse import urlsplit
 from datetime import datetime
-from time import sleep
-import subprocess
 import threading
+import queue
+import json
+import time
 import argparse
 import os
 
@@ -55,20 +75,31 @@ def main():
     args = parser.parse_args()
 
     configuration = read_configuration(args.configuration)
+    configure_logging(configuration.get("logging", {}))
+    metrics.enabled = configuration.get("metrics", {}).get("enabled", True)
     silent = False # TODO: Control with a button.
     # Define the app.
     app = Flask(__name__, template_folder='template', static_url_path='/static')
     app.secret_key = configuration["secret_key"] 
     api = Api(app)
 
-    encoder = H264Encoder()
-    output = CircularOutput()
-
-    # Global or session variable to hold the current recording file name.
-    current_video_file = None
-
-    # Global Thread Lock
-    email_lock = threading.Lock()
+    # The hardware libraries are only required by the camera source.
+    source_configuration = configuration.get("source", {"type": "picamera"})
+    recording = configuration.get("recording", {})
+    if source_configuration.get("type", "picamera") == "picamera":
+        from picamera2.outputs import CircularOutput
+        from picamera2.encoders import H264Encoder
+        if recording.get("format", "h264") == "hls":
+            # Segments are cut at keyframes, which carry the stream headers.
+            encoder = H264Encoder(repeat=True, iperiod=int(recording.get("framerate", 30)))
+        else:
+            encoder = H264Encoder()
+        # The circular buffer holds the pre-roll frames of each recording.
+        output = CircularOutput(
+            buffersize=int(recording.get("pre_roll", 5) * recording.get("framerate", 30)))
+    else:
+        encoder = None
+        output = None
 
     # Camera Handler
     images_directory = os.path.join(
@@ -77,6 +108,8 @@ def main():
         os.path.dirname(os.path.realpath(__file__)), "static/video")
     sound_directory = os.path.join(
         os.path.dirname(os.path.realpath(__file__)), "static/sound")
+    for directory in (images_directory, videos_directory, sound_directory):
+        os.makedirs(directory, exist_ok=True)
 
     credentials = Credentials(
         sender_email=configuration["sender_email"],
@@ -85,8 +118,165 @@ def main():
         location=configuration["location"],
         users=configuration["users"],
     )
+    # A single worker sends the alerts over a persistent SMTP connection.
+    smtp = configuration.get("smtp", {})
+    notifier = EmailNotifier(
+        credentials,
+        host=smtp.get("host", "smtp.gmail.com"),
+        port=smtp.get("port", 465),
+        use_ssl=smtp.get("ssl", True),
+        window=smtp.get("window", 10),
+        queue_size=smtp.get("queue_size", 32),
+    )
+
+    # The media listings are served from an index instead of the directories.
+    media = MediaIndex(
+        configuration.get("media", {}).get("database", os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "media.db")),
+        {"image": images_directory, "video": videos_directory, "sound": sound_directory},
+        probe=probe_duration,
+    )
+    added, removed = media.sync()
+    if not silent:
+        logger(f"Media index synchronized: {added} added, {removed} removed.")
+
+    # The motion events are kept in an append-only log queried by time.
+    event_configuration = configuration.get("events", {})
+    events = EventLog(
+        event_configuration.get("database", os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "events.db")),
+        quiet_period=event_configuration.get("quiet_period", 10),
+        max_duration=event_configuration.get("max_duration", 600),
+    )
+    events.start()
+
+    # The gallery loads small thumbnails instead of the original files.
+    thumbnail_configuration = configuration.get("thumbnails", {})
+    thumbnails = ThumbnailCache(
+        thumbnail_configuration.get("directory", os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "thumbnails")),
+        max_bytes=int(thumbnail_configuration.get("max_mb", 64) * 1024 * 1024),
+        size=thumbnail_configuration.get("size", (320, 240)),
+        quality=thumbnail_configuration.get("quality", 70),
+    )
+
+    def on_converted(path: str):
+        """
+        Indexes a converted recording and creates its poster frame
+        while still on the conversion worker.
+        """
+        media.add(path)
+        thumbnails.get(path)
+        retention.wake()
+        if activity is not None:
+            activity.schedule()
+
+    # Old files are removed before the storage fills up.
+    retention_configuration = configuration.get("retention", {})
+    retention = RetentionManager(
+        media,
+        {
+            kind: RetentionPolicy.from_configuration(policy)
+            for kind, policy in retention_configuration.get("quotas", {}).items()
+        },
+        min_free_bytes=int(retention_configuration.get("min_free_mb", 0) * 1024 * 1024),
+        interval=retention_configuration.get("interval", 60),
+        grace=retention_configuration.get("grace", 60),
+        on_removed=thumbnails.remove,
+    )
+    retention.start()
+
+    # A single capture of the microphone stores sound clips on request or on a trigger.
+    audio_configuration = configuration.get("audio", {})
+    trigger = audio_configuration.get("trigger") or {}
+    try:
+        audio = AudioService(
+            audio_source_from_configuration(audio_configuration.get("source", {})),
+            sound_directory,
+            codec=audio_configuration.get("codec", "flac"),
+            pre_roll=audio_configuration.get("pre_roll", 2),
+            buffer_seconds=audio_configuration.get("buffer_seconds", 60),
+            trigger_db=trigger.get("level_db"),
+            quiet_period=trigger.get("quiet_period", 5),
+            max_duration=audio_configuration.get("max_duration", 60),
+            on_saved=lambda path, duration: (media.add(path, duration=duration), retention.wake()),
+        )
+        audio.start()
+    except Exception as e:
+        logger(f"Sound recording is unavailable: {e}", code="WARNING")
+        audio = None
+
+    # Finished recordings are converted by a bounded pool of workers.
+    transcoding = configuration.get("transcoding", {})
+    jobs = JobQueue(
+        workers=transcoding.get("workers", 1),
+        max_pending=transcoding.get("max_pending", 32),
+        name="transcode",
+    )
+    transcoder = Transcoder(jobs, silent, on_converted=on_converted)
+
+    # The recordings are indexed for activity in the background, once each.
+    activity_configuration = configuration.get("activity", {})
+    activity = None
+    if activity_configuration.get("enabled", True):
+        activity = ActivityIndex(
+            media,
+            JobQueue(workers=1, max_pending=2, name="activity"),
+            size=activity_configuration.get("size", (160, 120)),
+            fps=activity_configuration.get("fps", 2),
+            pixel_threshold=activity_configuration.get("pixel_threshold", 25),
+        )
+        activity.schedule()
+
+    # Full resolution stills pause the stream, so they are queued one at a time.
+    snapshots = configuration.get("snapshots", {})
+    stills = JobQueue(workers=1, max_pending=1, name="stills")
+    still_interval = snapshots.get("still_interval", 30)
+    still_lock = threading.Lock()
+    last_still = {"time": 0.0}
+    transcoder.recover(videos_directory)
+
+    recorder = None
+    if output is not None:
+        recorder = EventRecorder(
+            output,
+            videos_directory,
+            auto=recording.get("auto", False),
+            quiet_period=recording.get("quiet_period", 10),
+            max_duration=recording.get("max_duration", 120),
+            on_finished=transcoder.submit,
+            container=recording.get("format", "h264"),
+            segment_duration=recording.get("segment_duration", 2),
+            framerate=recording.get("framerate", 30),
+            # Segmented recordings are listed while in progress.
+            on_started=lambda path: media.add(path, duration=0),
+        )
+
+    analysis_source = None
+    if "analysis_source" in configuration:
+        analysis_source = source_from_configuration(configuration["analysis_source"])
 
     height, width = args.resolution
+    motion = MotionDetector.from_configuration(configuration.get("motion", {}))
+    source = source_from_configuration(
+        source_configuration,
+        width=width,
+        height=height,
+        size=(width, height),
+        lores_size=motion.analysis_size or (320, 240)
+    )
+    # The motion analysis optionally runs in its own process.
+    motion_process = None
+    if configuration.get("motion_process", {}).get("enabled", False):
+        motion_process = MotionProcess(
+            configuration.get("motion", {}),
+            slots=configuration["motion_process"].get("slots", 8),
+        )
+        metrics.gauge(
+            "surveillance_analysis_skipped", "The frames skipped by the motion process.",
+            lambda: motion_process.skipped)
+    # The motion boxes are pushed to the viewers next to the untouched stream.
+    motion_channel = MetadataChannel()
     camera = Camera(
         encoder=encoder,
         output=output,
@@ -95,10 +285,131 @@ def main():
         width=width,
         height=height,
         cooldown=args.cooldown,
+        motion=motion,
+        analysis_source=analysis_source,
+        source=source,
+        recorder=recorder,
+        notifier=notifier,
+        alert_frames_before=configuration.get("alerts", {}).get("frames_before", 0),
+        alert_frames_after=configuration.get("alerts", {}).get("frames_after", 0),
+        alert_frame_step=configuration.get("alerts", {}).get("frame_step", 1),
+        motion_process=motion_process,
+        events=events,
+        motion_channel=motion_channel,
     )
+    # The other cameras capture and analyze their frames in worker processes
+    # and share the notifier and the media directories of the server.
+    camera_alerts = {}
 
-    servo = Servo(17)
-    servo.value = None
+    def on_camera_motion(
+            camera_id: str,
+            timestamp: float,
+            score: int,
+            frame: bytes,
+            regions: list,
+            bounds: list
+        ):
+        """
+        Logs the motion detected by a worker camera and sends an
+        alert at most once per cooldown period for each camera.
+        """
+        last = camera_alerts.get(camera_id)
+        alerted = last is None or timestamp - last >= args.cooldown
+        events.motion(camera_id, timestamp, score, regions=regions, bounds=bounds, alerted=alerted)
+        if not alerted:
+            return
+        camera_alerts[camera_id] = timestamp
+        name = workers[camera_id].name
+        notifier.notify(
+            f"[Surveillance] - Motion Detected Alert ({name})",
+            f"Motion has been detected by your camera {name} at {show_time()} in {credentials.location}.",
+            [frame],
+        )
+        logger(f"Motion detected by camera {name} and email queued for {credentials.receivers}.")
+
+    workers = {}
+    for camera_id, camera_configuration in configuration.get("cameras", {}).items():
+        worker = CameraWorker(
+            camera_id,
+            camera_configuration,
+            defaults={"width": width, "height": height, "size": (width, height)},
+            on_motion=on_camera_motion,
+        )
+        worker.start()
+        workers[camera_id] = worker
+
+    # A single thread captures and analyzes each frame for all viewers.
+    broadcaster = FrameBroadcaster(camera.get_frame)
+    broadcaster.start()
+    # Lower quality tiers are re-encoded once for all of their viewers.
+    tiers = build_tiers(broadcaster, configuration.get("stream", {}).get("tiers", DEFAULT_TIERS))
+
+    # A single actuator thread owns the servo and follows the latest position.
+    try:
+        servo = ServoController.from_configuration(configuration.get("servo", {}))
+        servo.start()
+    except Exception as e:
+        logger(f"Servo control is unavailable: {e}", code="WARNING")
+        servo = None
+
+    # Optionally serve the stream and the servo control from an event loop.
+    streaming = configuration.get("streaming", {})
+    stream_server = None
+    if streaming.get("async", False):
+        stream_server = AsyncStreamServer(
+            app,
+            broadcaster,
+            tiers=tiers,
+            move=servo.move if servo is not None else None,
+            metadata=motion_channel,
+            port=streaming.get("port", 5001),
+            max_buffer=int(streaming.get("max_buffer_kb", 512) * 1024),
+            max_stall=streaming.get("max_stall", 10),
+        )
+        stream_server.start()
+
+    # Expose the state of the pipeline next to the stage timings.
+    metrics.gauge(
+        "surveillance_stream_clients", "The connected stream viewers.",
+        lambda: sum(tier.clients for tier in tiers.values()) +
+                sum(worker.broadcaster.clients for worker in workers.values()))
+    metrics.gauge(
+        "surveillance_queue_depth", "The pending items of the work queues.",
+        jobs.queue.qsize, queue="jobs")
+    metrics.gauge(
+        "surveillance_queue_depth", "The pending items of the work queues.",
+        notifier.queue.qsize, queue="notifications")
+    metrics.gauge(
+        "surveillance_notifications_sent", "The notification emails sent.",
+        lambda: notifier.sent)
+    metrics.gauge(
+        "surveillance_notifications_dropped", "The notifications dropped.",
+        lambda: notifier.dropped)
+    metrics.gauge(
+        "surveillance_retention_removed", "The files removed by the retention manager.",
+        lambda: retention.removed)
+    if stream_server is not None:
+        metrics.gauge(
+            "surveillance_dropped_frames", "The frames dropped for viewers with a full write buffer.",
+            lambda: stream_server.dropped)
+    send = stage("send")
+
+    def stream_base() -> str:
+        """
+        Returns the base URL of the stream and control endpoints.
+
+        Returns
+        -------
+            url: str
+                An empty string for this server or the URL of the
+                streaming server on the same host.
+        """
+        if stream_server is None:
+            return ''
+        host = urlsplit(f"//{request.host}").hostname
+        if ':' in host:
+            host = f"[{host}]"
+        return f"//{host}:{stream_server.port}/"
 
     class VideoFeed(Resource):
         """
@@ -107,19 +418,79 @@ def main():
         def get(self):
             if 'username' not in session:
                 return redirect(url_for('login'))  # Ensure this follows your app's login logic
-            return Response(genFrames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+            quality = request.args.get('quality', 'high')
+            if quality not in tiers:
+                return {'error': f"Unknown quality: {quality}"}, 400
+            max_fps = request.args.get('fps', None, type=float)
+            return Response(
+                genFrames(tiers[quality], max_fps), 
+                mimetype='multipart/x-mixed-replace; boundary=frame')
                 
-    def genFrames():
+    class CameraFeed(Resource):
+        """
+        The stream of a camera running in a worker process.
+        """
+        def get(self, camera_id: str):
+            if 'username' not in session:
+                return redirect(url_for('login'))
+            if camera_id not in workers:
+                return {'error': f"Unknown camera: {camera_id}"}, 404
+            max_fps = request.args.get('fps', None, type=float)
+            return Response(
+                genFrames(workers[camera_id].broadcaster, max_fps),
+                mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    def genFrames(source: FrameBroadcaster, max_fps: float=None):
         """
         Continuous generation of frames in a stream to display 
         in the endpoint.
+
+        Parameters
+        ----------
+            source: FrameBroadcaster
+                The broadcaster of the requested quality tier.
+
+            max_fps: float
+                The maximum frame rate sent to the client.
         """
-        while True:
-            frame = camera.get_frame()
-            yield (
-                b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n\r\n'
-            )
+        for frame in source.subscribe(max_fps):
+            # The generator resumes once the server has written the frame.
+            with send.time():
+                yield (
+                    b'--frame\r\n'
+                    b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n\r\n'
+                )
+
+    def motion_boxes():
+        """
+        Streams the boxes of the moving objects seen by the main camera
+        as Server-Sent Events. The streaming server serves them instead
+        when it is enabled. Each event holds the time, the motion
+        decision and the [left, top, right, bottom] boxes normalized
+        between 0 and 1. A comment is sent while there is no motion to
+        keep the connection open.
+
+        Returns
+        -------
+            Response
+                The text/event-stream of the motion boxes.
+        """
+        def generate():
+            yield 'retry: 2000\n\n'
+            for data in motion_channel.subscribe():
+                if data is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield f'data: {json.dumps(data)}\n\n'
+
+        return Response(
+            generate(),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    # Otherwise the streaming server sends the boxes without holding a thread.
+    if stream_server is None:
+        app.add_url_rule('/api/motion/boxes', view_func=motion_boxes)
 
     # @App Routes
 
@@ -133,13 +504,12 @@ def main():
             rendered_template: str
                 The template for start recording session.
         """
+        if recorder is None:
+            logger("Recording is not supported by the frame source.", code="WARNING")
+            return render_template('startRec.html')
         if not silent:
             logger("Starting video record progress...")
-        basename = show_time()
-        # Save the full path to a global variable.
-        current_video_file = f"vid_{basename}.h264"  
-        output.fileoutput = os.path.join(videos_directory, current_video_file)
-        output.start()
+        recorder.start()
         return render_template('startRec.html')
 
     @app.route('/stopRec.html')
@@ -152,16 +522,23 @@ def main():
             rendered_template: str
                 The template for stopping recording.
         """
+        if recorder is None:
+            return render_template(
+                'stopRec.html', 
+                message="Recording is not supported by the frame source.")
         if not silent:
             logger("Stopping video recording...")
-        output.stop()
-        if current_video_file:
-            source_path = os.path.join(videos_directory, current_video_file)
+        # The finished clip is converted by the recorder callback.
+        source_path = recorder.stop()
+        if source_path and source_path.endswith('.m3u8'):
+            return render_template(
+                'stopRec.html', 
+                message=f"The recording was saved to {os.path.dirname(source_path)}")
+        elif source_path:
             output_path = source_path.replace('.h264', '.mp4')
-            convert_h264_to_mp4(source_path, output_path, silent)
             return render_template(
                 'stopRec.html', 
-                message=f"Conversion successful for {output_path}")
+                message=f"Converting the recording to {output_path}")
         else:
             return render_template(
                 'stopRec.html', 
@@ -177,7 +554,8 @@ def main():
             rendered_template: str
                 The template for the homepage.
         """
-        return render_template('index.html')
+        return render_template('index.html', stream_base=stream_base(), qualities=list(tiers),
+            cameras={camera_id: worker.name for camera_id, worker in workers.items()})
 
     @app.route('/home', methods = ['GET', 'POST'])
     def home_func() -> str:
@@ -188,17 +566,19 @@ def main():
         -------
             The template for the homepage.
         """
-        return render_template("index.html")
+        return render_template("index.html", stream_base=stream_base(), qualities=list(tiers),
+            cameras={camera_id: worker.name for camera_id, worker in workers.items()})
     
     @app.route("/move", methods=["POST"])
     def move():
+        if servo is None:
+            return 'Servo control is unavailable.', 503
         # Get slider values for servo movement.
-        slider = request.form["slider"]
-        servo.value = float(slider)
-        # Give servo some time to move.
-        sleep(1)
-        servo.value = None
-        return '', 204  # Successful movement
+        try:
+            servo.move(request.form["slider"])
+        except (KeyError, ValueError):
+            return 'Invalid servo position.', 400
+        return '', 204  # The movement was requested
 
     @app.route('/info.html')
     def info() -> str:
@@ -225,15 +605,36 @@ def main():
             rendered_template: str
                 The template to show when recording sounds.
         """
-        timestamp = datetime.now()
+        if audio is None:
+            return 'Sound recording is unavailable.', 503
         if not silent:
-            logger(f"Starting sound recording session {timestamp}...")
-        subprocess.Popen(
-            f'arecord -D dmic_sv -d 30 -f S32_LE {sound_directory}/cam_$(date "+%b-%d-%y-%I").wav -c 2', 
-            shell=True
-        )
+            logger("Starting sound recording session...")
+        # A click during a recording extends it instead of starting another capture.
+        audio.record(30)
         return render_template('srecord.html')
 
+    @app.route('/api/audio', methods=['GET', 'POST', 'DELETE'])
+    def api_audio():
+        """
+        Fetches the sound recording state. POST records for "duration"
+        seconds and DELETE stops the recording in progress.
+
+        Returns
+        -------
+            Response
+                The recording state.
+        """
+        if audio is None:
+            return jsonify({'error': "Sound recording is unavailable."}), 503
+        if request.method == 'POST':
+            duration = request.values.get('duration', 30, type=float)
+            if not 0 < duration <= audio.max_duration:
+                return jsonify({'error': "Invalid duration."}), 400
+            return jsonify(audio.record(duration))
+        if request.method == 'DELETE':
+            return jsonify(audio.stop_clip())
+        return jsonify(audio.status())
+
     @app.route('/snap.html')
     def snap():
         """
@@ -247,33 +648,286 @@ def main():
         """
         if not silent:
             logger("Taking a photo.")
-        
-        camera.video_snap()
+        try:
+            media.add(camera.video_snap())
+        except TimeoutError as e:
+            logger(f"Could not take a photo: {e}", code="WARNING")
+            return render_template("snap.html", error=str(e)), 503
         return render_template("snap.html")
 
+    @app.route('/api/snapshot', methods=['POST'])
+    def api_snapshot():
+        """
+        Takes snapshots of the stream. The "mode" parameter selects
+        a single snapshot ("fast"), a burst of "count" snapshots
+        "interval" seconds apart ("burst") or a queued full resolution
+        picture ("still"), which is limited to one per still_interval.
+        The "camera" parameter selects a camera running in a worker
+        process, which only supports single snapshots.
+
+        Returns
+        -------
+            Response
+                The stored files or the queued still job.
+        """
+        mode = request.values.get('mode', 'fast')
+        camera_id = request.values.get('camera')
+        try:
+            if camera_id is not None:
+                if camera_id not in workers:
+                    return jsonify({'error': f"Unknown camera: {camera_id}"}), 404
+                if mode != 'fast':
+                    return jsonify({'error': "Only single snapshots are supported by this camera."}), 400
+                paths = [workers[camera_id].snap(images_directory)]
+            elif mode == 'fast':
+                paths = [camera.video_snap()]
+            elif mode == 'burst':
+                count = request.values.get('count', 5, type=int)
+                interval = request.values.get('interval', 0.2, type=float)
+                if not 1 <= count <= snapshots.get("burst_max", 20) or not 0 <= interval <= 10:
+                    return jsonify({'error': "Invalid burst count or interval."}), 400
+                # The burst holds the request, so its duration is bounded.
+                if (count - 1) * interval > snapshots.get("burst_max_seconds", 5):
+                    return jsonify({'error': "The burst would take too long."}), 400
+                paths = camera.burst_snap(count, interval)
+            elif mode == 'still':
+                with still_lock:
+                    now = time.monotonic()
+                    if now - last_still["time"] < still_interval:
+                        return jsonify({'error': "A still was taken recently."}), 429
+                    path = camera.snap_path(datetime.now(), "_full")
+                    try:
+                        job = stills.submit(
+                            "still", path, lambda: media.add(camera.still_snap(path)))
+                    except queue.Full:
+                        return jsonify({'error': "A still is already queued."}), 503
+                    last_still["time"] = now
+                return jsonify({'job': job.to_dict()}), 202
+            else:
+                return jsonify({'error': f"Unknown mode: {mode}"}), 400
+        except TimeoutError as e:
+            return jsonify({'error': str(e)}), 503
+        for path in paths:
+            media.add(path)
+        return jsonify({'files': [os.path.basename(path) for path in paths]})
+
+    @app.route('/api/cameras')
+    def api_cameras():
+        """
+        Fetches the state of the cameras running in worker processes.
+
+        Returns
+        -------
+            Response
+                The name, process, restarts and viewers of each camera.
+        """
+        return jsonify({'cameras': [worker.status() for worker in workers.values()]})
+
+    @app.route('/api/events')
+    def api_events():
+        """
+        Fetches the motion events of a time range and their counts per
+        bucket. The query accepts from and to (epoch seconds or ISO 8601
+        dates, the last day by default), bucket (seconds, or minute,
+        hour, day or week), camera and limit parameters. Buckets of
+        whole hours start on the hour.
+
+        Returns
+        -------
+            Response
+                The buckets, the most recent events of the range, their
+                number and the events in progress.
+        """
+        try:
+            end = parse_time(request.args.get('to'))
+            end = time.time() if end is None else end
+            start = parse_time(request.args.get('from'))
+            start = end - 86400 if start is None else start
+            bucket = request.args.get('bucket', 'hour')
+            size = float(BUCKETS.get(bucket, bucket))
+            if end <= start or size <= 0:
+                raise ValueError("The time range or the bucket size is empty.")
+            if (end - start) / size > 10000:
+                raise ValueError("The time range has too many buckets.")
+            # Buckets of whole hours start on the hour to use the hourly rollup.
+            if size % 3600 == 0:
+                start -= start % 3600
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        camera_id = request.args.get('camera') or None
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        items, total = events.query(start, end, camera=camera_id, limit=limit)
+        return jsonify({
+            'from': start,
+            'to': end,
+            'bucket': size,
+            'buckets': events.buckets(start, end, size, camera=camera_id),
+            'events': items,
+            'total': total,
+            'current': [
+                event for event in events.current()
+                if camera_id is None or event['camera'] == camera_id
+            ],
+        })
+
+    @app.route('/api/jobs')
+    def api_jobs():
+        """
+        Fetches the status of the background jobs.
+
+        Returns
+        -------
+            Response
+                The pending, running and recently finished jobs.
+        """
+        listed = jobs.jobs() + stills.jobs()
+        if activity is not None:
+            listed += activity.jobs.jobs()
+        return jsonify({'jobs': listed})
+
     @app.route('/api/files')
     def api_files():
         """
-        Fetches the files for images and videos captured.
+        Fetches a page of the images, videos and sounds captured. The
+        query accepts the type (image, video or sound, or several of
+        them separated by commas), from and to
+        (epoch seconds or ISO 8601 dates), sort (timestamp, name, size
+        or duration), order (asc or desc), page and per_page parameters.
 
         Returns
         -------
             Response
-                This displays the files stored.
+                The files of the page and the number of matching files.
         """
         try:
-            images = [img for img in os.listdir(images_directory) if img.endswith(('.jpg', '.jpeg', '.png'))]
-            videos = [file for file in os.listdir(videos_directory) if file.endswith('.mp4')]
-            if not silent:
-                logger(f"Images found: {images}") 
-                logger(f"Videos found: {videos}") 
-            return jsonify({'images': images, 'videos': videos})
-        except Exception as e:
-            if not silent:
-                logger(f"Error in api_files: {str(e)}", code="ERROR") 
-            return jsonify({'error': str(e)})
+            kind = request.args.get('type') or None
+            if kind is not None:
+                kind = kind.split(',')
+                for name in kind:
+                    if name not in ('image', 'video', 'sound'):
+                        raise ValueError(f"Unsupported media type: {name}")
+            page = request.args.get('page', 1, type=int)
+            per_page = min(request.args.get('per_page', 50, type=int), 500)
+            items, total = media.query(
+                kind=kind,
+                start=parse_time(request.args.get('from')),
+                end=parse_time(request.args.get('to')),
+                sort=request.args.get('sort', 'timestamp'),
+                order=request.args.get('order', 'desc'),
+                page=page,
+                per_page=per_page,
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({
+            'items': items,
+            'images': [item['name'] for item in items if item['type'] == 'image'],
+            'videos': [item['name'] for item in items if item['type'] == 'video'],
+            'sounds': [item['name'] for item in items if item['type'] == 'sound'],
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+        })
+
+    @app.route('/thumb/<kind>/<path:filename>')
+    def thumb(kind: str, filename: str):
+        """
+        Serves the thumbnail of a picture or the poster frame of a video.
+
+        Parameters
+        ----------
+            kind: str
+                The media type: "image" or "video".
+
+            filename: str
+                The name of the picture or video.
+
+        Returns
+        -------
+            Response
+                The JPEG thumbnail, revalidated with its ETag.
+        """
+        directory = media.directories.get(kind)
+        if directory is None:
+            abort(404)
+        source_path = os.path.join(directory, filename)
+        if media.media_type(source_path) != kind:
+            abort(404)
+        path = thumbnails.get(source_path)
+        if path is None:
+            abort(404)
+        return send_file(path, mimetype='image/jpeg', max_age=86400)
+
+    def media_path(filename: str) -> str:
+        """
+        Resolves a file name listed by /api/files to its path.
+
+        Parameters
+        ----------
+            filename: str
+                The name of the picture, video or sound.
+
+        Returns
+        -------
+            file_path: str
+                The path to the file or None if the name is
+                outside of the media directories.
+        """
+        # Determine if it's a video or picture based on the extension or another method
+        if filename.endswith(('.mp4', '.mkv', '.m3u8')):
+            directory = videos_directory
+        elif filename.endswith(('.wav', '.flac', '.opus')):
+            directory = sound_directory
+        else:
+            directory = images_directory
+        file_path = os.path.join(directory, filename)
+        if not os.path.realpath(file_path).startswith(os.path.realpath(directory) + os.sep):
+            return None
+        # Segmented recordings are stored in their own directory.
+        if filename.endswith('.m3u8') and media.media_type(file_path) != "video":
+            return None
+        return file_path
+
+    @app.route('/api/activity/<path:filename>')
+    def api_activity(filename: str):
+        """
+        Fetches the active segments of a recording. The query accepts
+        the level (activity in permille from which a second is active),
+        gap (quiet seconds joined into a segment) and pad (seconds added
+        around each segment) parameters.
 
-    @app.route('/delete-file/<filename>', methods=['DELETE'])
+        Parameters
+        ----------
+            filename: str
+                The name of the recording listed by /api/files.
+
+        Returns
+        -------
+            Response
+                The segments and the activity of each second, or 404
+                if the recording is not indexed yet.
+        """
+        if activity is None:
+            abort(404)
+        file_path = media_path(filename)
+        if file_path is None or media.media_type(file_path) != "video":
+            return jsonify({'error': 'Invalid file name.'}), 400
+        timeline = activity.timeline(media.name(file_path))
+        if timeline is None:
+            return jsonify({'error': 'The recording is not indexed yet.'}), 404
+        segments = activity_segments(
+            timeline,
+            level=request.args.get('level', activity_configuration.get("level", 5), type=int),
+            gap=request.args.get('gap', activity_configuration.get("gap", 3), type=int),
+            pad=request.args.get('pad', activity_configuration.get("pad", 1), type=int),
+        )
+        return jsonify({
+            'name': filename,
+            'segments': segments,
+            'timeline': timeline.tolist(),
+        })
+
+    @app.route('/delete-file/<path:filename>', methods=['DELETE'])
     def delete_file(filename):
         """
         Deletes the file by providing the filename.
@@ -286,17 +940,63 @@ def main():
             code: int
                 This is the code of complete: 204 for successful, 500 for an error.
         """
-        # Determine if it's a video or picture based on the extension or another method
-        if filename.endswith('.mp4') or filename.endswith('.mkv'):
-            file_path = os.path.join(videos_directory, filename)
-        else:
-            file_path = os.path.join(images_directory, filename)
+        file_path = media_path(filename)
+        if file_path is None:
+            return 'Invalid file name.', 400
         try:
-            os.remove(file_path)
+            media.delete(file_path)
+            thumbnails.remove(file_path)
             return '', 204  # Successful deletion
         except Exception as e:
             return str(e), 500  # Internal server error
 
+    @app.route('/protect-file/<path:filename>', methods=['POST', 'DELETE'])
+    def protect_file(filename):
+        """
+        Protects a file from the retention policies (POST)
+        or removes its protection (DELETE).
+
+        Returns
+        -------
+            message: str
+                This could be an error, or a blank string if successful.
+
+            code: int
+                204 for successful, 404 if the file is not indexed.
+        """
+        file_path = media_path(filename)
+        if file_path is None:
+            return 'Invalid file name.', 400
+        if not media.protect(file_path, request.method == 'POST'):
+            return 'File not found.', 404
+        return '', 204
+
+    @app.route('/api/storage')
+    def api_storage():
+        """
+        Fetches the storage usage of each media type.
+
+        Returns
+        -------
+            Response
+                The usage, the retention limits and the disk space.
+        """
+        return jsonify(retention.status())
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """
+        Fetches the pipeline metrics in the Prometheus text format.
+
+        Returns
+        -------
+            Response
+                The stage latency histograms, the counters and the gauges.
+        """
+        if not metrics.enabled:
+            abort(404)
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
     @app.route('/files') 
     def files() -> str:
         """
@@ -307,16 +1007,11 @@ def main():
             rendered_template: str
                 Display all the files stored so far.
         """
-        try:
-            images = os.listdir(images_directory)
-            videos = [file for file in os.listdir(videos_directory) if file.endswith(('.mp4', '.h264'))]  # Assuming video formats
-            # Filtering out system files like .DS_Store which might be present in directories
-            images = [img for img in images if img.endswith(('.jpg', '.jpeg', '.png'))]
-            return render_template('files.html', images=images, videos=videos)
-        except Exception as e:
-            return str(e)  # For debugging purposes, show the exception in the browser
+        # The gallery fetches its pages from /api/files.
+        return render_template('files.html')
     
     api.add_resource(VideoFeed, '/cam')
+    api.add_resource(CameraFeed, '/cam/<string:camera_id>')
 
     @app.route('/login', methods=['GET', 'POST'])
     def login() -> str:
@@ -364,6 +1059,8 @@ def main():
                 This is the request for login information.
         """
         allowed_routes = ['login', 'static']  # Make sure the streaming endpoints are either correctly authenticated or exempted here.
+        if configuration.get("metrics", {}).get("public", False):
+            allowed_routes.append('metrics_endpoint')
         if request.endpoint not in allowed_routes and 'username' not in session:
             return redirect(url_for('login'))
 
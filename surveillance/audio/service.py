@@ -0,0 +1,357 @@
+from typing import Callable, Optional
+from surveillance.audio.sources import AudioSource
+from surveillance.jobs import JobQueue
+from surveillance import logger
+from datetime import datetime
+import numpy as np
+import subprocess
+import threading
+import queue
+import wave
+import time
+import os
+
+CODECS = {
+    "flac": ("flac", ["-c:a", "flac"]),
+    "opus": ("opus", ["-c:a", "libopus", "-b:a", "32k"]),
+    "wav": ("wav", None),
+}
+
+def block_levels(block: np.ndarray, window: int, full_scale: float) -> np.ndarray:
+    """
+    Computes the RMS level of consecutive windows of a block.
+
+    Parameters
+    ----------
+        block: np.ndarray
+            The samples of shape (frames, channels).
+
+        window: int
+            The number of frames per window. Trailing frames which do
+            not fill a window are ignored.
+
+        full_scale: float
+            The largest amplitude of a sample.
+
+    Returns
+    -------
+        levels: np.ndarray
+            The level of each window in dBFS.
+    """
+    count = len(block) // window
+    if count == 0:
+        return np.empty(0)
+    samples = block[:count * window].reshape(count, -1).astype(np.float32) / full_scale
+    rms = np.sqrt(np.mean(np.square(samples), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+class AudioService:
+    """
+    Captures audio continuously from a single source into an in-memory
+    ring buffer and stores clips of it on request or when the sound
+    level exceeds a threshold. Each clip includes the pre_roll seconds
+    buffered before it started and is encoded in the background, so
+    the capture never stops and requests never start overlapping
+    captures of the device.
+
+    Parameters
+    ----------
+        source: AudioSource
+            The source of the samples.
+
+        directory: str
+            The directory of the clips.
+
+        codec: str
+            The clip format, "flac", "opus" (encoded with ffmpeg) or "wav".
+
+        pre_roll: float
+            The time in seconds before the start of a clip included in it.
+
+        buffer_seconds: float
+            The length of the ring buffer. It is extended to hold the
+            pre-roll and the longest clip.
+
+        trigger_db: float
+            The level in dBFS above which a clip is started. Clips are
+            only started on request if None.
+
+        quiet_period: float
+            The time in seconds without sound above the trigger level
+            after which a triggered clip stops.
+
+        max_duration: float
+            The maximum length in seconds of a clip.
+
+        block_seconds: float
+            The length of the blocks read from the source.
+
+        window_seconds: float
+            The length of the windows whose RMS level is compared to
+            the trigger level.
+
+        on_saved: Callable[[str, float], None]
+            Called with the path and the duration of each stored clip.
+    """
+    def __init__(
+            self,
+            source: AudioSource,
+            directory: str,
+            codec: str="flac",
+            pre_roll: float=2.0,
+            buffer_seconds: float=60.0,
+            trigger_db: Optional[float]=None,
+            quiet_period: float=5.0,
+            max_duration: float=60.0,
+            block_seconds: float=0.1,
+            window_seconds: float=0.02,
+            on_saved: Optional[Callable[[str, float], None]]=None
+        ) -> None:
+
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported audio codec: {codec}")
+        self.source = source
+        self.directory = directory
+        self.codec = codec
+        self.pre_roll = pre_roll
+        self.trigger_db = trigger_db
+        self.quiet_period = quiet_period
+        self.max_duration = max_duration
+        self.block_frames = max(1, int(source.rate * block_seconds))
+        self.window_frames = max(1, int(source.rate * window_seconds))
+        self.on_saved = on_saved
+        seconds = max(buffer_seconds, pre_roll + max_duration + 2 * block_seconds)
+        self.ring = np.zeros((int(seconds * source.rate), source.channels), dtype=source.dtype)
+        # The number of frames captured since the start.
+        self.written = 0
+        self.level_db = None
+        self.clip = None
+        self.clips = 0
+        self.reserved = set()
+        self.lock = threading.Lock()
+        self.jobs = JobQueue(workers=1, max_pending=8, name="audio")
+        self._running = False
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        """
+        Starts the source and the capture thread.
+        """
+        if self._running:
+            return
+        self.source.start()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="audio", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float=2.0):
+        """
+        Stops the capture and stores the clip in progress.
+
+        Parameters
+        ----------
+            timeout: float
+                The time in seconds to wait for the capture thread.
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._thread.join(timeout)
+        self.source.close()
+        self.stop_clip()
+
+    def _run(self):
+        """
+        The capture loop, which restarts the source after a failure.
+        """
+        while self._running:
+            try:
+                block = self.source.read(self.block_frames)
+            except EOFError as e:
+                if not self.source.restartable:
+                    logger(f"The audio source ended: {e}")
+                    self._finish_clip()
+                    self._running = False
+                    return
+                logger(f"The audio capture failed, restarting it: {e}", code="WARNING")
+                self.source.close()
+                time.sleep(5)
+                self.source.start()
+                continue
+            self._write(block)
+            levels = block_levels(block, self.window_frames, self.source.full_scale)
+            if len(levels):
+                self.level_db = float(levels.max())
+            if self.trigger_db is not None and len(levels) and levels.max() > self.trigger_db:
+                self.record(self.quiet_period, reason="trigger")
+            with self.lock:
+                done = self.clip is not None and self.written >= self.clip["end"]
+            if done:
+                self._finish_clip()
+
+    def _write(self, block: np.ndarray):
+        """
+        Appends a block to the ring buffer.
+        """
+        capacity = len(self.ring)
+        block = block[-capacity:]
+        start = self.written % capacity
+        first = min(len(block), capacity - start)
+        self.ring[start:start + first] = block[:first]
+        self.ring[:len(block) - first] = block[first:]
+        with self.lock:
+            self.written += len(block)
+
+    def _read(self, start: int, end: int) -> np.ndarray:
+        """
+        Copies the frames between two positions out of the ring buffer.
+        """
+        capacity = len(self.ring)
+        start = max(start, self.written - capacity)
+        indices = np.arange(start, end) % capacity
+        return self.ring[indices]
+
+    def record(self, duration: float, reason: str="manual") -> dict:
+        """
+        Starts a clip, or extends the clip in progress, lasting at
+        least duration seconds from now.
+
+        Parameters
+        ----------
+            duration: float
+                The time in seconds to record from now.
+
+            reason: str
+                Why the clip was started, i.e. "manual" or "trigger".
+
+        Returns
+        -------
+            status: dict
+                The recording state.
+        """
+        rate = self.source.rate
+        with self.lock:
+            end = self.written + int(duration * rate)
+            if self.clip is None:
+                start = max(0, self.written - int(self.pre_roll * rate))
+                self.clip = {
+                    "start": start,
+                    "end": end,
+                    "reason": reason,
+                    "started": datetime.fromtimestamp(time.time() - (self.written - start) / rate),
+                }
+                logger(f"Recording a {reason} sound clip.")
+            elif not self.clip.get("stopped"):
+                self.clip["end"] = max(self.clip["end"], end)
+            self.clip["end"] = min(self.clip["end"], self.clip["start"] + int(self.max_duration * rate))
+        return self.status()
+
+    def stop_clip(self) -> dict:
+        """
+        Stops the clip in progress at the current position.
+
+        Returns
+        -------
+            status: dict
+                The recording state.
+        """
+        with self.lock:
+            if self.clip is not None:
+                self.clip["end"] = min(self.clip["end"], self.written)
+                self.clip["stopped"] = True
+        if not self._running:
+            self._finish_clip()
+        return self.status()
+
+    def _finish_clip(self):
+        """
+        Takes the finished clip out of the ring buffer and queues its encoding.
+        """
+        with self.lock:
+            clip, self.clip = self.clip, None
+            if clip is None:
+                return
+            end = min(clip["end"], self.written)
+            samples = self._read(clip["start"], end)
+            path = self._unique_path(clip["started"])
+            self.reserved.add(path)
+        if len(samples) == 0:
+            self.reserved.discard(path)
+            return
+        try:
+            self.jobs.submit("audio", path, self._encode, samples, path)
+        except queue.Full:
+            self.reserved.discard(path)
+            logger("The audio encoding queue is full, the clip was dropped.", code="WARNING")
+
+    def _unique_path(self, started: datetime) -> str:
+        """
+        Returns a clip path which is not used by a stored or pending clip.
+        """
+        extension = CODECS[self.codec][0]
+        base = os.path.join(self.directory, f"cam_{started:%Y-%m-%d_%H-%M-%S}")
+        path = f"{base}.{extension}"
+        index = 1
+        while path in self.reserved or os.path.exists(path):
+            path = f"{base}_{index}.{extension}"
+            index += 1
+        return path
+
+    def _encode(self, samples: np.ndarray, path: str):
+        """
+        Writes a clip in the configured format.
+        """
+        try:
+            arguments = CODECS[self.codec][1]
+            if arguments is None:
+                with wave.open(path, "wb") as fp:
+                    fp.setnchannels(self.source.channels)
+                    fp.setsampwidth(self.source.dtype.itemsize)
+                    fp.setframerate(self.source.rate)
+                    fp.writeframes(samples.tobytes())
+            else:
+                command = [
+                    "ffmpeg", "-y", "-loglevel", "error",
+                    "-f", self.source.sample_format[:3].lower() + "le",
+                    "-ar", str(self.source.rate), "-ac", str(self.source.channels),
+                    "-i", "pipe:0", *arguments, path
+                ]
+                process = subprocess.run(command, input=samples.tobytes(), stderr=subprocess.PIPE)
+                if process.returncode != 0:
+                    raise RuntimeError(process.stderr.decode(errors="replace").strip())
+        finally:
+            self.reserved.discard(path)
+        self.clips += 1
+        duration = len(samples) / self.source.rate
+        logger(f"Stored the sound clip {os.path.basename(path)} ({duration:.1f} s).", code="SUCCESS")
+        if self.on_saved is not None:
+            self.on_saved(path, duration)
+
+    def status(self) -> dict:
+        """
+        Returns the recording state.
+
+        Returns
+        -------
+            status: dict
+                Whether the capture is running and a clip is recorded,
+                the length and reason of the clip, the latest sound
+                level and the number of stored clips.
+        """
+        with self.lock:
+            clip = self.clip
+            return {
+                "running": self._running,
+                "recording": clip is not None,
+                "reason": clip["reason"] if clip else None,
+                "seconds": (self.written - clip["start"]) / self.source.rate if clip else 0,
+                "remaining": max(0, clip["end"] - self.written) / self.source.rate if clip else 0,
+                "level_db": self.level_db,
+                "trigger_db": self.trigger_db,
+                "clips": self.clips,
+                "codec": self.codec,
+            }
@@ -0,0 +1,270 @@
+from typing import Optional
+import numpy as np
+import subprocess
+import wave
+import time
+
+# The sample formats of arecord and their NumPy types.
+SAMPLE_FORMATS = {
+    "S16_LE": np.dtype("<i2"),
+    "S32_LE": np.dtype("<i4"),
+}
+
+class AudioSource:
+    """
+    Base class of the audio sources feeding the audio service. A source
+    returns blocks of interleaved integer samples as NumPy arrays of
+    shape (frames, channels).
+
+    Parameters
+    ----------
+        rate: int
+            The sample rate in Hz.
+
+        channels: int
+            The number of channels.
+
+        sample_format: str
+            The sample format, "S16_LE" or "S32_LE".
+    """
+    def __init__(self, rate: int=48000, channels: int=2, sample_format: str="S32_LE") -> None:
+        if sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f"Unsupported sample format: {sample_format}")
+        self.rate = rate
+        self.channels = channels
+        self.sample_format = sample_format
+        self.dtype = SAMPLE_FORMATS[sample_format]
+
+    # Specify whether the source is started again after it failed.
+    restartable = False
+
+    @property
+    def full_scale(self) -> float:
+        """
+        The largest amplitude of a sample.
+        """
+        return float(np.iinfo(self.dtype).max)
+
+    def start(self):
+        """
+        Starts producing samples.
+        """
+        pass
+
+    def read(self, frames: int) -> np.ndarray:
+        """
+        Waits for the next block of samples.
+
+        Parameters
+        ----------
+            frames: int
+                The number of frames (samples per channel) to read.
+
+        Returns
+        -------
+            block: np.ndarray
+                The samples of shape (frames, channels).
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Releases any resources held by the source.
+        """
+        pass
+
+class AlsaSource(AudioSource):
+    """
+    Captures an ALSA device with a single long-running arecord process
+    writing raw samples to a pipe.
+
+    Parameters
+    ----------
+        device: str
+            The ALSA device, i.e. "dmic_sv".
+
+        rate: int
+            The sample rate in Hz.
+
+        channels: int
+            The number of channels.
+
+        sample_format: str
+            The sample format, "S16_LE" or "S32_LE".
+    """
+    def __init__(
+            self,
+            device: str="dmic_sv",
+            rate: int=48000,
+            channels: int=2,
+            sample_format: str="S32_LE"
+        ) -> None:
+
+        super().__init__(rate, channels, sample_format)
+        self.device = device
+        self.process: Optional[subprocess.Popen] = None
+
+    restartable = True
+
+    def start(self):
+        """
+        Starts arecord.
+        """
+        self.process = subprocess.Popen(
+            ["arecord", "-q", "-D", self.device, "-f", self.sample_format,
+             "-c", str(self.channels), "-r", str(self.rate), "-t", "raw"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def read(self, frames: int) -> np.ndarray:
+        size = frames * self.channels * self.dtype.itemsize
+        data = self.process.stdout.read(size)
+        if len(data) < size:
+            raise EOFError("The audio capture stopped.")
+        return np.frombuffer(data, dtype=self.dtype).reshape(-1, self.channels)
+
+    def close(self):
+        """
+        Stops arecord.
+        """
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+class _PacedAudioSource(AudioSource):
+    """
+    Base class of the sources which return blocks in real time.
+    """
+    def __init__(self, rate: int, channels: int, sample_format: str) -> None:
+        super().__init__(rate, channels, sample_format)
+        self._next_time = None
+
+    def _pace(self, frames: int):
+        """
+        Sleeps until the block of frames is due.
+        """
+        now = time.monotonic()
+        if self._next_time is None or self._next_time < now:
+            self._next_time = now
+        else:
+            time.sleep(self._next_time - now)
+        self._next_time += frames / self.rate
+
+class WavSource(_PacedAudioSource):
+    """
+    Replays a 16 or 32 bit PCM WAV file in real time to run the audio
+    service without a microphone.
+
+    Parameters
+    ----------
+        path: str
+            The WAV file.
+
+        loop: bool
+            Specify whether to restart at the end of the file.
+    """
+    def __init__(self, path: str, loop: bool=True) -> None:
+        with wave.open(path, "rb") as fp:
+            widths = {2: "S16_LE", 4: "S32_LE"}
+            if fp.getsampwidth() not in widths:
+                raise ValueError(f"Unsupported WAV sample width: {fp.getsampwidth()}")
+            super().__init__(fp.getframerate(), fp.getnchannels(), widths[fp.getsampwidth()])
+            data = fp.readframes(fp.getnframes())
+        self.samples = np.frombuffer(data, dtype=self.dtype).reshape(-1, self.channels)
+        self.loop = loop
+        self.position = 0
+
+    def read(self, frames: int) -> np.ndarray:
+        if self.position >= len(self.samples):
+            if not self.loop:
+                raise EOFError("No more samples in the recording.")
+            self.position = 0
+        block = self.samples[self.position:self.position + frames]
+        self.position += len(block)
+        self._pace(len(block))
+        return block
+
+class SyntheticSource(_PacedAudioSource):
+    """
+    Generates low level noise with a tone burst at a regular interval.
+
+    Parameters
+    ----------
+        rate: int
+            The sample rate in Hz.
+
+        channels: int
+            The number of channels.
+
+        sample_format: str
+            The sample format, "S16_LE" or "S32_LE".
+
+        period: float
+            The time in seconds between the starts of the bursts.
+
+        burst: float
+            The duration in seconds of each burst.
+
+        frequency: float
+            The frequency in Hz of the tone.
+
+        seed: int
+            The seed of the noise.
+    """
+    def __init__(
+            self,
+            rate: int=16000,
+            channels: int=1,
+            sample_format: str="S16_LE",
+            period: float=10.0,
+            burst: float=1.0,
+            frequency: float=440.0,
+            seed: int=0
+        ) -> None:
+
+        super().__init__(rate, channels, sample_format)
+        self.period = period
+        self.burst = burst
+        self.frequency = frequency
+        self.rng = np.random.default_rng(seed)
+        self.position = 0
+
+    def read(self, frames: int) -> np.ndarray:
+        t = (self.position + np.arange(frames)) / self.rate
+        signal = self.rng.normal(0, 0.003, frames)
+        loud = np.mod(t, self.period) < self.burst
+        signal += loud * 0.5 * np.sin(2 * np.pi * self.frequency * t)
+        block = np.clip(signal * self.full_scale, -self.full_scale, self.full_scale)
+        block = np.repeat(block[:, None], self.channels, axis=1).astype(self.dtype)
+        self.position += frames
+        self._pace(frames)
+        return block
+
+def audio_source_from_configuration(configuration: dict) -> AudioSource:
+    """
+    Creates an audio source from the "source" of the "audio" section
+    of the JSON configuration.
+
+    Parameters
+    ----------
+        configuration: dict
+            The source settings. The "type" key selects the source,
+            the remaining keys are passed to its constructor.
+
+    Returns
+    -------
+        source: AudioSource
+            The configured audio source.
+    """
+    settings = dict(configuration)
+    kind = settings.pop("type", "alsa")
+    sources = {
+        "alsa": AlsaSource,
+        "wav": WavSource,
+        "synthetic": SyntheticSource,
+    }
+    if kind not in sources:
+        raise ValueError(f"Unsupported audio source: {kind}")
+    return sources[kind](**settings)
@@ -0,0 +1,433 @@
+from surveillance.video.sources import ReplaySource, SyntheticSource
+from surveillance.video.motion import MotionDetector
+from surveillance.video.analysis import MotionProcess
+from surveillance.video.camera import Camera
+from PIL import Image, ImageChops, ImageFilter
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List
+import numpy as np
+import functools
+import argparse
+import tempfile
+import resource
+import time
+import io
+import os
+
+def synthetic_frames(width: int, height: int, count: int, seed: int=0) -> List[bytes]:
+    """
+    Generates JPEG frames of a noisy scene with a moving square.
+
+    Parameters
+    ----------
+        width: int
+            The width of the frames.
+
+        height: int
+            The height of the frames.
+
+        count: int
+            The number of frames to generate.
+
+        seed: int
+            The seed of the random noise.
+
+    Returns
+    -------
+        frames: List[bytes]
+            The JPEG encoded frames.
+    """
+    source = SyntheticSource(size=(width, height), frames=count, seed=seed)
+    return [frame for frame, _ in source.frames]
+
+def legacy_motion(frames: List[bytes]) -> List[int]:
+    """
+    The original Pillow motion pipeline: full resolution decode,
+    grayscale conversion, gaussian blur, ImageChops difference and
+    a Python lambda threshold.
+
+    Parameters
+    ----------
+        frames: List[bytes]
+            The JPEG encoded frames.
+
+    Returns
+    -------
+        counts: List[int]
+            The changed pixel counts per frame pair.
+    """
+    counts = []
+    previous = None
+    for frame in frames:
+        image = Image.open(io.BytesIO(frame))
+        current = image.convert('L').filter(ImageFilter.GaussianBlur(radius=2))
+        if previous is not None:
+            diff = ImageChops.difference(previous, current)
+            diff = diff.point(lambda x: x > 40 and 255)
+            counts.append(int(np.sum(np.array(diff) > 0)))
+        previous = current
+    return counts
+
+def engine_motion(frames: List[bytes], detector: MotionDetector) -> List[int]:
+    """
+    The vectorized motion pipeline used by the camera.
+
+    Parameters
+    ----------
+        frames: List[bytes]
+            The JPEG encoded frames.
+
+        detector: MotionDetector
+            The motion detection engine.
+
+    Returns
+    -------
+        counts: List[int]
+            The changed pixel counts per frame pair.
+    """
+    counts = []
+    previous = None
+    for frame in frames:
+        current = detector.prepare(detector.luma_from_jpeg(frame))
+        if previous is not None:
+            counts.append(detector.changed_pixels(previous, current))
+        previous = current
+    return counts
+
+def measure(function: Callable, repeat: int) -> float:
+    """
+    Returns the best wall time of several runs.
+
+    Parameters
+    ----------
+        function: Callable
+            The function to time.
+
+        repeat: int
+            The number of runs.
+
+    Returns
+    -------
+        seconds: float
+            The fastest run in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def benchmark_motion(args: argparse.Namespace):
+    """
+    Compares the legacy Pillow pipeline against the vectorized engine.
+    """
+    height, width = args.resolution
+    frames = synthetic_frames(width, height, args.frames)
+    detector = MotionDetector(
+        analysis_size=tuple(args.analysis_size) if args.analysis_size else None,
+        blur=None if args.blur == "none" else args.blur,
+    )
+    legacy = measure(lambda: legacy_motion(frames), args.repeat)
+    engine = measure(lambda: engine_motion(frames, detector), args.repeat)
+    n = len(frames)
+    print(f"frames: {n} at {width}x{height}, analysis size: {detector.analysis_size}")
+    print(f"legacy: {1000 * legacy / n:8.3f} ms/frame  {n / legacy:8.1f} fps")
+    print(f"engine: {1000 * engine / n:8.3f} ms/frame  {n / engine:8.1f} fps")
+    print(f"speedup: {legacy / engine:.1f}x")
+
+def timed(function: Callable, samples: List[float]) -> Callable:
+    """
+    Wraps a function to record the duration of each call.
+
+    Parameters
+    ----------
+        function: Callable
+            The function to wrap.
+
+        samples: List[float]
+            The list receiving the durations in seconds.
+
+    Returns
+    -------
+        wrapper: Callable
+            The timed function.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+    return wrapper
+
+def report_stages(stages: Dict[str, List[float]]):
+    """
+    Prints the latency percentiles of each stage in milliseconds.
+
+    Parameters
+    ----------
+        stages: Dict[str, List[float]]
+            The durations in seconds of each stage.
+    """
+    print(f"{'stage':<10}{'calls':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for name, samples in stages.items():
+        if not samples:
+            continue
+        p50, p90, p99, peak = 1000 * np.percentile(samples, [50, 90, 99, 100])
+        print(f"{name:<10}{len(samples):>8}{p50:>10.3f}{p90:>10.3f}{p99:>10.3f}{peak:>10.3f}")
+
+def benchmark_pipeline(args: argparse.Namespace):
+    """
+    Drives Camera.get_frame and Camera.detect_motion from a replayed
+    or synthetic frame source and reports the throughput, the latency
+    percentiles of each stage and the peak memory usage.
+    """
+    height, width = args.resolution
+    motion = MotionDetector(analysis_size=tuple(args.analysis_size))
+    if args.replay:
+        source = ReplaySource(
+            args.replay, size=(width, height), lores_size=motion.analysis_size, fps=args.fps)
+    else:
+        source = SyntheticSource(
+            size=(width, height), lores_size=motion.analysis_size, fps=args.fps)
+
+    stages = {name: [] for name in ("capture", "luma", "prepare", "detect", "total")}
+    with tempfile.TemporaryDirectory() as directory:
+        camera = Camera(
+            encoder=None,
+            output=None,
+            images_directory=directory,
+            credentials=None,
+            width=width,
+            height=height,
+            motion=motion,
+            source=source,
+        )
+        source.read_jpeg = timed(source.read_jpeg, stages["capture"])
+        source.read_luma = timed(source.read_luma, stages["luma"])
+        motion.prepare = timed(motion.prepare, stages["prepare"])
+        camera.detect_motion = timed(camera.detect_motion, stages["detect"])
+        get_frame = timed(camera.get_frame, stages["total"])
+
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            start = time.perf_counter()
+            for _ in range(args.frames):
+                get_frame()
+            elapsed = time.perf_counter() - start
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"frames: {args.frames} at {width}x{height}, analysis size: {motion.analysis_size}")
+    print(f"throughput: {args.frames / elapsed:.1f} frames/s")
+    report_stages(stages)
+    print(f"peak RSS: {peak_rss:.1f} MB")
+
+def run_frame_loop(camera: Camera, frames: int) -> Dict[str, float]:
+    """
+    Calls Camera.get_frame and measures the frame loop.
+
+    Parameters
+    ----------
+        camera: Camera
+            The camera to drive.
+
+        frames: int
+            The number of frames to process.
+
+    Returns
+    -------
+        measures: Dict[str, float]
+            The wall time and the CPU time of the calling process in seconds.
+    """
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        cpu = time.process_time()
+        for _ in range(frames):
+            camera.get_frame()
+        return {
+            "wall": time.perf_counter() - start,
+            "cpu": time.process_time() - cpu,
+        }
+
+def benchmark_analysis(args: argparse.Namespace):
+    """
+    Compares the motion analysis in the frame loop against the motion
+    process reading the shared memory ring, with the source paced at
+    the camera frame rate. The frames looped and the frames actually
+    analyzed per second are reported, since the process skips frames
+    while it is behind, with the latency from a frame to its result.
+    The CPU time is the time spent in the server process, which
+    competes with the requests.
+    """
+    height, width = args.resolution
+    configuration = {"analysis_size": tuple(args.analysis_size)}
+    results = {}
+    for mode in ("in-process", "process"):
+        motion = MotionDetector.from_configuration(configuration)
+        source = SyntheticSource(
+            size=(width, height), lores_size=motion.analysis_size, fps=args.fps)
+        motion_process = MotionProcess(configuration) if mode == "process" else None
+        latencies = []
+        with tempfile.TemporaryDirectory() as directory:
+            camera = Camera(
+                encoder=None,
+                output=None,
+                images_directory=directory,
+                credentials=None,
+                width=width,
+                height=height,
+                motion=motion,
+                source=source,
+                motion_process=motion_process,
+            )
+            if motion_process is None:
+                camera.detect_motion = timed(camera.detect_motion, latencies)
+                results[mode] = run_frame_loop(camera, args.frames)
+                results[mode]["analyzed"] = len(latencies)
+                results[mode]["skipped"] = 0
+                results[mode]["latency"] = latencies
+                continue
+
+            # The worker startup is not part of the measure.
+            camera.get_frame()
+            while motion_process.pending:
+                motion_process.collect(timeout=30)
+            first = motion_process.sequence
+            skipped = motion_process.skipped
+            submitted = {}
+            submit, collect = motion_process.submit, motion_process.collect
+
+            def timed_submit(luma):
+                sequence = submit(luma)
+                if sequence is not None:
+                    submitted[sequence] = time.perf_counter()
+                return sequence
+
+            def timed_collect(timeout=None):
+                collected = collect(timeout)
+                now = time.perf_counter()
+                for sequence, _ in collected:
+                    latencies.append(now - submitted.pop(sequence))
+                return collected
+
+            motion_process.submit, motion_process.collect = timed_submit, timed_collect
+            results[mode] = run_frame_loop(camera, args.frames)
+            # The frames still in the ring are analyzed within the measure.
+            start = time.perf_counter()
+            while motion_process.pending:
+                timed_collect(timeout=30)
+            results[mode]["wall"] += time.perf_counter() - start
+            results[mode]["analyzed"] = motion_process.sequence - first
+            results[mode]["skipped"] = motion_process.skipped - skipped
+            results[mode]["latency"] = latencies
+            motion_process.close()
+
+    print(f"frames: {args.frames} at {width}x{height}, analysis size: {tuple(args.analysis_size)}, "
+          f"source: {f'{args.fps:g} fps' if args.fps else 'unlimited'}")
+    print(f"{'mode':<12}{'frames/s':>10}{'analyzed/s':>12}{'skipped':>9}"
+          f"{'cpu ms/frame':>14}{'p50 ms':>9}{'p90 ms':>9}")
+    for mode, measures in results.items():
+        p50, p90 = 1000 * np.percentile(measures["latency"] or [0], [50, 90])
+        print(f"{mode:<12}{args.frames / measures['wall']:>10.1f}"
+              f"{measures['analyzed'] / measures['wall']:>12.1f}{measures['skipped']:>9}"
+              f"{1000 * measures['cpu'] / args.frames:>14.3f}{p50:>9.2f}{p90:>9.2f}")
+
+def main():
+    """
+    Define the command line arguments and run a benchmark.
+    """
+    parser = argparse.ArgumentParser(
+        description=("Surveillance pipeline benchmarks"),
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    motion = subparsers.add_parser('motion',
+                        help="Compare the motion engine against the Pillow pipeline.")
+    motion.add_argument('-r', '--resolution',
+                        help="The resolution of the frames (height, width).",
+                        type=int, nargs=2,
+                        default=(600, 800),
+                    )
+    motion.add_argument('--analysis-size',
+                        help="The analysis resolution (width, height).",
+                        type=int, nargs=2,
+                        default=(320, 240),
+                    )
+    motion.add_argument('--blur',
+                        help="The smoothing filter of the engine.",
+                        choices=["box", "gaussian", "none"],
+                        default="box",
+                    )
+    motion.add_argument('--frames',
+                        help="The number of frames to process.",
+                        type=int,
+                        default=100,
+                    )
+    motion.add_argument('--repeat',
+                        help="The number of timed runs.",
+                        type=int,
+                        default=3,
+                    )
+    motion.set_defaults(function=benchmark_motion)
+
+    pipeline = subparsers.add_parser('pipeline',
+                        help="Measure the camera pipeline on a hardware-free source.")
+    pipeline.add_argument('-r', '--resolution',
+                        help="The resolution of the frames (height, width).",
+                        type=int, nargs=2,
+                        default=(600, 800),
+                    )
+    pipeline.add_argument('--analysis-size',
+                        help="The analysis resolution (width, height).",
+                        type=int, nargs=2,
+                        default=(320, 240),
+                    )
+    pipeline.add_argument('--replay',
+                        help="A directory of images, a glob or a video file to replay.\n"
+                             "Synthetic frames are generated if not provided.",
+                        type=str,
+                        default=None,
+                    )
+    pipeline.add_argument('--fps',
+                        help="The frame rate of the source. 0 is unlimited.",
+                        type=float,
+                        default=0,
+                    )
+    pipeline.add_argument('--frames',
+                        help="The number of frames to process.",
+                        type=int,
+                        default=300,
+                    )
+    pipeline.set_defaults(function=benchmark_pipeline)
+
+    analysis = subparsers.add_parser('analysis',
+                        help="Compare the motion analysis in the frame loop and in a process.")
+    analysis.add_argument('-r', '--resolution',
+                        help="The resolution of the frames (height, width).",
+                        type=int, nargs=2,
+                        default=(600, 800),
+                    )
+    analysis.add_argument('--analysis-size',
+                        help="The analysis resolution (width, height).",
+                        type=int, nargs=2,
+                        default=(320, 240),
+                    )
+    analysis.add_argument('--fps',
+                        help="The frame rate of the source. 0 is unlimited.",
+                        type=float,
+                        default=30,
+                    )
+    analysis.add_argument('--frames',
+                        help="The number of frames to process.",
+                        type=int,
+                        default=300,
+                    )
+    analysis.set_defaults(function=benchmark_analysis)
+
+    args = parser.parse_args()
+    args.function(args)
+
+if __name__ == '__main__':
+    main()
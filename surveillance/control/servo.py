@@ -0,0 +1,218 @@
+from typing import Optional
+from surveillance import logger
+import threading
+import queue
+import math
+import time
+
+class ServoController:
+    """
+    Owns a servo on a dedicated actuator thread. Requested positions are
+    queued and only the latest one is kept, so a burst of slider moves
+    results in a single movement towards the last position. The servo
+    moves to its target in small steps at a limited speed and is
+    detached once it was idle, so it does not hold or jitter.
+
+    Parameters
+    ----------
+        servo: gpiozero.Servo
+            The servo, i.e. Servo(17). Any object with a writable
+            "value" between -1 and 1, or None to detach, is accepted.
+
+        speed: float
+            The maximum speed in position units (-1 to 1) per second.
+
+        step_interval: float
+            The time in seconds between the steps of a movement.
+
+        idle_timeout: float
+            The time in seconds the servo holds its position after a
+            movement before it is detached.
+    """
+    def __init__(
+            self,
+            servo,
+            speed: float=2.0,
+            step_interval: float=0.02,
+            idle_timeout: float=1.0
+        ) -> None:
+
+        self.servo = servo
+        self.speed = speed
+        self.step_interval = step_interval
+        self.idle_timeout = idle_timeout
+        self.targets = queue.Queue()
+        # The position is unknown until the first movement.
+        self.position: Optional[float] = None
+        self.target: Optional[float] = None
+        self.attached = False
+        self.moves = 0
+        self.coalesced = 0
+        self._running = False
+        self._thread = None
+
+    @staticmethod
+    def from_configuration(configuration: dict) -> "ServoController":
+        """
+        Creates the controller of a gpiozero servo.
+
+        Parameters
+        ----------
+            configuration: dict
+                The "pin", "speed", "step_interval" and "idle_timeout"
+                of the servo.
+
+        Returns
+        -------
+            controller: ServoController
+                The controller, not started yet.
+        """
+        from gpiozero import Servo
+        servo = Servo(configuration.get("pin", 17))
+        servo.value = None
+        return ServoController(
+            servo,
+            speed=configuration.get("speed", 2.0),
+            step_interval=configuration.get("step_interval", 0.02),
+            idle_timeout=configuration.get("idle_timeout", 1.0),
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        """
+        Starts the actuator thread.
+        """
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="servo", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float=2.0):
+        """
+        Stops the actuator thread and detaches the servo.
+
+        Parameters
+        ----------
+            timeout: float
+                The time in seconds to wait for the thread.
+        """
+        if not self._running:
+            return
+        self._running = False
+        self.targets.put(None)
+        self._thread.join(timeout)
+
+    def move(self, value: float):
+        """
+        Requests a position without waiting for the movement.
+
+        Parameters
+        ----------
+            value: float
+                The position of the servo between -1 and 1. Values
+                outside of this range are clamped.
+
+        Raises
+        ------
+            ValueError
+                Raised if the position is not a number.
+        """
+        value = float(value)
+        if math.isnan(value):
+            raise ValueError("The servo position must be a number.")
+        self.targets.put(min(1.0, max(-1.0, value)))
+
+    def _latest(self, block: bool, timeout: Optional[float]=None) -> Optional[float]:
+        """
+        Takes the pending targets and returns the latest one,
+        or None if there is none.
+        """
+        try:
+            target = self.targets.get(block=block, timeout=timeout)
+        except queue.Empty:
+            return None
+        # A stop request (None) ends the coalescing.
+        while target is not None:
+            try:
+                newer = self.targets.get_nowait()
+            except queue.Empty:
+                break
+            self.coalesced += 1
+            target = newer
+        return target
+
+    def _run(self):
+        """
+        The actuator loop, which ramps the servo to the latest target
+        and detaches it once it was idle.
+        """
+        while self._running:
+            target = self._latest(block=True, timeout=self.idle_timeout if self.attached else None)
+            if target is None:
+                if self.attached:
+                    self._detach()
+                continue
+            self.target = target
+            self.moves += 1
+            try:
+                self._ramp()
+            except Exception as e:
+                logger(f"The servo could not move: {e}", code="WARNING")
+        if self.attached:
+            self._detach()
+
+    def _ramp(self):
+        """
+        Moves the servo to the target in steps limited by the speed,
+        following newer targets as soon as they arrive.
+        """
+        step = self.speed * self.step_interval
+        if self.position is None:
+            # The starting position is unknown, so there is nothing to ramp from.
+            self.position = self.target
+        while self._running:
+            distance = self.target - self.position
+            if abs(distance) > step:
+                self.position += math.copysign(step, distance)
+            else:
+                self.position = self.target
+            self.servo.value = self.position
+            self.attached = True
+            if self.position == self.target:
+                return
+            time.sleep(self.step_interval)
+            if not self.targets.empty():
+                target = self._latest(block=False)
+                if target is None:
+                    return
+                self.target = target
+
+    def _detach(self):
+        """
+        Stops driving the servo.
+        """
+        self.servo.value = None
+        self.attached = False
+
+    def status(self) -> dict:
+        """
+        Returns the state of the servo.
+
+        Returns
+        -------
+            status: dict
+                The position, the target, whether the servo is
+                attached and the number of movements and coalesced
+                requests.
+        """
+        return {
+            "position": self.position,
+            "target": self.target,
+            "attached": self.attached,
+            "moves": self.moves,
+            "coalesced": self.coalesced,
+        }
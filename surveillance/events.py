@@ -0,0 +1,414 @@
+from typing import Dict, List, Optional, Tuple
+from surveillance.media import MANIFEST
+from surveillance import logger
+import threading
+import sqlite3
+import atexit
+import json
+import time
+import os
+
+# The bucket sizes which can be given by name.
+BUCKETS = {
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "week": 604800,
+}
+
+# The length in seconds of the rollup rows.
+ROLLUP = 3600
+
+def media_name(path: str) -> str:
+    """
+    Returns the name under which a recording is listed once it is
+    finished: the mp4 file of an .h264 recording, or the directory
+    and manifest of a segmented recording.
+
+    Parameters
+    ----------
+        path: str
+            The path of the recording or picture.
+
+    Returns
+    -------
+        name: str
+            The name relative to its media directory.
+    """
+    if os.path.basename(path) == MANIFEST:
+        return f"{os.path.basename(os.path.dirname(path))}/{MANIFEST}"
+    if path.endswith(".h264"):
+        return os.path.basename(path)[:-len(".h264")] + ".mp4"
+    return os.path.basename(path)
+
+class EventLog:
+    """
+    An append-only SQLite log of the motion events. The motion results
+    of each camera are merged into a single open event until nothing
+    moved for quiet_period seconds, and the event is then appended with
+    its start, end, peak score, affected regions and media. The counts
+    of each hour are kept in a rollup table updated with each event, so
+    the buckets of a year are aggregated from a few thousand rows.
+
+    Parameters
+    ----------
+        database: str
+            The path to the SQLite database file.
+
+        quiet_period: float
+            The time in seconds without motion which ends an event.
+
+        max_duration: float
+            The maximum length in seconds of an event. Longer motion
+            is split into several events.
+
+        interval: float
+            The time in seconds between the checks for ended events.
+    """
+    def __init__(
+            self,
+            database: str,
+            quiet_period: float=10.0,
+            max_duration: float=600.0,
+            interval: float=1.0
+        ) -> None:
+
+        self.quiet_period = quiet_period
+        self.max_duration = max_duration
+        self.interval = interval
+        self.open: Dict[str, dict] = {}
+        self.appended = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY,
+                    camera TEXT NOT NULL,
+                    start REAL NOT NULL,
+                    end REAL NOT NULL,
+                    peak INTEGER NOT NULL,
+                    frames INTEGER NOT NULL,
+                    regions TEXT NOT NULL,
+                    bounds TEXT,
+                    media TEXT NOT NULL,
+                    alerted INTEGER NOT NULL DEFAULT 0
+                )
+                """)
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS events_time ON events (start, camera, end, peak)")
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS event_hours (
+                    hour REAL NOT NULL,
+                    camera TEXT NOT NULL,
+                    events INTEGER NOT NULL,
+                    seconds REAL NOT NULL,
+                    peak INTEGER NOT NULL,
+                    PRIMARY KEY (hour, camera)
+                )
+                """)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the thread appending the ended events. The open events
+        are appended when the application exits.
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="events", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout: float=2.0):
+        """
+        Stops the thread and appends the open events.
+
+        Parameters
+        ----------
+            timeout: float
+                The time in seconds to wait for the thread.
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush(float("inf"))
+
+    def _run(self):
+        """
+        The loop appending the events once they ended.
+        """
+        while self._running:
+            try:
+                self.flush(time.time())
+            except Exception as e:
+                logger(f"The motion events could not be stored: {e}", code="WARNING")
+            time.sleep(self.interval)
+
+    def motion(
+            self,
+            camera: str,
+            timestamp: float,
+            score: int,
+            regions: Optional[List[str]]=None,
+            bounds: Optional[List[float]]=None,
+            media: Optional[List[str]]=None,
+            alerted: bool=False
+        ):
+        """
+        Adds a motion result to the open event of a camera, opening a
+        new event if there is none.
+
+        Parameters
+        ----------
+            camera: str
+                The identifier of the camera.
+
+            timestamp: float
+                The epoch time of the motion.
+
+            score: int
+                The motion score of the frame.
+
+            regions: List[str]
+                The names of the regions of interest affected.
+
+            bounds: List[float]
+                The normalized [left, top, right, bottom] box of the motion.
+
+            media: List[str]
+                The paths of the recordings or pictures of the motion.
+
+            alerted: bool
+                Specify whether an alert was sent for the motion.
+        """
+        with self.lock:
+            event = self.open.get(camera)
+            if event is not None and timestamp - event["start"] >= self.max_duration:
+                self._append(self.open.pop(camera))
+                event = None
+            if event is None:
+                event = {
+                    "camera": camera,
+                    "start": timestamp,
+                    "end": timestamp,
+                    "peak": 0,
+                    "frames": 0,
+                    "regions": [],
+                    "bounds": None,
+                    "media": [],
+                    "alerted": False,
+                }
+                self.open[camera] = event
+            event["end"] = max(event["end"], timestamp)
+            event["peak"] = max(event["peak"], int(score))
+            event["frames"] += 1
+            event["alerted"] = event["alerted"] or alerted
+            for name in regions or []:
+                if name not in event["regions"]:
+                    event["regions"].append(name)
+            for path in media or []:
+                name = media_name(path)
+                if name not in event["media"]:
+                    event["media"].append(name)
+            if bounds is not None:
+                current = event["bounds"]
+                event["bounds"] = list(bounds) if current is None else [
+                    min(current[0], bounds[0]), min(current[1], bounds[1]),
+                    max(current[2], bounds[2]), max(current[3], bounds[3]),
+                ]
+
+    def flush(self, now: float) -> int:
+        """
+        Appends the open events which ended before a time.
+
+        Parameters
+        ----------
+            now: float
+                The current time, infinite to append every open event.
+
+        Returns
+        -------
+            appended: int
+                The number of events appended.
+        """
+        with self.lock:
+            ended = [
+                camera for camera, event in self.open.items()
+                if now - event["end"] >= self.quiet_period
+            ]
+            for camera in ended:
+                self._append(self.open.pop(camera))
+        return len(ended)
+
+    def _append(self, event: dict):
+        """
+        Appends an event. The lock must be held.
+        """
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO events (camera, start, end, peak, frames, regions, bounds, media, alerted) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (event["camera"], event["start"], event["end"], event["peak"], event["frames"],
+                 json.dumps(event["regions"]),
+                 None if event["bounds"] is None else json.dumps(event["bounds"]),
+                 json.dumps(event["media"]), int(event["alerted"])))
+            self.connection.execute(
+                "INSERT INTO event_hours (hour, camera, events, seconds, peak) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT (hour, camera) DO UPDATE SET events = events + 1, "
+                "seconds = seconds + excluded.seconds, peak = MAX(peak, excluded.peak)",
+                (event["start"] // ROLLUP * ROLLUP, event["camera"],
+                 event["end"] - event["start"], event["peak"]))
+        self.appended += 1
+
+    def _filters(
+            self,
+            start: float,
+            end: float,
+            camera: Optional[str],
+            column: str="start"
+        ) -> Tuple[str, list]:
+        """
+        Builds the WHERE clause of a time range.
+        """
+        clauses, parameters = [f"{column} >= ?", f"{column} < ?"], [start, end]
+        if camera is not None:
+            clauses.append("camera = ?")
+            parameters.append(camera)
+        return " AND ".join(clauses), parameters
+
+    def query(
+            self,
+            start: float,
+            end: float,
+            camera: Optional[str]=None,
+            limit: int=100
+        ) -> Tuple[List[dict], int]:
+        """
+        Lists the stored events which started within a time range.
+
+        Parameters
+        ----------
+            start: float
+                The epoch time from which the events are listed.
+
+            end: float
+                The epoch time before which the events are listed.
+
+            camera: str
+                Only list the events of this camera if provided.
+
+            limit: int
+                The maximum number of events, the most recent first.
+
+        Returns
+        -------
+            events: List[dict]
+                The stored events.
+
+            total: int
+                The number of events within the time range.
+        """
+        where, parameters = self._filters(start, end, camera)
+        with self.lock:
+            total = self.connection.execute(
+                f"SELECT COUNT(*) FROM events WHERE {where}", parameters).fetchone()[0]
+            rows = self.connection.execute(
+                "SELECT id, camera, start, end, peak, frames, regions, bounds, media, alerted "
+                f"FROM events WHERE {where} ORDER BY start DESC LIMIT ?",
+                parameters + [limit]).fetchall()
+        events = [
+            {
+                "id": i, "camera": c, "start": s, "end": e, "peak": p, "frames": f,
+                "regions": json.loads(r), "bounds": None if b is None else json.loads(b),
+                "media": json.loads(m), "alerted": bool(a),
+            }
+            for i, c, s, e, p, f, r, b, m, a in rows
+        ]
+        return events, total
+
+    def buckets(
+            self,
+            start: float,
+            end: float,
+            size: float,
+            camera: Optional[str]=None
+        ) -> List[dict]:
+        """
+        Aggregates the events of a time range into buckets of equal size.
+        The hourly rollup is used for the whole hours of the range when
+        the start and the size of the buckets are whole hours, and the
+        events of a partial last hour are aggregated from the log.
+
+        Parameters
+        ----------
+            start: float
+                The epoch time at which the first bucket starts.
+
+            end: float
+                The epoch time at which the last bucket ends.
+
+            size: float
+                The length of the buckets in seconds.
+
+            camera: str
+                Only count the events of this camera if provided.
+
+        Returns
+        -------
+            buckets: List[dict]
+                The "start" of each bucket, the number of "events" which
+                started within it, their total length in "seconds" and
+                their "peak" score. Buckets without events are included.
+        """
+        events_query = (
+            "SELECT CAST((start - ?) / ? AS INTEGER) AS bucket, COUNT(*), "
+            "SUM(end - start), MAX(peak) FROM events WHERE {} GROUP BY bucket")
+        queries = []
+        if start % ROLLUP == 0 and size % ROLLUP == 0:
+            hours_end = max(start, end // ROLLUP * ROLLUP)
+            where, parameters = self._filters(start, hours_end, camera, column="hour")
+            queries.append((
+                "SELECT CAST((hour - ?) / ? AS INTEGER) AS bucket, SUM(events), "
+                f"SUM(seconds), MAX(peak) FROM event_hours WHERE {where} GROUP BY bucket",
+                parameters))
+            if hours_end < end:
+                where, parameters = self._filters(hours_end, end, camera)
+                queries.append((events_query.format(where), parameters))
+        else:
+            where, parameters = self._filters(start, end, camera)
+            queries.append((events_query.format(where), parameters))
+        counts = {}
+        with self.lock:
+            for query, parameters in queries:
+                rows = self.connection.execute(query, [start, size] + parameters).fetchall()
+                for bucket, count, seconds, peak in rows:
+                    total = counts.get(bucket, (0, 0.0, 0))
+                    counts[bucket] = (total[0] + count, total[1] + seconds, max(total[2], peak))
+        buckets = []
+        for index in range(int(-(-(end - start) // size))):
+            count, seconds, peak = counts.get(index, (0, 0.0, 0))
+            buckets.append({
+                "start": start + index * size,
+                "events": count,
+                "seconds": round(seconds, 1),
+                "peak": peak,
+            })
+        return buckets
+
+    def current(self) -> List[dict]:
+        """
+        Returns the events which did not end yet.
+
+        Returns
+        -------
+            events: List[dict]
+                The open event of each camera with motion.
+        """
+        with self.lock:
+            return [
+                dict(event, regions=list(event["regions"]), media=list(event["media"]))
+                for event in self.open.values()
+            ]
@@ -0,0 +1,192 @@
+from typing import Callable, Dict, List, Optional
+from collections import deque
+from surveillance import logger
+import threading
+import itertools
+import queue
+import time
+
+class Job:
+    """
+    A unit of background work and its status.
+
+    Parameters
+    ----------
+        kind: str
+            The type of work, i.e. "transcode".
+
+        target: str
+            The file or resource the job works on.
+
+        function: Callable
+            The function to run.
+
+        args: tuple
+            The arguments passed to the function.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, kind: str, target: str, function: Callable, args: tuple=()) -> None:
+        self.id = next(Job._ids)
+        self.kind = kind
+        self.target = target
+        self.function = function
+        self.args = args
+        self.status = "pending"
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self) -> dict:
+        """
+        Returns the JSON serializable status of the job.
+
+        Returns
+        -------
+            status: dict
+                The job id, kind, target, status, error and times.
+        """
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "target": self.target,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+class JobQueue:
+    """
+    A bounded queue of jobs run by a fixed pool of worker threads.
+
+    Parameters
+    ----------
+        workers: int
+            The number of jobs run concurrently.
+
+        max_pending: int
+            The maximum number of jobs waiting to run. Submitting
+            to a full queue raises queue.Full.
+
+        history: int
+            The number of finished jobs kept for the status listing.
+
+        name: str
+            The name prefix of the worker threads.
+    """
+    def __init__(
+            self,
+            workers: int=1,
+            max_pending: int=32,
+            history: int=100,
+            name: str="jobs"
+        ) -> None:
+
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.active: Dict[int, Job] = {}
+        self.finished = deque(maxlen=history)
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in range(max(1, workers)):
+            thread = threading.Thread(
+                target=self._work, name=f"{name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, kind: str, target: str, function: Callable, *args, block: bool=False) -> Job:
+        """
+        Queues a job.
+
+        Parameters
+        ----------
+            kind: str
+                The type of work.
+
+            target: str
+                The file or resource the job works on.
+
+            function: Callable
+                The function to run.
+
+            args: tuple
+                The arguments passed to the function.
+
+            block: bool
+                Specify whether to wait for room in a full queue
+                instead of raising queue.Full.
+
+        Returns
+        -------
+            job: Job
+                The queued job.
+        """
+        job = Job(kind, target, function, args)
+        with self.lock:
+            self.active[job.id] = job
+        try:
+            self.queue.put(job, block=block)
+        except queue.Full:
+            with self.lock:
+                del self.active[job.id]
+            raise
+        return job
+
+    def _work(self):
+        """
+        The worker loop running the queued jobs.
+        """
+        while True:
+            job = self.queue.get()
+            job.status = "running"
+            job.started = time.time()
+            try:
+                job.function(*job.args)
+                job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                logger(f"The {job.kind} job for {job.target} failed: {e}", code="WARNING")
+            job.finished = time.time()
+            with self.lock:
+                self.active.pop(job.id, None)
+                self.finished.append(job)
+            self.queue.task_done()
+
+    def pending(self, kind: Optional[str]=None) -> List[Job]:
+        """
+        Lists the jobs which are waiting or running.
+
+        Parameters
+        ----------
+            kind: str
+                Only list the jobs of this type if provided.
+
+        Returns
+        -------
+            jobs: List[Job]
+                The unfinished jobs.
+        """
+        with self.lock:
+            return [j for j in self.active.values() if kind is None or j.kind == kind]
+
+    def jobs(self) -> List[dict]:
+        """
+        Returns the status of the unfinished and recently finished jobs.
+
+        Returns
+        -------
+            jobs: List[dict]
+                The job statuses, most recent first.
+        """
+        with self.lock:
+            jobs = list(self.active.values()) + list(self.finished)
+        return [job.to_dict() for job in sorted(jobs, key=lambda j: j.id, reverse=True)]
+
+    def join(self):
+        """
+        Blocks until every queued job has finished.
+        """
+        self.queue.join()
@@ -0,0 +1,257 @@
+from typing import Dict, List, Optional, TextIO, Tuple
+from datetime import datetime
+import threading
+import queue
+import json
+import time
+import sys
+import os
+
+LEVELS = {
+    "DEBUG": 10,
+    "INFO": 20,
+    "SUCCESS": 25,
+    "WARNING": 30,
+    "ERROR": 40,
+}
+
+class LogWriter:
+    """
+    Writes log records from a background thread, so logging never blocks
+    the frame loop on the terminal or the disk. Records wait in a bounded
+    queue and are dropped, and counted, when it is full. A message logged
+    again within repeat_window seconds is not written again, instead a
+    single "repeated N times" summary follows once the window is over.
+    The writer must be closed to write the last records and summaries.
+
+    Parameters
+    ----------
+        level: str
+            The lowest level written, i.e. "INFO".
+
+        json_format: bool
+            Specify whether to write one JSON object per line instead
+            of the plain text format.
+
+        path: str
+            The log file. Only the terminal is written if None.
+
+        max_bytes: int
+            The size of the log file after which it is rotated.
+
+        backups: int
+            The number of rotated log files kept.
+
+        console: bool
+            Specify whether to write to the terminal.
+
+        queue_size: int
+            The maximum number of records waiting to be written.
+
+        repeat_window: float
+            The time in seconds during which repeated messages are
+            suppressed. Every record is written if 0.
+    """
+    def __init__(
+            self,
+            level: str="INFO",
+            json_format: bool=False,
+            path: Optional[str]=None,
+            max_bytes: int=10 * 1024 * 1024,
+            backups: int=3,
+            console: bool=True,
+            queue_size: int=1000,
+            repeat_window: float=10.0
+        ) -> None:
+
+        self.level = LEVELS.get(level.upper(), LEVELS["INFO"])
+        self.json_format = json_format
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.console = console
+        self.repeat_window = repeat_window
+        self.queue = queue.Queue(maxsize=queue_size)
+        # The time each recent message was written and its suppressed repeats.
+        self.recent: Dict[Tuple[str, str], List[float]] = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.file: Optional[TextIO] = None
+        self.closed = False
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def log(self, message: str, code: str="INFO"):
+        """
+        Queues a record without waiting for it to be written.
+
+        Parameters
+        ----------
+            message: str
+                The message to log.
+
+            code: str
+                The level of the message.
+        """
+        code = code.upper()
+        if LEVELS.get(code, LEVELS["INFO"]) < self.level:
+            return
+        now = time.monotonic()
+        if self.repeat_window > 0:
+            key = (code, message)
+            with self.lock:
+                entry = self.recent.get(key)
+                if entry is not None and now - entry[0] < self.repeat_window:
+                    entry[1] += 1
+                    return
+                self.recent[key] = [now, 0]
+        self._put((time.time(), code, message, threading.current_thread().name, 0))
+
+    def _put(self, record: tuple):
+        """
+        Queues a record, starting the writer on first use.
+        """
+        if self.closed:
+            return
+        if self._thread is None:
+            with self.lock:
+                if self._thread is None and not self.closed:
+                    self._thread = threading.Thread(target=self._run, name="logger", daemon=True)
+                    self._thread.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def _run(self):
+        """
+        The writer loop, which also writes the summaries of the
+        suppressed repeats. The queued records are written once the
+        writer is closed.
+        """
+        while not self._stopping.is_set():
+            try:
+                record = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                record = None
+            if record is not None:
+                self._write(record)
+            self._summarize(time.monotonic())
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self._write(record)
+
+    def _summarize(self, now: float):
+        """
+        Writes the summaries of the repeated messages whose window is
+        over and the number of records dropped.
+        """
+        summaries = []
+        with self.lock:
+            for key, (written, repeats) in list(self.recent.items()):
+                if now - written < self.repeat_window:
+                    continue
+                del self.recent[key]
+                if repeats:
+                    summaries.append((time.time(), key[0], key[1], "logger", int(repeats)))
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            summaries.append((
+                time.time(), "WARNING", f"{dropped} log records were dropped.", "logger", 0))
+        for record in summaries:
+            self._write(record)
+
+    def format(self, record: tuple) -> str:
+        """
+        Formats a record as a line of text or JSON.
+
+        Parameters
+        ----------
+            record: tuple
+                The time, the level, the message, the thread name and
+                the number of suppressed repeats.
+
+        Returns
+        -------
+            line: str
+                The formatted record without the line ending.
+        """
+        timestamp, code, message, thread, repeated = record
+        if self.json_format:
+            entry = {
+                "time": datetime.fromtimestamp(timestamp).isoformat(),
+                "level": code,
+                "message": message,
+                "thread": thread,
+            }
+            if repeated:
+                entry["repeated"] = repeated
+            return json.dumps(entry)
+        if repeated:
+            message = f"{message} (repeated {repeated} times)"
+        return f"\t - [{code}]: {message}"
+
+    def _write(self, record: tuple):
+        """
+        Writes a record to the terminal and the log file.
+        """
+        line = self.format(record)
+        try:
+            if self.console:
+                sys.stdout.write(line + "\n")
+                sys.stdout.flush()
+            if self.path is not None:
+                self._write_file(line + "\n")
+        except Exception:
+            # Logging must never stop the writer.
+            pass
+
+    def _write_file(self, text: str):
+        """
+        Appends to the log file, rotating it once it exceeds max_bytes.
+        """
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+        size = len(text.encode("utf-8"))
+        if self.file.tell() + size > self.max_bytes and self.file.tell() > 0:
+            self.file.close()
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            if self.backups > 0:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
+            self.file = open(self.path, "a", encoding="utf-8")
+        self.file.write(text)
+        self.file.flush()
+
+    def close(self, timeout: float=2.0):
+        """
+        Stops the writer thread once the queued records are written,
+        writes the pending summaries and closes the log file. Records
+        logged afterwards are discarded.
+
+        Parameters
+        ----------
+            timeout: float
+                The maximum time in seconds to wait for the thread.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                # The thread still owns the file and the terminal.
+                return
+        self._summarize(float("inf"))
+        if self.file is not None:
+            self.file.close()
+            self.file = None
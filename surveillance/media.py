@@ -0,0 +1,467 @@
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from datetime import datetime
+import threading
+import sqlite3
+import shutil
+import os
+
+MEDIA_EXTENSIONS = {
+    "image": ('.jpg', '.jpeg', '.png'),
+    "video": ('.mp4', '.m3u8'),
+    "sound": ('.wav', '.flac', '.opus'),
+}
+
+# Segmented recordings are stored in a directory holding this manifest.
+MANIFEST = "index.m3u8"
+
+SORT_COLUMNS = ("timestamp", "name", "size", "duration")
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a time filter given as epoch seconds or an ISO 8601 date.
+
+    Parameters
+    ----------
+        value: str
+            The time to parse, i.e. "1718000000" or "2024-06-01T08:00".
+
+    Returns
+    -------
+        timestamp: float
+            The time as epoch seconds or None if no value was provided.
+    """
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+class MediaIndex:
+    """
+    A persistent SQLite index of the captured media files. The index is
+    reconciled with the directories once at startup and then updated
+    by the code paths creating and removing files, so listing the
+    media never scans the directories. Tables of other components keyed
+    by the name of a file, e.g. the activity index of the recordings,
+    can be attached so their rows are removed with the file.
+
+    Parameters
+    ----------
+        database: str
+            The path to the SQLite database file.
+
+        directories: dict
+            The directory of each media type, i.e. {"image":
+            images_directory, "video": videos_directory, "sound": sound_directory}.
+
+        probe: Callable[[str], Optional[float]]
+            Returns the duration in seconds of a video file. Called for
+            the videos added without a known duration.
+    """
+    def __init__(
+            self,
+            database: str,
+            directories: Dict[str, str],
+            probe: Optional[Callable[[str], Optional[float]]]=None
+        ) -> None:
+
+        self.directories = directories
+        self.probe = probe
+        self.dependents: Dict[str, List[str]] = {}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS media (
+                    type TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    timestamp REAL NOT NULL,
+                    duration REAL,
+                    protected INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (type, name)
+                )
+                """)
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info(media)")}
+            if "protected" not in columns:
+                self.connection.execute(
+                    "ALTER TABLE media ADD COLUMN protected INTEGER NOT NULL DEFAULT 0")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS media_time ON media (type, timestamp)")
+
+    def media_type(self, path: str) -> Optional[str]:
+        """
+        Determines the media type of a file from its directory
+        and extension. The manifest of a segmented recording is in
+        a subdirectory of the videos directory.
+
+        Parameters
+        ----------
+            path: str
+                The path to the file.
+
+        Returns
+        -------
+            type: str
+                The media type or None if the file is not indexed.
+        """
+        directory = os.path.realpath(os.path.dirname(path))
+        if os.path.basename(path) == MANIFEST:
+            directory = os.path.dirname(directory)
+        for kind, media_directory in self.directories.items():
+            if (os.path.realpath(media_directory) == directory and
+                path.lower().endswith(MEDIA_EXTENSIONS.get(kind, ()))):
+                return kind
+        return None
+
+    def path(self, kind: str, name: str) -> str:
+        """
+        Returns the path of an indexed file.
+
+        Parameters
+        ----------
+            kind: str
+                The media type.
+
+            name: str
+                The indexed name of the file.
+
+        Returns
+        -------
+            path: str
+                The path to the file.
+        """
+        return os.path.join(self.directories[kind], name)
+
+    def attach(self, kind: str, table: str):
+        """
+        Registers a table whose rows are removed with the files of a
+        media type. The table must be in the same database and have a
+        name column.
+
+        Parameters
+        ----------
+            kind: str
+                The media type of the files.
+
+            table: str
+                The name of the table.
+        """
+        if table not in self.dependents.setdefault(kind, []):
+            self.dependents[kind].append(table)
+
+    def _unlink(self, kind: str, names: List[str]):
+        """
+        Removes the rows of the attached tables for removed files.
+        The lock must be held within the transaction.
+        """
+        for table in self.dependents.get(kind, []):
+            self.connection.executemany(
+                f"DELETE FROM {table} WHERE name = ?", [(name,) for name in names])
+
+    def sync(self, kinds: Optional[List[str]]=None) -> Tuple[int, int]:
+        """
+        Reconciles the index with the files on disk. Files which are
+        not indexed yet are added and missing files are removed.
+
+        Parameters
+        ----------
+            kinds: List[str]
+                The media types to reconcile. All of them if None.
+
+        Returns
+        -------
+            added: int
+                The number of files added to the index.
+
+            removed: int
+                The number of entries removed from the index.
+        """
+        added = removed = 0
+        for kind, directory in self.directories.items():
+            if kinds is not None and kind not in kinds:
+                continue
+            with self.lock:
+                known = {name for name, in self.connection.execute(
+                    "SELECT name FROM media WHERE type = ?", (kind,))}
+            present = set()
+            for entry in os.scandir(directory):
+                if entry.is_dir():
+                    if os.path.exists(os.path.join(entry.path, MANIFEST)):
+                        present.add(f"{entry.name}/{MANIFEST}")
+                elif entry.name.lower().endswith(MEDIA_EXTENSIONS.get(kind, ())):
+                    present.add(entry.name)
+            for name in present - known:
+                if self.add(os.path.join(directory, name)):
+                    added += 1
+            missing = known - present
+            if missing:
+                with self.lock, self.connection:
+                    self.connection.executemany(
+                        "DELETE FROM media WHERE type = ? AND name = ?",
+                        [(kind, name) for name in missing])
+                    self._unlink(kind, list(missing))
+                removed += len(missing)
+        return added, removed
+
+    def add(self, path: str, duration: Optional[float]=None) -> bool:
+        """
+        Adds or updates a file in the index. An updated
+        file keeps its protection.
+
+        Parameters
+        ----------
+            path: str
+                The path to the file.
+
+            duration: float
+                The duration in seconds of a video, if known.
+
+        Returns
+        -------
+            added: bool
+                False if the file does not exist or is not a media file.
+        """
+        kind = self.media_type(path)
+        if kind is None:
+            return False
+        try:
+            if os.path.basename(path) == MANIFEST:
+                # The manifest is created with the first segment.
+                directory = os.path.dirname(path)
+                timestamp = os.stat(directory).st_mtime
+                size = sum(entry.stat().st_size for entry in os.scandir(directory))
+            else:
+                stat = os.stat(path)
+                timestamp, size = stat.st_mtime, stat.st_size
+        except OSError:
+            return False
+        if duration is None and kind == "video" and self.probe is not None:
+            duration = self.probe(path)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO media (type, name, size, timestamp, duration) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (type, name) DO UPDATE SET "
+                "size = excluded.size, timestamp = excluded.timestamp, "
+                "duration = excluded.duration",
+                (kind, self.name(path), size, timestamp, duration))
+        return True
+
+    def name(self, path: str) -> str:
+        """
+        Returns the indexed name of a file: its file name, or the
+        directory and manifest of a segmented recording.
+
+        Parameters
+        ----------
+            path: str
+                The path to the file.
+
+        Returns
+        -------
+            name: str
+                The name relative to its media directory.
+        """
+        if os.path.basename(path) == MANIFEST:
+            return f"{os.path.basename(os.path.dirname(path))}/{MANIFEST}"
+        return os.path.basename(path)
+
+    def remove(self, path: str) -> bool:
+        """
+        Removes a file from the index.
+
+        Parameters
+        ----------
+            path: str
+                The path to the file.
+
+        Returns
+        -------
+            removed: bool
+                True if the file was indexed.
+        """
+        kind = self.media_type(path)
+        if kind is None:
+            return False
+        name = self.name(path)
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM media WHERE type = ? AND name = ?", (kind, name))
+            self._unlink(kind, [name])
+        return cursor.rowcount > 0
+
+    def delete(self, path: str):
+        """
+        Deletes a file, or the directory of a segmented recording,
+        and removes it from the index.
+
+        Parameters
+        ----------
+            path: str
+                The path to the file.
+        """
+        if os.path.basename(path) == MANIFEST:
+            shutil.rmtree(os.path.dirname(path))
+        else:
+            os.remove(path)
+        self.remove(path)
+
+    def protect(self, path: str, protected: bool=True) -> bool:
+        """
+        Marks a file as protected from the retention policies.
+
+        Parameters
+        ----------
+            path: str
+                The path to the file.
+
+            protected: bool
+                Specify whether the file is protected.
+
+        Returns
+        -------
+            updated: bool
+                True if the file is indexed.
+        """
+        kind = self.media_type(path)
+        if kind is None:
+            return False
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE media SET protected = ? WHERE type = ? AND name = ?",
+                (int(protected), kind, self.name(path)))
+        return cursor.rowcount > 0
+
+    def usage(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the number of files and bytes used by each media type.
+
+        Returns
+        -------
+            usage: dict
+                The "files", "bytes" and "protected" bytes of each type.
+        """
+        usage = {kind: {"files": 0, "bytes": 0, "protected": 0} for kind in self.directories}
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT type, COUNT(*), SUM(size), SUM(size * protected) "
+                "FROM media GROUP BY type").fetchall()
+        for kind, files, size, protected in rows:
+            usage[kind] = {"files": files, "bytes": size or 0, "protected": protected or 0}
+        return usage
+
+    def oldest(
+            self,
+            kind: Optional[str]=None,
+            before: Optional[float]=None,
+            limit: int=100
+        ) -> List[Tuple[str, str, int, float]]:
+        """
+        Lists the oldest unprotected files.
+
+        Parameters
+        ----------
+            kind: str
+                Only list this media type if provided.
+
+            before: float
+                Only list the files older than this epoch time.
+
+            limit: int
+                The maximum number of files.
+
+        Returns
+        -------
+            files: List[tuple]
+                The type, name, size and timestamp of the files, oldest first.
+        """
+        clauses, parameters = ["protected = 0"], []
+        if kind is not None:
+            clauses.append("type = ?")
+            parameters.append(kind)
+        if before is not None:
+            clauses.append("timestamp < ?")
+            parameters.append(before)
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT type, name, size, timestamp FROM media WHERE {' AND '.join(clauses)} "
+                "ORDER BY timestamp ASC LIMIT ?", parameters + [limit]).fetchall()
+
+    def query(
+            self,
+            kind: Optional[Union[str, List[str]]]=None,
+            start: Optional[float]=None,
+            end: Optional[float]=None,
+            sort: str="timestamp",
+            order: str="desc",
+            page: int=1,
+            per_page: int=50
+        ) -> Tuple[List[dict], int]:
+        """
+        Lists the indexed files.
+
+        Parameters
+        ----------
+            kind: Union[str, List[str]]
+                Only list this media type ("image", "video" or "sound")
+                or these media types if provided.
+
+            start: float
+                Only list the files captured at or after this epoch time.
+
+            end: float
+                Only list the files captured before this epoch time.
+
+            sort: str
+                The column to sort by: "timestamp", "name",
+                "size" or "duration".
+
+            order: str
+                The sort order: "asc" or "desc".
+
+            page: int
+                The page to return, starting at 1.
+
+            per_page: int
+                The number of files per page.
+
+        Returns
+        -------
+            items: List[dict]
+                The files of the page with their type, name, size,
+                timestamp, duration and protection.
+
+            total: int
+                The number of files matching the filters.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unsupported sort column: {sort}")
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Unsupported sort order: {order}")
+        clauses, parameters = [], []
+        if kind is not None:
+            kinds = [kind] if isinstance(kind, str) else list(kind)
+            clauses.append(f"type IN ({', '.join('?' * len(kinds))})")
+            parameters.extend(kinds)
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            parameters.append(start)
+        if end is not None:
+            clauses.append("timestamp < ?")
+            parameters.append(end)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        page, per_page = max(1, page), max(1, per_page)
+        with self.lock:
+            total = self.connection.execute(
+                f"SELECT COUNT(*) FROM media {where}", parameters).fetchone()[0]
+            rows = self.connection.execute(
+                f"SELECT type, name, size, timestamp, duration, protected FROM media {where} "
+                f"ORDER BY {sort} {order}, name {order} LIMIT ? OFFSET ?",
+                parameters + [per_page, (page - 1) * per_page]).fetchall()
+        items = [
+            {"type": t, "name": n, "size": s, "timestamp": ts, "duration": d, "protected": bool(p)}
+            for t, n, s, ts, d, p in rows
+        ]
+        return items, total
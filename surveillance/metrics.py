@@ -0,0 +1,369 @@
+from typing import Callable, Dict, List, Tuple
+from time import perf_counter
+import threading
+import bisect
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+)
+
+def format_labels(labels: Dict[str, str]) -> str:
+    """
+    Formats labels in the Prometheus text format.
+
+    Parameters
+    ----------
+        labels: Dict[str, str]
+            The label names and values.
+
+    Returns
+    -------
+        labels: str
+            The labels, i.e. '{stage="capture"}', or an empty string.
+    """
+    if not labels:
+        return ""
+    escaped = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+class _NullTimer:
+    """
+    The timer returned while the metrics are disabled.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+class _Timer:
+    """
+    Observes the duration of a block in a histogram.
+    """
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: "Histogram") -> None:
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(perf_counter() - self.start)
+        return False
+
+class Histogram:
+    """
+    A histogram of observations in fixed buckets.
+
+    Parameters
+    ----------
+        registry: Registry
+            The registry which enables the histogram.
+
+        name: str
+            The metric name.
+
+        labels: Dict[str, str]
+            The labels of this series.
+
+        buckets: tuple
+            The upper bounds of the buckets in increasing order.
+    """
+    def __init__(
+            self,
+            registry: "Registry",
+            name: str,
+            labels: Dict[str, str],
+            buckets: Tuple[float, ...]=DEFAULT_BUCKETS
+        ) -> None:
+
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        """
+        Records an observation.
+
+        Parameters
+        ----------
+            value: float
+                The observed value, i.e. a duration in seconds.
+        """
+        if not self.registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """
+        Returns a context manager observing the duration of its block.
+
+        Returns
+        -------
+            timer: context manager
+                The timer, which does nothing while the metrics are disabled.
+        """
+        if not self.registry.enabled:
+            return NULL_TIMER
+        return _Timer(self)
+
+    def samples(self) -> List[str]:
+        """
+        Returns the cumulative buckets, the sum and the count
+        in the Prometheus text format.
+        """
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = dict(self.labels, le="+Inf" if bound == float("inf") else repr(bound))
+            lines.append(f"{self.name}_bucket{format_labels(labels)} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(self.labels)} {total}")
+        lines.append(f"{self.name}_count{format_labels(self.labels)} {cumulative}")
+        return lines
+
+class Counter:
+    """
+    A monotonically increasing count.
+
+    Parameters
+    ----------
+        registry: Registry
+            The registry which enables the counter.
+
+        name: str
+            The metric name.
+
+        labels: Dict[str, str]
+            The labels of this series.
+    """
+    def __init__(self, registry: "Registry", name: str, labels: Dict[str, str]) -> None:
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float=1):
+        """
+        Increments the counter.
+
+        Parameters
+        ----------
+            amount: float
+                The amount to add.
+        """
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.value += amount
+
+    def samples(self) -> List[str]:
+        """
+        Returns the value in the Prometheus text format.
+        """
+        return [f"{self.name}{format_labels(self.labels)} {self.value}"]
+
+class Gauge:
+    """
+    A value read when the metrics are collected.
+
+    Parameters
+    ----------
+        name: str
+            The metric name.
+
+        labels: Dict[str, str]
+            The labels of this series.
+
+        function: Callable[[], float]
+            Returns the current value.
+    """
+    def __init__(self, name: str, labels: Dict[str, str], function: Callable[[], float]) -> None:
+        self.name = name
+        self.labels = labels
+        self.function = function
+
+    def samples(self) -> List[str]:
+        """
+        Returns the current value in the Prometheus text format.
+        """
+        try:
+            value = self.function()
+        except Exception:
+            return []
+        return [f"{self.name}{format_labels(self.labels)} {value}"]
+
+class Registry:
+    """
+    The process wide collection of metrics. Histograms and counters
+    ignore observations while the registry is disabled, and their
+    timers do not read the clock, so the instrumentation costs a
+    single attribute check.
+
+    Parameters
+    ----------
+        enabled: bool
+            Specify whether observations are recorded.
+    """
+    def __init__(self, enabled: bool=True) -> None:
+        self.enabled = enabled
+        self.metrics: Dict[str, Tuple[str, str, list]] = {}
+        self.series: Dict[Tuple[str, tuple], object] = {}
+        self.lock = threading.Lock()
+
+    def _register(self, kind: str, name: str, help: str, labels: Dict[str, str], factory: Callable):
+        """
+        Returns the series of a metric, creating it on first use.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.series:
+                if name not in self.metrics:
+                    self.metrics[name] = (kind, help, [])
+                self.series[key] = factory()
+                self.metrics[name][2].append(self.series[key])
+            return self.series[key]
+
+    def histogram(
+            self,
+            name: str,
+            help: str,
+            buckets: Tuple[float, ...]=DEFAULT_BUCKETS,
+            **labels: str
+        ) -> Histogram:
+        """
+        Returns a histogram series.
+
+        Parameters
+        ----------
+            name: str
+                The metric name.
+
+            help: str
+                The description of the metric.
+
+            buckets: tuple
+                The upper bounds of the buckets.
+
+            labels: str
+                The labels of the series.
+
+        Returns
+        -------
+            histogram: Histogram
+                The histogram of these labels.
+        """
+        return self._register(
+            "histogram", name, help, labels, lambda: Histogram(self, name, labels, buckets))
+
+    def counter(self, name: str, help: str, **labels: str) -> Counter:
+        """
+        Returns a counter series.
+
+        Parameters
+        ----------
+            name: str
+                The metric name.
+
+            help: str
+                The description of the metric.
+
+            labels: str
+                The labels of the series.
+
+        Returns
+        -------
+            counter: Counter
+                The counter of these labels.
+        """
+        return self._register("counter", name, help, labels, lambda: Counter(self, name, labels))
+
+    def gauge(self, name: str, help: str, function: Callable[[], float], **labels: str) -> Gauge:
+        """
+        Registers a gauge read when the metrics are collected.
+
+        Parameters
+        ----------
+            name: str
+                The metric name.
+
+            help: str
+                The description of the metric.
+
+            function: Callable[[], float]
+                Returns the current value.
+
+            labels: str
+                The labels of the series.
+
+        Returns
+        -------
+            gauge: Gauge
+                The gauge of these labels.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            # A gauge registered again reads the new function.
+            self.series.pop(key, None)
+            if name in self.metrics:
+                self.metrics[name] = (self.metrics[name][0], help, [
+                    series for series in self.metrics[name][2] if series.labels != labels
+                ])
+        return self._register("gauge", name, help, labels, lambda: Gauge(name, labels, function))
+
+    def render(self) -> str:
+        """
+        Returns all the metrics in the Prometheus text exposition format.
+
+        Returns
+        -------
+            text: str
+                The metrics.
+        """
+        with self.lock:
+            metrics = [(name, kind, help, list(series))
+                       for name, (kind, help, series) in self.metrics.items()]
+        lines = []
+        for name, kind, help, series in metrics:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for entry in series:
+                lines.extend(entry.samples())
+        return "\n".join(lines) + "\n"
+
+metrics = Registry()
+
+def stage(name: str) -> Histogram:
+    """
+    Returns the latency histogram of a pipeline stage.
+
+    Parameters
+    ----------
+        name: str
+            The name of the stage, i.e. "capture".
+
+    Returns
+    -------
+        histogram: Histogram
+            The histogram of the stage durations in seconds.
+    """
+    return metrics.histogram(
+        "surveillance_stage_seconds", "The duration of the pipeline stages.", stage=name)
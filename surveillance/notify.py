@@ -0,0 +1,273 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, List, Optional
+if TYPE_CHECKING:
+    from surveillance.credentials import Credentials
+
+from surveillance.metrics import stage
+from surveillance import build_message, logger
+import threading
+import smtplib
+import queue
+import time
+
+ENCODE = stage("alert_encode")
+
+class Alert:
+    """
+    A single notification waiting to be sent.
+
+    Parameters
+    ----------
+        subject: str
+            The subject of the alert.
+
+        body: str
+            The HTML body of the alert.
+
+        images: list
+            The encoded images (bytes) attached to the alert.
+    """
+    def __init__(self, subject: str, body: str, images: Optional[List[bytes]]=None) -> None:
+        self.subject = subject
+        self.body = body
+        self.images = images or []
+        self.time = time.time()
+
+class EmailNotifier:
+    """
+    Sends email notifications from a single worker thread over a
+    persistent SMTP connection. Alerts are queued without blocking and
+    the alerts arriving within a batching window are coalesced into one
+    digest message. The connection is reopened with an exponential
+    backoff when it fails and closed after being idle.
+
+    Parameters
+    ----------
+        credentials: Credentials
+            The sender email, password and the recipients.
+
+        host: str
+            The SMTP server host.
+
+        port: int
+            The SMTP server port.
+
+        use_ssl: bool
+            Specify whether to connect with implicit TLS (SMTP_SSL).
+            Otherwise a plain connection is used, upgraded with
+            STARTTLS when the server supports it.
+
+        window: float
+            The time in seconds to wait for more alerts to coalesce
+            into the same message.
+
+        queue_size: int
+            The maximum number of alerts waiting. Alerts beyond
+            this limit are dropped.
+
+        max_images: int
+            The maximum number of images attached to a digest.
+
+        idle_timeout: float
+            The time in seconds after which an unused connection is closed.
+
+        max_backoff: float
+            The maximum delay in seconds between reconnection attempts.
+
+        max_attempts: int
+            The number of attempts to send a message before it is dropped.
+    """
+    def __init__(
+            self,
+            credentials: Credentials,
+            host: str="smtp.gmail.com",
+            port: int=465,
+            use_ssl: bool=True,
+            window: float=10,
+            queue_size: int=32,
+            max_images: int=6,
+            idle_timeout: float=300,
+            max_backoff: float=300,
+            max_attempts: int=5
+        ) -> None:
+
+        self.credentials = credentials
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.window = window
+        self.max_images = max_images
+        self.idle_timeout = idle_timeout
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.server = None
+        self.last_used = 0
+        self.dropped = 0
+        self.sent = 0
+        self._thread = threading.Thread(
+            target=self._run, name="email-notifier", daemon=True)
+        self._thread.start()
+
+    def notify(self, subject: str, body: str, images: Optional[List[bytes]]=None) -> bool:
+        """
+        Queues an alert without blocking.
+
+        Parameters
+        ----------
+            subject: str
+                The subject of the alert.
+
+            body: str
+                The HTML body of the alert.
+
+            images: list
+                The encoded images (bytes) attached to the alert.
+
+        Returns
+        -------
+            queued: bool
+                False if the queue is full and the alert was dropped.
+        """
+        try:
+            self.queue.put_nowait(Alert(subject, body, images))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger("The notification queue is full, the alert was dropped.", code="WARNING")
+            return False
+
+    def _run(self):
+        """
+        The worker loop collecting alerts into digests and sending them.
+        """
+        while True:
+            try:
+                first = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self.lock:
+                    self._disconnect()
+                continue
+            alerts = [first]
+            deadline = first.time + self.window
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    alerts.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                msg = self.digest(alerts)
+            except Exception as e:
+                logger(f"Failed to build the alert email: {e}", code="WARNING")
+                continue
+            with self.lock:
+                self._deliver(msg)
+
+    def digest(self, alerts: List[Alert]):
+        """
+        Coalesces alerts into a single message.
+
+        Parameters
+        ----------
+            alerts: List[Alert]
+                The alerts to send.
+
+        Returns
+        -------
+            msg: MIMEMultipart
+                The digest message.
+        """
+        if len(alerts) == 1:
+            subject = alerts[0].subject
+        else:
+            subject = f"{alerts[0].subject} ({len(alerts)} alerts)"
+        body = "<br>\n".join(alert.body for alert in alerts)
+        images = [image for alert in alerts for image in alert.images][:self.max_images]
+        with ENCODE.time():
+            return build_message(
+                subject, body, self.credentials.sender_email,
+                self.credentials.receivers, images)
+
+    def _connect(self):
+        """
+        Opens and authenticates the SMTP connection. A connection which
+        fails the handshake or the login is closed.
+        """
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=30)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=30)
+        try:
+            if not self.use_ssl:
+                server.ehlo()
+                if server.has_extn('starttls'):
+                    server.starttls()
+                    server.ehlo()
+            if self.credentials.sender_password:
+                server.login(self.credentials.sender_email, self.credentials.sender_password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+
+    def _disconnect(self):
+        """
+        Closes the SMTP connection if it is open.
+        """
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            pass
+        self.server = None
+
+    def _deliver(self, msg):
+        """
+        Sends a message over the persistent connection, reconnecting
+        with an exponential backoff on failures.
+
+        Parameters
+        ----------
+            msg: MIMEMultipart
+                The message to send.
+        """
+        delay = 1
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if self.server is not None and time.time() - self.last_used > self.idle_timeout:
+                    self._disconnect()
+                if self.server is None:
+                    self._connect()
+                self.server.send_message(msg)
+                self.last_used = time.time()
+                self.sent += 1
+                logger("Email sent successfully!", code="SUCCESS")
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                self._disconnect()
+                logger(f"Failed to send email (attempt {attempt}): {e}", code="WARNING")
+                if attempt < self.max_attempts:
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.max_backoff)
+        logger("The email was dropped after repeated failures.", code="WARNING")
+
+    def stop(self, timeout: float=5.0):
+        """
+        Waits for the queued alerts to be picked up and closes
+        the connection.
+
+        Parameters
+        ----------
+            timeout: float
+                The maximum time in seconds to wait.
+        """
+        deadline = time.time() + timeout
+        while not self.queue.empty() and time.time() < deadline:
+            time.sleep(0.05)
+        with self.lock:
+            self._disconnect()
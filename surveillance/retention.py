@@ -0,0 +1,223 @@
+from typing import Callable, Dict, Optional
+from surveillance.media import MediaIndex
+from surveillance import logger
+import threading
+import shutil
+import time
+import os
+
+class RetentionPolicy:
+    """
+    The storage limits of a media type.
+
+    Parameters
+    ----------
+        max_bytes: int
+            The maximum size of the unprotected files. The protected
+            files are not counted, as they cannot be removed to meet
+            it. Unlimited if None.
+
+        max_age: float
+            The maximum age in seconds of the files. Unlimited if None.
+    """
+    def __init__(self, max_bytes: Optional[int]=None, max_age: Optional[float]=None) -> None:
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    @staticmethod
+    def from_configuration(configuration: dict) -> "RetentionPolicy":
+        """
+        Creates a policy from its configuration section.
+
+        Parameters
+        ----------
+            configuration: dict
+                The "max_mb" and "max_age_days" limits.
+
+        Returns
+        -------
+            policy: RetentionPolicy
+                The retention policy.
+        """
+        max_mb = configuration.get("max_mb")
+        max_age_days = configuration.get("max_age_days")
+        return RetentionPolicy(
+            max_bytes=None if max_mb is None else int(max_mb * 1024 * 1024),
+            max_age=None if max_age_days is None else max_age_days * 86400,
+        )
+
+class RetentionManager:
+    """
+    Removes the oldest unprotected media files from a background
+    thread once a media type exceeds its quota or maximum age, or
+    the disk runs low on free space. The usage is read from the
+    media index, so the directories are never rescanned. Files still
+    being written are never removed.
+
+    Parameters
+    ----------
+        media: MediaIndex
+            The index of the media files.
+
+        policies: Dict[str, RetentionPolicy]
+            The limits of each media type.
+
+        min_free_bytes: int
+            The free space to keep on the disk by removing the oldest
+            files of any type.
+
+        interval: float
+            The time in seconds between the checks.
+
+        grace: float
+            Files modified within this time in seconds are kept.
+
+        on_removed: Callable[[str], None]
+            Called with the path of each removed file.
+    """
+    def __init__(
+            self,
+            media: MediaIndex,
+            policies: Dict[str, RetentionPolicy],
+            min_free_bytes: int=0,
+            interval: float=60,
+            grace: float=60,
+            on_removed: Optional[Callable[[str], None]]=None
+        ) -> None:
+
+        self.media = media
+        self.policies = policies
+        self.min_free_bytes = min_free_bytes
+        self.interval = interval
+        self.grace = grace
+        self.on_removed = on_removed
+        self.removed = 0
+        self.last_check = None
+        self.wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+
+    def start(self):
+        """
+        Starts the background checks.
+        """
+        self._thread.start()
+
+    def wake(self):
+        """
+        Requests a check without waiting for the interval,
+        i.e. after a large file was written.
+        """
+        self.wakeup.set()
+
+    def _run(self):
+        """
+        The worker loop running the checks.
+        """
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger(f"The retention check failed: {e}", code="WARNING")
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def check(self, now: Optional[float]=None) -> int:
+        """
+        Applies the maximum ages, the quotas and the minimum free space.
+
+        Parameters
+        ----------
+            now: float
+                The current time. The current time if None.
+
+        Returns
+        -------
+            removed: int
+                The number of files removed.
+        """
+        now = time.time() if now is None else now
+        removed = 0
+        for kind, policy in self.policies.items():
+            if policy.max_age is not None:
+                for entry in self.media.oldest(kind, before=now - policy.max_age):
+                    removed += self._remove(entry, now)
+            if policy.max_bytes is not None:
+                usage = self.media.usage().get(kind, {})
+                unprotected = usage.get("bytes", 0) - usage.get("protected", 0)
+                removed += self._free(kind, unprotected - policy.max_bytes, now)
+        if self.min_free_bytes:
+            directory = next(iter(self.media.directories.values()))
+            excess = self.min_free_bytes - shutil.disk_usage(directory).free
+            removed += self._free(None, excess, now)
+        self.removed += removed
+        self.last_check = now
+        return removed
+
+    def _free(self, kind: Optional[str], excess: int, now: float) -> int:
+        """
+        Removes the oldest files until excess bytes were freed.
+        """
+        removed = 0
+        while excess > 0:
+            entries = self.media.oldest(kind)
+            if not entries:
+                break
+            progress = False
+            for entry in entries:
+                if excess <= 0:
+                    break
+                if self._remove(entry, now):
+                    excess -= entry[2]
+                    removed += 1
+                    progress = True
+            if not progress:
+                # Only files still being written are left.
+                break
+        return removed
+
+    def _remove(self, entry: tuple, now: float) -> int:
+        """
+        Removes a file unless it is still being written.
+        """
+        kind, name, size, _ = entry
+        path = self.media.path(kind, name)
+        target = os.path.dirname(path) if name.endswith("/index.m3u8") else path
+        try:
+            if now - os.path.getmtime(target) < self.grace:
+                return 0
+            self.media.delete(path)
+        except FileNotFoundError:
+            self.media.remove(path)
+            return 0
+        except OSError as e:
+            logger(f"Could not remove {path}: {e}", code="WARNING")
+            return 0
+        logger(f"Retention removed {kind} {name} ({size} bytes).")
+        if self.on_removed is not None:
+            self.on_removed(path)
+        return 1
+
+    def status(self) -> dict:
+        """
+        Returns the current usage, the limits and the disk space.
+
+        Returns
+        -------
+            status: dict
+                The usage and limits of each media type, the disk
+                space and the number of files removed so far.
+        """
+        usage = self.media.usage()
+        for kind, policy in self.policies.items():
+            usage.setdefault(kind, {"files": 0, "bytes": 0, "protected": 0})
+            usage[kind]["max_bytes"] = policy.max_bytes
+            usage[kind]["max_age"] = policy.max_age
+        directory = next(iter(self.media.directories.values()))
+        disk = shutil.disk_usage(directory)
+        return {
+            "usage": usage,
+            "disk": {"total": disk.total, "used": disk.used, "free": disk.free},
+            "min_free_bytes": self.min_free_bytes,
+            "removed": self.removed,
+            "last_check": self.last_check,
+        }
@@ -0,0 +1,433 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Tuple
+if TYPE_CHECKING:
+    from surveillance.video.broadcast import FrameBroadcaster, MetadataChannel
+    from flask import Flask
+
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs, urlsplit
+from surveillance import logger
+import functools
+import threading
+import asyncio
+import json
+
+class AsyncStreamServer:
+    """
+    Serves the MJPEG stream, the motion boxes and the servo control
+    from a single asyncio event loop, so hundreds of viewers do not
+    each hold a server thread. Every viewer receives the latest
+    published frame of its quality tier, at most at the frame rate it
+    requested. Frames are dropped for a viewer whose unsent data
+    exceeds the write buffer limit instead of being queued, and the
+    viewer is disconnected once it has not caught up for max_stall
+    seconds. Requests are authenticated with the session cookie of
+    the Flask application.
+
+    Parameters
+    ----------
+        app: Flask
+            The application whose session cookies are accepted.
+
+        broadcaster: FrameBroadcaster
+            The source of the frames.
+
+        tiers: Dict[str, FrameBroadcaster]
+            The source of the frames of each quality tier, selected
+            with /cam?quality=<tier>. Only the broadcaster as the
+            "high" tier if None.
+
+        move: Callable[[float], None]
+            Moves the servo to a position between -1 and 1. It runs on
+            a worker thread. /move is unavailable if None.
+
+        metadata: MetadataChannel
+            The source of the motion boxes sent as Server-Sent Events
+            from /api/motion/boxes. Unavailable if None.
+
+        host: str
+            The address to listen on.
+
+        port: int
+            The port to listen on.
+
+        max_buffer: int
+            The maximum number of unsent bytes per viewer before frames
+            are dropped.
+
+        max_stall: float
+            The time in seconds after which a viewer whose unsent data
+            stays above max_buffer is disconnected.
+    """
+    def __init__(
+            self,
+            app: Flask,
+            broadcaster: FrameBroadcaster,
+            tiers: Optional[Dict[str, FrameBroadcaster]]=None,
+            move: Optional[Callable[[float], None]]=None,
+            metadata: Optional[MetadataChannel]=None,
+            host: str="0.0.0.0",
+            port: int=5001,
+            max_buffer: int=512 * 1024,
+            max_stall: float=10.0
+        ) -> None:
+
+        self.app = app
+        self.tiers = tiers or {"high": broadcaster}
+        self.move = move
+        self.metadata = metadata
+        self.host = host
+        self.port = port
+        self.max_buffer = max_buffer
+        self.max_stall = max_stall
+        self.serializer = app.session_interface.get_signing_serializer(app)
+        self.cookie_name = app.config["SESSION_COOKIE_NAME"]
+        self.max_age = int(app.permanent_session_lifetime.total_seconds())
+        self.loop = None
+        self.frames = {name: (0, None) for name in self.tiers}
+        self.waiters = {name: set() for name in self.tiers}
+        self.listeners = {
+            name: functools.partial(self._on_frame, name) for name in self.tiers
+        }
+        self.updates = (0, None)
+        self.subscribers = set()
+        self.viewers = 0
+        self.dropped = 0
+        self.disconnected = 0
+        self._thread = None
+
+    def start(self):
+        """
+        Runs the event loop on a background thread.
+        """
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle, self.host, self.port))
+            for name, broadcaster in self.tiers.items():
+                broadcaster.add_listener(self.listeners[name])
+            if self.metadata is not None:
+                self.metadata.add_listener(self._on_update)
+            ready.set()
+            try:
+                self.loop.run_forever()
+            finally:
+                for name, broadcaster in self.tiers.items():
+                    broadcaster.remove_listener(self.listeners[name])
+                if self.metadata is not None:
+                    self.metadata.remove_listener(self._on_update)
+                server.close()
+                tasks = asyncio.all_tasks(self.loop)
+                for task in tasks:
+                    task.cancel()
+                self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+                self.loop.close()
+
+        self._thread = threading.Thread(target=run, name="stream-server", daemon=True)
+        self._thread.start()
+        ready.wait(5)
+        logger(f"Streaming server listening on port {self.port}.")
+
+    def stop(self, timeout: float=2.0):
+        """
+        Stops the event loop and closes the connections.
+
+        Parameters
+        ----------
+            timeout: float
+                The time in seconds to wait for the thread to exit.
+        """
+        if self._thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stalled(self, transport: asyncio.WriteTransport, since: Optional[float]) -> Optional[float]:
+        """
+        Tracks the time since the unsent data of a connection exceeds
+        the write buffer limit, and aborts the connection once it has
+        not caught up for max_stall seconds.
+
+        Parameters
+        ----------
+            transport: asyncio.WriteTransport
+                The transport of the connection.
+
+            since: float
+                The time at which the limit was first exceeded, or None.
+
+        Returns
+        -------
+            since: float
+                The updated time or None if the connection caught up.
+        """
+        if transport.get_write_buffer_size() <= self.max_buffer:
+            return None
+        now = self.loop.time()
+        if since is None:
+            return now
+        if now - since > self.max_stall:
+            logger(
+                f"Disconnecting a stream client which did not catch up "
+                f"for {self.max_stall:.0f} seconds.", code="WARNING")
+            self.disconnected += 1
+            # Closing would wait for the unsent data to be read.
+            transport.abort()
+        return since
+
+    def _on_frame(self, tier: str, sequence: int, frame: bytes):
+        """
+        Hands a published frame over to the event loop.
+        Called from the producer thread of the tier.
+        """
+        self.loop.call_soon_threadsafe(self._publish, tier, sequence, frame)
+
+    def _publish(self, tier: str, sequence: int, frame: bytes):
+        """
+        Stores the latest frame of a tier and wakes up its viewers.
+        """
+        self.frames[tier] = (sequence, frame)
+        for waiter in self.waiters[tier]:
+            waiter.set()
+
+    def _on_update(self, sequence: int, data: dict):
+        """
+        Hands a published metadata update over to the event loop.
+        Called from the publishing thread.
+        """
+        self.loop.call_soon_threadsafe(self._publish_update, sequence, data)
+
+    def _publish_update(self, sequence: int, data: dict):
+        """
+        Stores the latest metadata update and wakes up its subscribers.
+        """
+        self.updates = (sequence, data)
+        for waiter in self.subscribers:
+            waiter.set()
+
+    def authenticated(self, headers: Dict[str, str]) -> bool:
+        """
+        Verifies the Flask session cookie of a request.
+
+        Parameters
+        ----------
+            headers: Dict[str, str]
+                The request headers with lower case names.
+
+        Returns
+        -------
+            authenticated: bool
+                True if the session belongs to a logged in user.
+        """
+        if self.serializer is None:
+            return False
+        cookie = SimpleCookie()
+        try:
+            cookie.load(headers.get("cookie", ""))
+        except Exception:
+            return False
+        morsel = cookie.get(self.cookie_name)
+        if morsel is None:
+            return False
+        try:
+            session = self.serializer.loads(morsel.value, max_age=self.max_age)
+        except Exception:
+            return False
+        return "username" in session
+
+    async def read_request(
+            self,
+            reader: asyncio.StreamReader
+        ) -> Optional[Tuple[str, str, Dict[str, list], Dict[str, str], bytes]]:
+        """
+        Reads the request line, the headers and the body of a request.
+
+        Returns
+        -------
+            request: tuple
+                The method, the path, the query parameters, the headers
+                and the body, or None if the request is malformed.
+        """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        body = b""
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            return None
+        if 0 < length <= 65536:
+            try:
+                body = await asyncio.wait_for(reader.readexactly(length), timeout=10)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                return None
+        path, _, query = target.partition("?")
+        return method, path, parse_qs(query), headers, body
+
+    async def respond(self, writer: asyncio.StreamWriter, status: str, body: bytes=b""):
+        """
+        Sends a complete response and closes the connection.
+        """
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves a connection.
+        """
+        request = await self.read_request(reader)
+        if request is None:
+            writer.close()
+            return
+        method, path, query, headers, body = request
+        if not self.authenticated(headers):
+            await self.respond(writer, "401 Unauthorized", b"Login required.")
+        elif path == "/cam" and method == "GET":
+            tier = query.get("quality", ["high"])[0]
+            try:
+                max_fps = float(query["fps"][0]) if "fps" in query else None
+            except ValueError:
+                max_fps = None
+            if tier not in self.tiers:
+                await self.respond(writer, "400 Bad Request", b"Unknown quality.")
+            else:
+                await self.stream(writer, tier, max_fps)
+        elif path == "/move" and method == "POST":
+            await self.control(writer, body)
+        elif path == "/api/motion/boxes" and method == "GET" and self.metadata is not None:
+            await self.events(writer, headers)
+        else:
+            await self.respond(writer, "404 Not Found")
+
+    async def control(self, writer: asyncio.StreamWriter, body: bytes):
+        """
+        Moves the servo without blocking the event loop.
+        """
+        if self.move is None:
+            await self.respond(writer, "503 Service Unavailable", b"Servo control is unavailable.")
+            return
+        try:
+            value = float(parse_qs(body.decode())["slider"][0])
+        except (KeyError, ValueError):
+            await self.respond(writer, "400 Bad Request")
+            return
+        await self.loop.run_in_executor(None, self.move, value)
+        await self.respond(writer, "204 No Content")
+
+    async def stream(self, writer: asyncio.StreamWriter, tier: str="high", max_fps: Optional[float]=None):
+        """
+        Sends the latest frame of a tier to a viewer each time one is
+        published, at most max_fps times per second.
+        """
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+            b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        transport = writer.transport
+        broadcaster = self.tiers[tier]
+        interval = 1.0 / max_fps if max_fps and max_fps > 0 else 0
+        waiter = asyncio.Event()
+        self.waiters[tier].add(waiter)
+        self.viewers += 1
+        broadcaster.remote_clients += 1
+        sequence = 0
+        next_time = 0
+        stalled = None
+        try:
+            while not transport.is_closing():
+                delay = next_time - self.loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if self.frames[tier][0] == sequence:
+                    waiter.clear()
+                    try:
+                        await asyncio.wait_for(waiter.wait(), timeout=5)
+                    except asyncio.TimeoutError:
+                        stalled = self.stalled(transport, stalled)
+                        continue
+                sequence, frame = self.frames[tier]
+                # A slow viewer skips frames rather than buffering them.
+                stalled = self.stalled(transport, stalled)
+                if stalled is not None:
+                    self.dropped += 1
+                    continue
+                writer.writelines((
+                    b"--frame\r\nContent-Type: image/jpeg\r\n"
+                    b"Content-Length: %d\r\n\r\n" % len(frame),
+                    frame,
+                    b"\r\n",
+                ))
+                next_time = self.loop.time() + interval
+        finally:
+            self.waiters[tier].discard(waiter)
+            self.viewers -= 1
+            broadcaster.remote_clients -= 1
+            writer.close()
+
+    async def events(self, writer: asyncio.StreamWriter, headers: Dict[str, str]):
+        """
+        Sends the latest metadata update to a subscriber as a
+        Server-Sent Event each time one is published, and a comment
+        when nothing was published for the keepalive of the channel.
+        The pages of the Flask application on the same host may read
+        the events with credentials.
+        """
+        cors = b""
+        origin = headers.get("origin")
+        host = urlsplit(f"//{headers.get('host', '')}").hostname
+        if origin and host and urlsplit(origin).hostname == host:
+            cors = (
+                f"Access-Control-Allow-Origin: {origin}\r\n"
+                "Access-Control-Allow-Credentials: true\r\nVary: Origin\r\n").encode("latin-1")
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nConnection: close\r\n" + cors +
+            b"\r\nretry: 2000\n\n")
+        transport = writer.transport
+        waiter = asyncio.Event()
+        self.subscribers.add(waiter)
+        self.metadata.remote_clients += 1
+        sequence = self.updates[0]
+        stalled = None
+        try:
+            while not transport.is_closing():
+                if self.updates[0] == sequence:
+                    waiter.clear()
+                    try:
+                        await asyncio.wait_for(waiter.wait(), timeout=self.metadata.keepalive)
+                    except asyncio.TimeoutError:
+                        stalled = self.stalled(transport, stalled)
+                        if stalled is None:
+                            writer.write(b": keepalive\n\n")
+                        continue
+                sequence, data = self.updates
+                # A slow subscriber only receives the latest update.
+                stalled = self.stalled(transport, stalled)
+                if stalled is not None:
+                    continue
+                writer.write(f"data: {json.dumps(data)}\n\n".encode())
+        finally:
+            self.subscribers.discard(waiter)
+            self.metadata.remote_clients -= 1
+            writer.close()
@@ -0,0 +1,259 @@
+from typing import Optional, Tuple
+from collections import OrderedDict
+from surveillance import logger
+from PIL import Image
+import subprocess
+import threading
+import hashlib
+import time
+import os
+import io
+
+class ThumbnailCache:
+    """
+    A size-bounded on-disk cache of JPEG thumbnails for the pictures
+    and of poster frames for the videos. A thumbnail is created on the
+    first request (or at capture time) and is recreated when its source
+    changes. The least recently used thumbnails are evicted once the
+    cache exceeds its size. The access time of each thumbnail records
+    its use, so the eviction order survives restarts.
+
+    Parameters
+    ----------
+        directory: str
+            The directory storing the thumbnails.
+
+        max_bytes: int
+            The maximum total size of the thumbnails.
+
+        size: tuple
+            The maximum (width, height) of the thumbnails.
+
+        quality: int
+            The JPEG quality of the thumbnails.
+    """
+    def __init__(
+            self,
+            directory: str,
+            max_bytes: int=64 * 1024 * 1024,
+            size: Tuple[int, int]=(320, 240),
+            quality: int=70
+        ) -> None:
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = tuple(size)
+        self.quality = quality
+        self.lock = threading.Lock()
+        # Serializes the decoding so a gallery load does not saturate the CPU.
+        self.generating = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if not name.endswith('.jpg'):
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_atime, name, stat.st_size))
+        self.entries = OrderedDict(
+            (name, size) for _, name, size in sorted(entries))
+        self.total = sum(self.entries.values())
+
+    def path(self, source_path: str) -> str:
+        """
+        Returns the path of the thumbnail of a file.
+
+        Parameters
+        ----------
+            source_path: str
+                The path to the picture or video.
+
+        Returns
+        -------
+            path: str
+                The path of the thumbnail in the cache.
+        """
+        key = hashlib.sha1(os.path.realpath(source_path).encode()).hexdigest()[:20]
+        return os.path.join(self.directory, f"{key}.jpg")
+
+    def get(self, source_path: str) -> Optional[str]:
+        """
+        Returns the thumbnail of a file, creating it if it is
+        missing or older than the file.
+
+        Parameters
+        ----------
+            source_path: str
+                The path to the picture or video.
+
+        Returns
+        -------
+            path: str
+                The path of the thumbnail or None if the file does not
+                exist or could not be decoded.
+        """
+        try:
+            source_mtime = self.version(source_path)
+        except OSError:
+            return None
+        path = self.path(source_path)
+        name = os.path.basename(path)
+        try:
+            if os.stat(path).st_mtime_ns == source_mtime:
+                self._touch(path, name, source_mtime)
+                return path
+        except OSError:
+            pass
+
+        with self.generating:
+            # Another request may have created it while waiting.
+            try:
+                if os.stat(path).st_mtime_ns == source_mtime:
+                    self._touch(path, name, source_mtime)
+                    return path
+            except OSError:
+                pass
+            data = self.render(source_path)
+            if data is None:
+                return None
+            temporary = f"{path}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(data)
+            # The thumbnail carries the modification time of its source.
+            os.utime(temporary, ns=(time.time_ns(), source_mtime))
+            os.replace(temporary, path)
+
+        with self.lock:
+            self.total -= self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            self.total += len(data)
+            self._evict()
+        return path
+
+    def version(self, source_path: str) -> int:
+        """
+        Returns the modification time identifying the content of a file.
+        The manifest of a recording in progress changes with every
+        segment while its poster frame does not, so the first segment
+        it lists is used until the manifest is closed.
+
+        Parameters
+        ----------
+            source_path: str
+                The path to the picture or video.
+
+        Returns
+        -------
+            mtime: int
+                The modification time in nanoseconds.
+        """
+        if source_path.endswith('.m3u8'):
+            with open(source_path) as f:
+                content = f.read()
+            if "#EXT-X-ENDLIST" not in content:
+                segments = [
+                    line.strip() for line in content.splitlines()
+                    if line.strip() and not line.startswith('#')
+                ]
+                if segments:
+                    segment = os.path.join(os.path.dirname(source_path), segments[0])
+                    return os.stat(segment).st_mtime_ns
+        return os.stat(source_path).st_mtime_ns
+
+    def _touch(self, path: str, name: str, source_mtime: int):
+        """
+        Marks a thumbnail as recently used.
+        """
+        with self.lock:
+            if name in self.entries:
+                self.entries.move_to_end(name)
+            else:
+                size = os.path.getsize(path)
+                self.entries[name] = size
+                self.total += size
+        try:
+            os.utime(path, ns=(time.time_ns(), source_mtime))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """
+        Removes the least recently used thumbnails until the cache fits
+        its size. The lock must be held.
+        """
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            name, size = self.entries.popitem(last=False)
+            self.total -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def remove(self, source_path: str):
+        """
+        Removes the thumbnail of a deleted file.
+
+        Parameters
+        ----------
+            source_path: str
+                The path to the picture or video.
+        """
+        path = self.path(source_path)
+        with self.lock:
+            self.total -= self.entries.pop(os.path.basename(path), 0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def render(self, source_path: str) -> Optional[bytes]:
+        """
+        Encodes the thumbnail of a picture, or the poster frame of a video.
+
+        Parameters
+        ----------
+            source_path: str
+                The path to the picture or video.
+
+        Returns
+        -------
+            data: bytes
+                The JPEG thumbnail or None if the file could not be decoded.
+        """
+        try:
+            if source_path.lower().endswith(('.mp4', '.mkv', '.h264', '.m3u8')):
+                image = self.poster_frame(source_path)
+            else:
+                image = Image.open(source_path)
+                # Decode JPEG files directly at a reduced scale.
+                image.draft('RGB', self.size)
+            image = image.convert('RGB')
+            image.thumbnail(self.size)
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=self.quality)
+            return buffer.getvalue()
+        except Exception as e:
+            logger(f"Could not create the thumbnail of {source_path}: {e}", code="WARNING")
+            return None
+
+    def poster_frame(self, source_path: str) -> Image.Image:
+        """
+        Decodes the first frame of a video with ffmpeg, scaled down
+        to the thumbnail size.
+
+        Parameters
+        ----------
+            source_path: str
+                The path to the video.
+
+        Returns
+        -------
+            image: Image.Image
+                The poster frame.
+        """
+        width, height = self.size
+        command = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', source_path,
+                   '-frames:v', '1',
+                   '-vf', f'scale={width}:{height}:force_original_aspect_ratio=decrease',
+                   '-f', 'image2pipe', '-c:v', 'mjpeg', '-']
+        result = subprocess.run(command, check=True, capture_output=True, timeout=30)
+        return Image.open(io.BytesIO(result.stdout))
@@ -0,0 +1,333 @@
+from typing import Iterator, List, Optional, Tuple
+from surveillance.media import MediaIndex
+from surveillance.jobs import JobQueue
+from surveillance import logger
+import numpy as np
+import subprocess
+import queue
+import time
+
+def decode_frames(
+        path: str,
+        size: Tuple[int, int]=(160, 120),
+        fps: int=2,
+        chunk: int=32
+    ) -> Iterator[np.ndarray]:
+    """
+    Streams the decoded luma frames of a recording from an ffmpeg pipe
+    at a reduced resolution and frame rate, so the file is never loaded
+    at once.
+
+    Parameters
+    ----------
+        path: str
+            The mp4 file or the manifest of a segmented recording.
+
+        size: tuple
+            The (width, height) of the decoded frames.
+
+        fps: int
+            The number of frames decoded per second of video.
+
+        chunk: int
+            The maximum number of frames returned at a time.
+
+    Returns
+    -------
+        frames: Iterator[np.ndarray]
+            Arrays of shape (frames, height, width) of uint8 luma.
+    """
+    width, height = size
+    command = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "1", "-i", path,
+        "-an", "-sn", "-vf", f"fps={fps},scale={width}:{height}",
+        "-pix_fmt", "gray", "-f", "rawvideo", "pipe:1"
+    ]
+    # The errors are not read, as a full stderr pipe would block ffmpeg.
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    frame_size = width * height
+    try:
+        while True:
+            data = process.stdout.read(frame_size * chunk)
+            count = len(data) // frame_size
+            if count:
+                yield np.frombuffer(data[:count * frame_size], dtype=np.uint8).reshape(
+                    count, height, width)
+            if len(data) < frame_size * chunk:
+                break
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {process.returncode}")
+
+def activity_timeline(
+        chunks: Iterator[np.ndarray],
+        fps: int=2,
+        pixel_threshold: int=25
+    ) -> np.ndarray:
+    """
+    Computes the activity of each second of a recording by differencing
+    consecutive frames. The frames of each chunk are compared at once.
+
+    Parameters
+    ----------
+        chunks: Iterator[np.ndarray]
+            Arrays of shape (frames, height, width) of uint8 luma.
+
+        fps: int
+            The number of frames per second of video.
+
+        pixel_threshold: int
+            The minimum absolute luma difference for a pixel to be
+            considered changed.
+
+    Returns
+    -------
+        timeline: np.ndarray
+            The uint8 activity of each second: the largest fraction of
+            changed pixels between two frames in permille, saturated
+            at 255.
+    """
+    fractions = []
+    previous = None
+    for frames in chunks:
+        if previous is None:
+            fractions.append(np.zeros(1, dtype=np.float32))
+            stack = frames
+        else:
+            stack = np.concatenate((previous[None], frames))
+        difference = np.abs(stack[1:].astype(np.int16) - stack[:-1])
+        changed = np.count_nonzero(difference > pixel_threshold, axis=(1, 2))
+        fractions.append(changed / float(stack[0].size))
+        previous = frames[-1]
+    if not fractions:
+        return np.zeros(0, dtype=np.uint8)
+    fractions = np.concatenate(fractions)
+    seconds = -(-len(fractions) // fps)
+    padded = np.zeros(seconds * fps, dtype=np.float32)
+    padded[:len(fractions)] = fractions
+    peaks = padded.reshape(seconds, fps).max(axis=1)
+    return np.minimum(np.round(peaks * 1000), 255).astype(np.uint8)
+
+def activity_segments(
+        timeline: np.ndarray,
+        level: int=5,
+        gap: int=3,
+        pad: int=1
+    ) -> List[dict]:
+    """
+    Groups the active seconds of a timeline into segments.
+
+    Parameters
+    ----------
+        timeline: np.ndarray
+            The uint8 activity of each second.
+
+        level: int
+            The activity in permille from which a second is active.
+
+        gap: int
+            The number of quiet seconds within a single segment.
+
+        pad: int
+            The number of seconds added before and after each segment.
+
+    Returns
+    -------
+        segments: List[dict]
+            The "start" and "end" seconds and the "peak" activity in
+            permille of each segment.
+    """
+    active = np.flatnonzero(timeline >= level)
+    if len(active) == 0:
+        return []
+    # A new segment starts where the quiet seconds exceed the gap.
+    breaks = np.flatnonzero(np.diff(active) > gap + 1)
+    starts = np.concatenate(([active[0]], active[breaks + 1]))
+    ends = np.concatenate((active[breaks], [active[-1]])) + 1
+    return [
+        {
+            "start": int(max(0, start - pad)),
+            "end": int(min(len(timeline), end + pad)),
+            "peak": int(timeline[start:end].max()),
+        }
+        for start, end in zip(starts, ends)
+    ]
+
+class ActivityIndex:
+    """
+    An incremental index of the activity in the recordings. Each
+    recording is decoded once at a low resolution and frame rate and
+    its activity is stored as one byte per second next to the media
+    index, so the player jumps to the active parts of a recording
+    without scanning it. A recording is indexed again when its size or
+    time changes, which also applies to the recordings which could not
+    be decoded, and the timelines of deleted recordings are removed
+    with their media index entries.
+
+    Parameters
+    ----------
+        media: MediaIndex
+            The media index listing the recordings. Its database
+            stores the timelines.
+
+        jobs: JobQueue
+            The queue running the indexing.
+
+        size: tuple
+            The (width, height) at which the frames are decoded.
+
+        fps: int
+            The number of frames decoded per second of video.
+
+        pixel_threshold: int
+            The minimum absolute luma difference for a pixel to be
+            considered changed.
+    """
+    def __init__(
+            self,
+            media: MediaIndex,
+            jobs: JobQueue,
+            size: Tuple[int, int]=(160, 120),
+            fps: int=2,
+            pixel_threshold: int=25
+        ) -> None:
+
+        self.media = media
+        self.jobs = jobs
+        self.size = tuple(size)
+        self.fps = max(1, int(fps))
+        self.pixel_threshold = pixel_threshold
+        self.indexed = 0
+        with media.lock, media.connection:
+            media.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS activity (
+                    name TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    timestamp REAL NOT NULL,
+                    indexed REAL NOT NULL,
+                    timeline BLOB NOT NULL,
+                    error TEXT
+                )
+                """)
+            columns = {row[1] for row in media.connection.execute("PRAGMA table_info(activity)")}
+            if "error" not in columns:
+                media.connection.execute("ALTER TABLE activity ADD COLUMN error TEXT")
+        media.attach("video", "activity")
+
+    def pending(self) -> List[Tuple[str, int, float]]:
+        """
+        Lists the recordings which are not indexed or changed since.
+        Recordings in progress, which have no duration yet, are skipped,
+        and so are the recordings which could not be decoded until they
+        change.
+
+        Returns
+        -------
+            recordings: List[tuple]
+                The name, size and timestamp of the recordings, oldest first.
+        """
+        with self.media.lock:
+            return self.media.connection.execute(
+                "SELECT m.name, m.size, m.timestamp FROM media m "
+                "LEFT JOIN activity a ON a.name = m.name "
+                "WHERE m.type = 'video' AND COALESCE(m.duration, 1) > 0 "
+                "AND (a.name IS NULL OR a.size != m.size OR a.timestamp != m.timestamp) "
+                "ORDER BY m.timestamp ASC").fetchall()
+
+    def schedule(self):
+        """
+        Queues the indexing of the pending recordings unless it is
+        already queued.
+        """
+        if any(job.status == "pending" for job in self.jobs.pending("activity")):
+            return
+        try:
+            self.jobs.submit("activity", "videos", self.index_pending)
+        except queue.Full:
+            pass
+
+    def index_pending(self):
+        """
+        Indexes the pending recordings and removes the timelines of
+        the recordings which were deleted.
+        """
+        with self.media.lock, self.media.connection:
+            self.media.connection.execute(
+                "DELETE FROM activity WHERE name NOT IN "
+                "(SELECT name FROM media WHERE type = 'video')")
+        for name, size, timestamp in self.pending():
+            try:
+                self.index(name, size, timestamp)
+            except Exception as e:
+                logger(f"The activity of {name} could not be indexed: {e}", code="WARNING")
+                self._store(name, size, timestamp, b"", str(e))
+
+    def index(self, name: str, size: int, timestamp: float) -> np.ndarray:
+        """
+        Decodes a recording and stores its activity timeline.
+
+        Parameters
+        ----------
+            name: str
+                The indexed name of the recording.
+
+            size: int
+                The size of the recording when it was listed.
+
+            timestamp: float
+                The time of the recording when it was listed.
+
+        Returns
+        -------
+            timeline: np.ndarray
+                The uint8 activity of each second.
+        """
+        started = time.monotonic()
+        timeline = activity_timeline(
+            decode_frames(self.media.path("video", name), self.size, self.fps),
+            self.fps, self.pixel_threshold)
+        self._store(name, size, timestamp, timeline.tobytes())
+        self.indexed += 1
+        logger(
+            f"Indexed the activity of {name} ({len(timeline)} s "
+            f"in {time.monotonic() - started:.1f} s).")
+        return timeline
+
+    def _store(self, name: str, size: int, timestamp: float, timeline: bytes, error: Optional[str]=None):
+        """
+        Stores the timeline of a recording, or the error of its decoding,
+        with the size and time it was indexed at.
+        """
+        with self.media.lock, self.media.connection:
+            self.media.connection.execute(
+                "INSERT OR REPLACE INTO activity (name, size, timestamp, indexed, timeline, error) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (name, size, timestamp, time.time(), timeline, error))
+
+    def timeline(self, name: str) -> Optional[np.ndarray]:
+        """
+        Returns the activity timeline of a recording.
+
+        Parameters
+        ----------
+            name: str
+                The indexed name of the recording.
+
+        Returns
+        -------
+            timeline: np.ndarray
+                The uint8 activity of each second or None if the
+                recording is not indexed yet or could not be decoded.
+        """
+        with self.media.lock:
+            row = self.media.connection.execute(
+                "SELECT timeline FROM activity WHERE name = ? AND error IS NULL",
+                (name,)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.uint8)
@@ -0,0 +1,279 @@
+from typing import List, Optional, Tuple
+from multiprocessing import shared_memory
+from surveillance.video.motion import MotionDetector, MotionResult
+from surveillance import logger
+import multiprocessing
+import numpy as np
+import queue
+
+class LumaRing:
+    """
+    A ring of fixed-size luma buffers in shared memory. Each slot
+    stores the sequence number of its frame next to it, so a reader
+    detects a frame which was overwritten while it was copied and
+    frames are never pickled between the processes.
+
+    Parameters
+    ----------
+        shape: Tuple[int, int]
+            The (height, width) of the luma frames.
+
+        slots: int
+            The number of frames held in the ring.
+
+        name: str
+            The name of an existing ring to attach to. A new ring is
+            created if None.
+    """
+    def __init__(self, shape: Tuple[int, int], slots: int=8, name: Optional[str]=None) -> None:
+        height, width = shape
+        self.shape = (height, width)
+        self.slots = slots
+        header = slots * np.dtype(np.int64).itemsize
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=header + slots * height * width)
+            self.owner = True
+        else:
+            # Only the creator of the ring unlinks it.
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.sequences = np.ndarray((slots,), dtype=np.int64, buffer=self.memory.buf)
+        self.frames = np.ndarray(
+            (slots, height, width), dtype=np.uint8, buffer=self.memory.buf, offset=header)
+        if self.owner:
+            self.sequences[:] = 0
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def write(self, sequence: int, luma: np.ndarray):
+        """
+        Stores a frame in the slot of its sequence number.
+
+        Parameters
+        ----------
+            sequence: int
+                The sequence number of the frame, starting at 1.
+
+            luma: np.ndarray
+                The uint8 (height, width) luma array.
+        """
+        slot = sequence % self.slots
+        # The slot is marked as being written until the copy is complete.
+        self.sequences[slot] = -1
+        self.frames[slot] = luma
+        self.sequences[slot] = sequence
+
+    def read(self, sequence: int) -> Optional[np.ndarray]:
+        """
+        Copies a frame out of the ring.
+
+        Parameters
+        ----------
+            sequence: int
+                The sequence number of the frame.
+
+        Returns
+        -------
+            luma: np.ndarray
+                The uint8 (height, width) luma array or None if the
+                frame was already overwritten.
+        """
+        slot = sequence % self.slots
+        if self.sequences[slot] != sequence:
+            return None
+        luma = self.frames[slot].copy()
+        if self.sequences[slot] != sequence:
+            return None
+        return luma
+
+    def close(self):
+        """
+        Releases the ring and removes it once its creator closes it.
+        """
+        self.sequences = self.frames = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+def analyze_frames(name: str, shape: Tuple[int, int], slots: int, configuration: dict, requests, results):
+    """
+    The motion analysis process. It reads the frames announced on the
+    requests queue from the shared ring and returns the result of each
+    one on the results queue.
+
+    Parameters
+    ----------
+        name: str
+            The name of the shared ring.
+
+        shape: Tuple[int, int]
+            The (height, width) of the luma frames.
+
+        slots: int
+            The number of frames held in the ring.
+
+        configuration: dict
+            The motion settings.
+
+        requests: multiprocessing.Queue
+            The sequence numbers of the frames to analyze, None to stop.
+
+        results: multiprocessing.Queue
+            Receives (sequence, count, score, motion, tiles, boxes, shape)
+            tuples, or (sequence, None, None, None, None, None, None) for
+            a frame without result.
+    """
+    ring = LumaRing(shape, slots, name=name)
+    detector = MotionDetector.from_configuration(configuration)
+    previous = None
+    try:
+        while True:
+            sequence = requests.get()
+            if sequence is None:
+                break
+            luma = ring.read(sequence)
+            if luma is None:
+                results.put((sequence, None, None, None, None, None, None))
+                continue
+            current = detector.prepare(luma)
+            if previous is None:
+                results.put((sequence, None, None, None, None, None, None))
+            else:
+                result = detector.analyze(previous, current)
+                results.put((
+                    sequence, result.count, result.score, result.motion, result.tiles,
+                    result.boxes, result.shape))
+            previous = current
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+class MotionProcess:
+    """
+    Runs the motion analysis in a separate process, so it does not hold
+    the interpreter lock of the server. Frames are copied into a shared
+    memory ring and only their sequence numbers and the compact results
+    cross the process boundary. Frames are skipped while the ring is
+    full of frames waiting to be analyzed.
+
+    Parameters
+    ----------
+        configuration: dict
+            The motion settings of the worker's detector.
+
+        slots: int
+            The number of frames held in the ring.
+    """
+    def __init__(self, configuration: dict, slots: int=8) -> None:
+        self.configuration = configuration
+        self.slots = slots
+        self.context = multiprocessing.get_context("spawn")
+        self.ring = None
+        self.process = None
+        self.requests = None
+        self.results = None
+        self.sequence = 0
+        self.pending = 0
+        self.skipped = 0
+
+    def _start(self, shape: Tuple[int, int]):
+        """
+        Creates the ring and starts the worker process.
+        """
+        if self.ring is None:
+            self.ring = LumaRing(shape, self.slots)
+        self.requests = self.context.Queue()
+        self.results = self.context.Queue()
+        self.pending = 0
+        self.process = self.context.Process(
+            target=analyze_frames,
+            args=(self.ring.name, self.ring.shape, self.slots, self.configuration,
+                  self.requests, self.results),
+            name="motion-analysis",
+            daemon=True,
+        )
+        self.process.start()
+        logger(f"Motion analysis started in process {self.process.pid}.")
+
+    def submit(self, luma: np.ndarray) -> Optional[int]:
+        """
+        Hands a frame over to the worker without waiting for its result.
+
+        Parameters
+        ----------
+            luma: np.ndarray
+                The uint8 (height, width) luma array.
+
+        Returns
+        -------
+            sequence: int
+                The sequence number of the frame, or None if it was
+                skipped because the worker is behind.
+        """
+        if self.process is None:
+            self._start(luma.shape)
+        elif not self.process.is_alive():
+            logger(
+                f"Motion analysis stopped (exit code {self.process.exitcode}), restarting it.",
+                code="WARNING")
+            self._start(luma.shape)
+        if self.pending >= self.slots - 1:
+            self.skipped += 1
+            return None
+        self.sequence += 1
+        self.ring.write(self.sequence, luma)
+        self.requests.put(self.sequence)
+        self.pending += 1
+        return self.sequence
+
+    def collect(self, timeout: Optional[float]=None) -> List[Tuple[int, MotionResult]]:
+        """
+        Takes the results returned by the worker.
+
+        Parameters
+        ----------
+            timeout: float
+                The time in seconds to wait for a first result. The
+                results already returned are taken without waiting if None.
+
+        Returns
+        -------
+            results: List[Tuple[int, MotionResult]]
+                The sequence number and the result of each analyzed frame.
+        """
+        collected = []
+        while self.pending:
+            try:
+                if timeout is not None and not collected:
+                    entry = self.results.get(timeout=timeout)
+                else:
+                    entry = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending -= 1
+            sequence, count, score, motion, tiles, boxes, shape = entry
+            if count is not None:
+                collected.append((sequence, MotionResult(count, tiles, score, motion, boxes, shape)))
+        return collected
+
+    def close(self, timeout: float=2.0):
+        """
+        Stops the worker and releases the ring.
+
+        Parameters
+        ----------
+            timeout: float
+                The time in seconds to wait for the worker to exit.
+        """
+        if self.process is not None:
+            self.requests.put(None)
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
@@ -0,0 +1,367 @@
+from typing import Callable, Iterator, List, Optional, Tuple
+from surveillance.metrics import metrics
+from surveillance import logger
+import threading
+import time
+
+class FrameBroadcaster:
+    """
+    Runs a single producer thread which captures and analyzes each
+    frame once, and publishes the numbered result to any number of
+    subscribers. Subscribers always receive the latest frame and skip
+    the ones they were too slow to send.
+
+    Parameters
+    ----------
+        producer: Callable[[], bytes]
+            The function called once per frame to retrieve the
+            next frame, i.e. Camera.get_frame.
+
+        name: str
+            The name of the producer thread.
+
+        max_backoff: float
+            The maximum delay in seconds before calling a failing
+            producer again. The delay doubles after each failure.
+
+        log_interval: float
+            The minimum time in seconds between two logged failures.
+    """
+    def __init__(
+            self,
+            producer: Callable[[], bytes],
+            name: str="frame-broadcaster",
+            max_backoff: float=5.0,
+            log_interval: float=30.0
+        ) -> None:
+
+        self.producer = producer
+        self.name = name
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.subscribers = 0
+        self.remote_clients = 0
+        self.listeners: List[Callable[[int, bytes], None]] = []
+        self.skipped = metrics.counter(
+            "surveillance_skipped_frames_total",
+            "The frames skipped by slow or rate limited subscribers.", broadcaster=name)
+        self.max_backoff = max_backoff
+        self.log_interval = log_interval
+        self.failures = 0
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the producer thread if it is not already running.
+        """
+        if self._running:
+            return
+        self._running = True
+        self._wakeup.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float=2.0):
+        """
+        Stops the producer thread and wakes up all subscribers.
+
+        Parameters
+        ----------
+            timeout: float
+                The time in seconds to wait for the thread to exit.
+        """
+        self._running = False
+        self._wakeup.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        """
+        Specifies whether the producer thread is running.
+
+        Returns
+        -------
+            running: bool
+                True if the producer thread is running.
+        """
+        return self._running
+
+    @property
+    def clients(self) -> int:
+        """
+        The number of subscribers and of the clients served by the
+        listeners. The listeners count their clients in remote_clients
+        from their own thread, i.e. the event loop of the streaming
+        server, so they never wait for the lock of the producer.
+
+        Returns
+        -------
+            clients: int
+                The number of connected clients.
+        """
+        return self.subscribers + self.remote_clients
+
+    def _run(self):
+        """
+        The producer loop. Retrieves frames and publishes them, and
+        backs off while the producer fails.
+        """
+        delay = 0.1
+        last_log = None
+        suppressed = 0
+        while self._running:
+            try:
+                frame = self.producer()
+            except Exception as e:
+                self.failures += 1
+                now = time.monotonic()
+                if last_log is None or now - last_log >= self.log_interval:
+                    repeated = f" ({suppressed} more failures)" if suppressed else ""
+                    logger(
+                        f"Frame producer failed, retrying in {delay:.1f} seconds: {e}{repeated}",
+                        code="WARNING")
+                    last_log, suppressed = now, 0
+                else:
+                    suppressed += 1
+                self._wakeup.wait(delay)
+                delay = min(delay * 2, self.max_backoff)
+                continue
+            delay = 0.1
+            if frame is not None:
+                self.publish(frame)
+
+    def publish(self, frame: bytes) -> int:
+        """
+        Publishes a new frame to the subscribers.
+
+        Parameters
+        ----------
+            frame: bytes
+                The encoded frame to publish.
+
+        Returns
+        -------
+            sequence: int
+                The sequence number assigned to the frame.
+        """
+        with self.condition:
+            self.sequence += 1
+            self.frame = frame
+            self.condition.notify_all()
+            sequence = self.sequence
+        for listener in self.listeners:
+            listener(sequence, frame)
+        return sequence
+
+    def add_listener(self, listener: Callable[[int, bytes], None]):
+        """
+        Registers a function called from the producer thread with the
+        sequence number and the frame each time a frame is published.
+        Listeners must return immediately, i.e. by scheduling the work
+        on their own thread or event loop.
+
+        Parameters
+        ----------
+            listener: Callable[[int, bytes], None]
+                The function to call.
+        """
+        self.listeners = self.listeners + [listener]
+
+    def remove_listener(self, listener: Callable[[int, bytes], None]):
+        """
+        Unregisters a listener.
+
+        Parameters
+        ----------
+            listener: Callable[[int, bytes], None]
+                The function to remove.
+        """
+        self.listeners = [l for l in self.listeners if l is not listener]
+
+    def wait_for_frame(
+            self,
+            last_sequence: int=0,
+            timeout: Optional[float]=None
+        ) -> Tuple[int, Optional[bytes]]:
+        """
+        Waits for a frame newer than the last one received.
+
+        Parameters
+        ----------
+            last_sequence: int
+                The sequence number of the last frame received.
+
+            timeout: float
+                The maximum time in seconds to wait. None waits
+                until a frame is published or the broadcaster stops.
+
+        Returns
+        -------
+            sequence: int
+                The sequence number of the latest frame.
+
+            frame: bytes
+                The latest frame or None if no new frame
+                was published within the timeout.
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.sequence > last_sequence or not self._running,
+                timeout)
+            if self.sequence > last_sequence:
+                return self.sequence, self.frame
+            return last_sequence, None
+
+    def subscribe(self, max_fps: Optional[float]=None) -> Iterator[bytes]:
+        """
+        Yields the latest frame every time a new frame is published.
+        Frames published while the subscriber was busy are skipped.
+
+        Parameters
+        ----------
+            max_fps: float
+                The maximum frame rate sent to this subscriber. The
+                latest frame is taken once the interval has elapsed,
+                so a capped subscriber never receives stale frames.
+
+        Returns
+        -------
+            frames: Iterator[bytes]
+                The generator of frames for a single client.
+        """
+        interval = 1.0 / max_fps if max_fps else 0
+        with self.condition:
+            self.subscribers += 1
+        try:
+            sequence = 0
+            next_time = 0
+            while self._running:
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                previous = sequence
+                sequence, frame = self.wait_for_frame(sequence, timeout=1.0)
+                if frame is not None:
+                    if previous and sequence - previous > 1:
+                        self.skipped.inc(sequence - previous - 1)
+                    next_time = time.monotonic() + interval
+                    yield frame
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+class MetadataChannel:
+    """
+    Publishes the latest metadata of the stream, i.e. the motion boxes,
+    to any number of subscribers next to the frames, so the frames are
+    sent untouched. Like the frames, a slow subscriber only receives
+    the latest update.
+
+    Parameters
+    ----------
+        keepalive: float
+            The time in seconds after which subscribers receive None
+            when nothing was published, to keep their connection open.
+    """
+    def __init__(self, keepalive: float=15.0) -> None:
+        self.keepalive = keepalive
+        self.condition = threading.Condition()
+        self.data = None
+        self.sequence = 0
+        self.subscribers = 0
+        self.remote_clients = 0
+        self.listeners: List[Callable[[int, dict], None]] = []
+
+    @property
+    def clients(self) -> int:
+        """
+        The number of subscribers and of the clients served by the
+        listeners, counted like the clients of a FrameBroadcaster.
+
+        Returns
+        -------
+            clients: int
+                The number of connected clients.
+        """
+        return self.subscribers + self.remote_clients
+
+    def publish(self, data: dict) -> int:
+        """
+        Publishes an update to the subscribers.
+
+        Parameters
+        ----------
+            data: dict
+                The JSON serializable update.
+
+        Returns
+        -------
+            sequence: int
+                The sequence number assigned to the update.
+        """
+        with self.condition:
+            self.sequence += 1
+            self.data = data
+            self.condition.notify_all()
+            sequence = self.sequence
+        for listener in self.listeners:
+            listener(sequence, data)
+        return sequence
+
+    def add_listener(self, listener: Callable[[int, dict], None]):
+        """
+        Registers a function called from the publishing thread with the
+        sequence number and the update each time one is published.
+        Listeners must return immediately.
+
+        Parameters
+        ----------
+            listener: Callable[[int, dict], None]
+                The function to call.
+        """
+        self.listeners = self.listeners + [listener]
+
+    def remove_listener(self, listener: Callable[[int, dict], None]):
+        """
+        Unregisters a listener.
+
+        Parameters
+        ----------
+            listener: Callable[[int, dict], None]
+                The function to remove.
+        """
+        self.listeners = [l for l in self.listeners if l is not listener]
+
+    def subscribe(self) -> Iterator[Optional[dict]]:
+        """
+        Yields the latest update every time one is published, and None
+        when nothing was published for keepalive seconds.
+
+        Returns
+        -------
+            updates: Iterator[dict]
+                The generator of updates for a single client.
+        """
+        with self.condition:
+            self.subscribers += 1
+            sequence = self.sequence
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.sequence > sequence, self.keepalive)
+                    if self.sequence == sequence:
+                        data = None
+                    else:
+                        sequence, data = self.sequence, self.data
+                yield data
+        finally:
+            with self.condition:
+                self.subscribers -= 1
@@ -1,33 +1,46 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Union
+from typing import TYPE_CHECKING, List, Tuple, Union
 if TYPE_CHECKING:
     from surveillance.credentials import Credentials
     from picamera2.outputs import CircularOutput
     from picamera2.encoders import H264Encoder
+    from surveillance.video.recorder import EventRecorder
+    from surveillance.video.analysis import MotionProcess
+    from surveillance.events import EventLog
+    from surveillance.video.broadcast import MetadataChannel
 
-from surveillance.video.utils import image2bytes, show_time
-from PIL import Image, ImageChops, ImageFilter
-from surveillance import logger, send_email
-from picamera2.encoders import MJPEGEncoder
-from picamera2.outputs import FileOutput
-from picamera2 import Picamera2
+from surveillance.video.utils import show_time
+from surveillance.video.sources import FrameSource, PicameraSource, StreamingOutput
+from surveillance.video.motion import MotionDetector, MotionResult
+from surveillance.metrics import metrics, stage
+from surveillance.notify import EmailNotifier
+from surveillance import logger
+from collections import deque
 from datetime import datetime
 import numpy as np
 import threading
 import time
-import io
 import os
 
+CAPTURE = stage("capture")
+LUMA = stage("luma")
+DETECT = stage("detect")
+MOTION_FRAMES = metrics.counter(
+    "surveillance_motion_frames_total", "The analyzed frames with motion.")
+ALERTS = metrics.counter(
+    "surveillance_alerts_total", "The motion alerts queued for sending.")
+
 class Camera:
     """
     Camera instance using the picamera2 library to capture image data 
-    from a Raspberry Pi camera module. 
+    from a Raspberry Pi camera module. Any other frame source can be
+    used instead to run the pipeline without the hardware.
 
     Parameters
     ----------
         encoder: H264Encoder, ...
             The encoder to pass to the camera object
-            to start recording.
+            to start recording. Recording is disabled if None.
 
         output: CircularOutput
             The output object to pass to the
@@ -38,7 +51,8 @@ class Camera:
             when utilizing the snap functionality.
 
         credentials: Credentials
-            This contains the user credentials.
+            This contains the user credentials. Email
+            notifications are disabled if None.
 
         width: int
             This is the width to display the feed or the 
@@ -56,6 +70,47 @@ class Camera:
         cooldown: int
             This is the time in seconds before sending another email if
             motion is detected.
+
+        motion: MotionDetector
+            The motion detection engine and its thresholds. The
+            default settings are used if None.
+
+        analysis_source: FrameSource
+            The source of luma frames for motion analysis. By default
+            the luma frames of the frame source are used, which is the
+            Y plane of the low resolution YUV420 stream for the camera.
+
+        source: FrameSource
+            The source of the frames. A PicameraSource at the given
+            width and height is created if None.
+
+        recorder: EventRecorder
+            The recorder notified of motion to record event clips.
+
+        notifier: EmailNotifier
+            The notifier sending the motion alerts. A notifier using
+            the credentials with the default SMTP server is created
+            if None.
+
+        alert_frames_before: int
+            The number of frames preceding the trigger attached to alerts.
+
+        alert_frames_after: int
+            The number of frames following the trigger attached to alerts.
+
+        alert_frame_step: int
+            The spacing in frames between the attached frames.
+
+        motion_process: MotionProcess
+            Analyzes the luma frames in a separate process instead of
+            the frame loop. The results arrive a few frames later.
+
+        events: EventLog
+            The log storing the motion events of the camera.
+
+        motion_channel: MetadataChannel
+            Receives the boxes of the moving objects of each analyzed
+            frame, which are sent to the viewers next to the stream.
     """
     def __init__(
             self, 
@@ -67,33 +122,67 @@ class Camera:
             height: int=600,
             silent: bool=False,
             cooldown: int=300,
+            motion: MotionDetector=None,
+            analysis_source: FrameSource=None,
+            source: FrameSource=None,
+            recorder: EventRecorder=None,
+            notifier: EmailNotifier=None,
+            alert_frames_before: int=0,
+            alert_frames_after: int=0,
+            alert_frame_step: int=1,
+            motion_process: MotionProcess=None,
+            events: EventLog=None,
+            motion_channel: MetadataChannel=None,
         ) -> None:
 
-        self.camera = Picamera2()
-        self.camera.configure(
-            self.camera.create_video_configuration(
-                main={
-                    "size": (width, height)
-                }))
-        self.still_config = self.camera.create_still_configuration()
+        self.motion = motion if motion is not None else MotionDetector()
+        lores_size = self.motion.analysis_size or (320, 240)
 
-        self.encoder = MJPEGEncoder(10000000)
-        self.streamOut = StreamingOutput()
-        self.streamOut2 = FileOutput(self.streamOut)
-        self.encoder.output = [self.streamOut2]
-
-        self.camera.start_encoder(self.encoder)
-        self.camera.start_recording(encoder, output)
+        if source is None:
+            source = PicameraSource(width, height, lores_size)
+        self.source = source
+        self.source.start()
+        if encoder is not None:
+            self.source.start_recording(encoder, output)
 
         self.images_directory = images_directory
         self.credentials = credentials
         self.previous_image = None
+        self.last_result = None
         self.motion_detected = False  # Track if motion is currently detected.
         self.last_motion_detected_time = None  # Initialize to None.
         self.last_motion_time = None
         self.email_allowed = True
         self.silent = silent
         self.cooldown = cooldown
+        self.analysis_source = analysis_source if analysis_source is not None else source
+        self.recorder = recorder
+        if notifier is None and credentials is not None:
+            notifier = EmailNotifier(credentials)
+        self.notifier = notifier
+        # The encoded frames are kept as they are so alerts attach the
+        # JPEG produced by the encoder without decoding or re-encoding.
+        # They are numbered so the frames around a trigger are found
+        # even when its result arrives late from the motion process.
+        self.alert_frames_before = alert_frames_before
+        self.alert_frames_after = alert_frames_after
+        self.alert_frame_step = max(1, alert_frame_step)
+        history = alert_frames_before * self.alert_frame_step + 1
+        if motion_process is not None:
+            history += motion_process.slots
+        self.recent_frames = deque(maxlen=history)
+        self.pending_alert = None
+        self.motion_process = motion_process
+        self.events = events
+        self.motion_channel = motion_channel
+        self.boxes_shown = False
+        # The sequence numbers and JPEG frames waiting for the result
+        # of their analysis.
+        self.analyzed_frames = {}
+        # The latest encoded frame is kept for the snapshots.
+        self.latest_frame = None
+        self.frame_sequence = 0
+        self.frame_condition = threading.Condition()
 
     def get_frame(self) -> bytes:
         """
@@ -104,56 +193,138 @@ class Camera:
             frame_data: bytes
                 The frame captured as bytes.
         """
-        self.camera.start()
-        with self.streamOut.condition:
-            self.streamOut.condition.wait()
-            frame_data = self.streamOut.frame
-        image = Image.open(io.BytesIO(frame_data))  
-        # Convert to grayscale and apply Gaussian blur.
-        image_process = image.convert('L').filter(ImageFilter.GaussianBlur(radius=2))  
-        if self.previous_image is not None and not self.silent:
-            self.detect_motion(self.previous_image, image_process, image)
+        # Includes the wait for the encoder to produce the next frame.
+        with CAPTURE.time():
+            frame_data = self.source.read_jpeg()
+        with self.frame_condition:
+            self.latest_frame = frame_data
+            self.frame_sequence += 1
+            sequence = self.frame_sequence
+            self.frame_condition.notify_all()
+        self.recent_frames.append((sequence, frame_data))
+        if self.pending_alert is not None:
+            self.collect_alert_frame(sequence, frame_data)
+        if self.silent:
+            return frame_data
+        # The luma plane comes straight from the analysis stream
+        # so the JPEG frame is never decoded.
+        with LUMA.time():
+            luma = self.analysis_source.read_luma()
+        if self.motion_process is not None:
+            self.analyze_in_process(luma, sequence, frame_data)
+            return frame_data
+        image_process = self.motion.prepare(luma)
+        if self.previous_image is not None:
+            with DETECT.time():
+                self.detect_motion(self.previous_image, image_process, sequence, frame_data)
         self.previous_image = image_process
         return frame_data
 
-    def detect_motion(self, previous_image: Image.Image, current_image: Image.Image, image: Image.Image):
+    def analyze_in_process(self, luma: np.ndarray, frame_sequence: int, frame: bytes):
+        """
+        Hands a luma frame over to the motion process and acts on
+        the results it returned for the previous frames.
+
+        Parameters
+        ----------
+            luma: np.ndarray
+                The current luma frame.
+
+            frame_sequence: int
+                The sequence number of the JPEG frame.
+
+            frame: bytes
+                The JPEG frame of the luma frame.
+        """
+        sequence = self.motion_process.submit(luma)
+        if sequence is not None:
+            self.analyzed_frames[sequence] = (frame_sequence, frame)
+        for sequence, result in self.motion_process.collect():
+            analyzed_sequence, image = self.analyzed_frames.get(sequence, (frame_sequence, frame))
+            with DETECT.time():
+                self.handle_motion(result, analyzed_sequence, image)
+        # Frames which were skipped or answered without result are released.
+        oldest = self.motion_process.sequence - self.motion_process.pending
+        for sequence in [s for s in self.analyzed_frames if s <= oldest]:
+            del self.analyzed_frames[sequence]
+
+    def detect_motion(
+            self,
+            previous_image: np.ndarray,
+            current_image: np.ndarray,
+            sequence: int,
+            image: bytes
+        ):
         """
         Detects any motion at a set threshold. Notifies via email if motion
         is detected. A cooldown factor is in effect to avoid email spamming.
 
         Parameters
         ----------
-            previous_image: Image.Image
-                This is the previous frame.
+            previous_image: np.ndarray
+                This is the previous prepared luma frame.
+
+            current_image: np.ndarray
+                This is the current prepared luma frame.
+
+            sequence: int
+                The sequence number of the JPEG frame.
+
+            image: bytes
+                This is the JPEG frame to send by mail.
+        """
+        # Sensitivity thresholds and regions are set in the motion configuration.
+        self.handle_motion(self.motion.analyze(previous_image, current_image), sequence, image)
+
+    def handle_motion(self, result: MotionResult, sequence: int, image: bytes):
+        """
+        Updates the recorder, publishes the motion boxes and sends the
+        alerts for a motion result.
+
+        Parameters
+        ----------
+            result: MotionResult
+                The result of the analysis of the current frame.
 
-            current_image: Image.Image
-                This is the current frame.
+            sequence: int
+                The sequence number of the analyzed JPEG frame.
 
-            image: Image.Image
-                This is the colored image to send by mail.
+            image: bytes
+                This is the JPEG frame to send by mail.
         """
         current_time = time.time()
-        diff = ImageChops.difference(previous_image, current_image)
-        # Adjust 40 to change sensitivity. Higher is less sensitve.
-        diff = diff.point(lambda x: x > 40 and 255)    
-        count = np.sum(np.array(diff) > 0)
-        # Sensitivity threshold for motion.
-        if count > 500:  
+        self.last_result = result
+        # The boxes are only sent while there are any, and once to clear them.
+        if self.motion_channel is not None and (result.boxes or self.boxes_shown):
+            self.motion_channel.publish({
+                "time": current_time,
+                "motion": result.motion,
+                "boxes": result.boxes,
+            })
+            self.boxes_shown = bool(result.boxes)
+        if self.recorder is not None:
+            if self.last_result.motion:
+                self.recorder.motion(current_time)
+            self.recorder.update(current_time)
+        if self.last_result.motion:
+            MOTION_FRAMES.inc()
+            alerted = False
             if self.email_allowed:
                 # Motion is detected and email is allowed.
-                if (self.last_motion_time is None or 
+                if self.notifier is None:
+                    pass
+                elif (self.last_motion_time is None or 
                     (current_time - self.last_motion_time > self.cooldown)):
-                    image_bytes = image2bytes(image)
-                    send_email(
+                    self.queue_alert(
                         "[Surveillance] - Motion Detected Alert", 
                         f"Motion has been detected by your camera at {show_time()} in {self.credentials.location}.", 
-                        self.credentials.sender_email, 
-                        self.credentials.sender_password,
-                        self.credentials.receivers, 
-                        image_bytes,
+                        sequence,
+                        image,
                     )
+                    ALERTS.inc()
+                    alerted = True
                     logger(
-                        f"Motion detected and email sent to {self.credentials.receivers}."
+                        f"Motion detected and email queued for {self.credentials.receivers}."
                     )
                     # Update the last motion time.
                     self.last_motion_time = current_time  
@@ -164,6 +335,17 @@ class Camera:
             else:
                 logger("Motion detected but email was not sent due to recent activity.")
             self.last_motion_detected_time = current_time
+            if self.events is not None:
+                recording = self.recorder.current_file if self.recorder is not None else None
+                self.events.motion(
+                    "main",
+                    current_time,
+                    result.score,
+                    regions=self.motion.affected_regions(result.tiles, result.shape),
+                    bounds=result.bounds(),
+                    media=[recording] if recording is not None else [],
+                    alerted=alerted,
+                )
         else:
             # No motion detected.
             if (self.last_motion_detected_time and 
@@ -176,40 +358,204 @@ class Camera:
                 # Reset to prevent message re-printing.
                 self.last_motion_detected_time = current_time  
 
-    def video_snap(self):
+    def queue_alert(self, subject: str, body: str, sequence: int, image: bytes):
+        """
+        Prepares a motion alert with the trigger frame and the preceding
+        frames of the ring buffer. The alert is sent once the following
+        frames have been collected.
+
+        Parameters
+        ----------
+            subject: str
+                The subject of the alert.
+
+            body: str
+                The body of the alert.
+
+            sequence: int
+                The sequence number of the trigger frame.
+
+            image: bytes
+                The JPEG frame which triggered the alert.
+        """
+        self.pending_alert = {
+            "subject": subject,
+            "body": body,
+            "images": self.frames_before(sequence) + [image],
+            "sequence": sequence,
+            "last": sequence + self.alert_frames_after * self.alert_frame_step,
+        }
+        # The results of the motion process arrive after the frames
+        # following the trigger, which are already in the ring buffer.
+        for number, frame in list(self.recent_frames):
+            if number > sequence and self.pending_alert is not None:
+                self.collect_alert_frame(number, frame)
+        if self.pending_alert is not None and self.pending_alert["last"] == sequence:
+            self.send_alert()
+
+    def frames_before(self, sequence: int) -> List[bytes]:
+        """
+        Selects the frames of the ring buffer preceding a frame at
+        alert_frame_step spacing.
+
+        Parameters
+        ----------
+            sequence: int
+                The sequence number of the trigger frame.
+
+        Returns
+        -------
+            frames: List[bytes]
+                Up to alert_frames_before JPEG frames, the oldest first.
+        """
+        wanted = set(
+            sequence - self.alert_frame_step * count
+            for count in range(1, self.alert_frames_before + 1)
+        )
+        frames = []
+        for number, frame in self.recent_frames:
+            if number in wanted:
+                frames.append(frame)
+        return frames
+
+    def collect_alert_frame(self, sequence: int, frame: bytes):
+        """
+        Attaches the frames following the trigger to the pending alert.
+
+        Parameters
+        ----------
+            sequence: int
+                The sequence number of the frame.
+
+            frame: bytes
+                The latest JPEG frame.
+        """
+        alert = self.pending_alert
+        if sequence <= alert["sequence"]:
+            return
+        if (sequence - alert["sequence"]) % self.alert_frame_step == 0:
+            alert["images"].append(frame)
+        if sequence >= alert["last"]:
+            self.send_alert()
+
+    def send_alert(self):
+        """
+        Hands the pending alert to the notifier.
+        """
+        alert, self.pending_alert = self.pending_alert, None
+        self.notifier.notify(alert["subject"], alert["body"], alert["images"])
+
+    def wait_for_frame(self, sequence: int=0, timeout: float=2.0) -> Tuple[int, bytes]:
+        """
+        Waits for a frame more recent than the given sequence number.
+
+        Parameters
+        ----------
+            sequence: int
+                The sequence number of the last frame taken.
+
+            timeout: float
+                The maximum time in seconds to wait.
+
+        Returns
+        -------
+            sequence, frame: Tuple[int, bytes]
+                The sequence number and the JPEG frame.
+
+        Raises
+        ------
+            TimeoutError
+                Raised if no frame was captured in time.
+        """
+        with self.frame_condition:
+            if not self.frame_condition.wait_for(
+                    lambda: self.frame_sequence > sequence, timeout):
+                raise TimeoutError("No frame was captured.")
+            return self.frame_sequence, self.latest_frame
+
+    def snap_path(self, timestamp: datetime, suffix: str="") -> str:
+        """
+        Returns the path of a snapshot in the images directory.
+        """
+        return os.path.join(self.images_directory, f"snap_{timestamp}{suffix}.jpg")
+
+    def video_snap(self) -> str:
         """
         Takes a snapshot of the videostream and storing the 
-        frame inside the images directory passed.
+        frame inside the images directory passed. The latest
+        frame of the stream is stored as it is, so the live feed
+        and the recordings are not interrupted.
+
+        Returns
+        -------
+            path: str
+                The path of the stored snapshot.
         """
         timestamp = datetime.now()
         if not self.silent:
             logger(f"Snap - [timestamp]: {timestamp}")
-        self.still_config = self.camera.create_still_configuration()
-        self.file_output = os.path.join(self.images_directory, f"snap_{timestamp}.jpg")
-        self.job = self.camera.switch_mode_and_capture_file(
-            self.still_config, self.file_output, wait=False)
-        self.metadata = self.camera.wait(self.job)
+        _, frame = self.wait_for_frame(self.frame_sequence - 1)
+        self.file_output = self.snap_path(timestamp)
+        with open(self.file_output, "wb") as fp:
+            fp.write(frame)
+        return self.file_output
 
-class StreamingOutput(io.BufferedIOBase):
-    """
-    The object to direct video streaming. 
-    """
-    def __init__(self):
-        self.frame = None
-        self.condition = threading.Condition()
+    def burst_snap(self, count: int, interval: float=0) -> List[str]:
+        """
+        Takes a burst of snapshots of the videostream. Each snapshot
+        is a different frame of the stream.
+
+        Parameters
+        ----------
+            count: int
+                The number of snapshots.
 
-    def write(self, buf: bytes):
+            interval: float
+                The minimum time in seconds between the snapshots.
+
+        Returns
+        -------
+            paths: List[str]
+                The paths of the stored snapshots.
         """
-        Write to the current frame. 
+        timestamp = datetime.now()
+        if not self.silent:
+            logger(f"Burst of {count} snaps - [timestamp]: {timestamp}")
+        paths = []
+        sequence = self.frame_sequence - 1
+        next_time = time.monotonic()
+        for i in range(count):
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_time = time.monotonic() + interval
+            sequence, frame = self.wait_for_frame(sequence)
+            path = self.snap_path(timestamp, f"_{i + 1:02d}")
+            with open(path, "wb") as fp:
+                fp.write(frame)
+            paths.append(path)
+        return paths
+
+    def still_snap(self, path: str) -> str:
+        """
+        Takes a full resolution still picture. The camera switches
+        the sensor mode, which pauses the stream and the recordings,
+        so the stills should be queued and rate limited.
 
         Parameters
         ----------
-            buf: bytes
-                The current frame stored in a buffer.
+            path: str
+                The path of the JPEG file to write.
+
+        Returns
+        -------
+            path: str
+                The path of the stored picture.
         """
-        with self.condition:
-            self.frame = buf
-            self.condition.notify_all()
+        if not self.silent:
+            logger(f"Full resolution still - [path]: {path}")
+        self.source.capture_still(path)
+        return path
 
 if __name__ == '__main__':
     camera = Camera()
\ No newline at end of file
@@ -0,0 +1,700 @@
+from __future__ import annotations
+from typing import List, Optional, Tuple
+from surveillance.metrics import stage
+from PIL import Image, ImageDraw
+import numpy as np
+import math
+import io
+
+RESIZE = stage("resize")
+BLUR = stage("blur")
+DIFF = stage("diff")
+TILES = stage("tiles")
+BOXES = stage("boxes")
+
+def label_components(mask: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    Labels the 4-connected components of a boolean mask. Neighbouring
+    foreground pixels are merged by hooking the larger root onto the
+    smaller one and compressing the parent pointers, all vectorized
+    over the pixel pairs, so the number of passes grows with the
+    logarithm of the component size.
+
+    Parameters
+    ----------
+        mask: np.ndarray
+            The (height, width) boolean mask.
+
+    Returns
+    -------
+        labels: np.ndarray
+            The int32 (height, width) labels. Background is 0 and
+            the components are numbered from 1.
+
+        count: int
+            The number of components.
+    """
+    labels = np.zeros(mask.shape, dtype=np.int32)
+    count = int(np.count_nonzero(mask))
+    if count == 0:
+        return labels, 0
+    # Number the foreground pixels and list their neighbouring pairs.
+    index = np.full(mask.shape, -1, dtype=np.int64)
+    index[mask] = np.arange(count)
+    vertical = mask[1:] & mask[:-1]
+    horizontal = mask[:, 1:] & mask[:, :-1]
+    first = np.concatenate((index[:-1][vertical], index[:, :-1][horizontal]))
+    second = np.concatenate((index[1:][vertical], index[:, 1:][horizontal]))
+
+    parent = np.arange(count)
+    while True:
+        roots_first, roots_second = parent[first], parent[second]
+        pending = roots_first != roots_second
+        if not pending.any():
+            break
+        low = np.minimum(roots_first[pending], roots_second[pending])
+        high = np.maximum(roots_first[pending], roots_second[pending])
+        np.minimum.at(parent, high, low)
+        # Point every pixel directly at its root.
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        first, second = first[pending], second[pending]
+    roots, inverse = np.unique(parent, return_inverse=True)
+    labels[mask] = inverse.reshape(-1) + 1
+    return labels, len(roots)
+
+def component_boxes(mask: np.ndarray, min_area: int=16, cell: int=4) -> np.ndarray:
+    """
+    Extracts the bounding boxes of the connected groups of a mask. The
+    changed pixels are grouped over a grid of cells, so the fragments
+    of one object in the same or adjacent cells form a single box, and
+    the boxes enclose the pixels of the mask itself.
+
+    Parameters
+    ----------
+        mask: np.ndarray
+            The (height, width) boolean mask.
+
+        min_area: int
+            The minimum number of pixels of a box.
+
+        cell: int
+            The size in pixels of the grouping cells.
+
+    Returns
+    -------
+        boxes: np.ndarray
+            The (boxes, 5) int array of the left, top, right and bottom
+            pixel edges (exclusive) and the pixel count of each box,
+            the largest first.
+    """
+    ys, xs = np.nonzero(mask)
+    if len(ys) == 0:
+        return np.zeros((0, 5), dtype=np.int64)
+    height, width = mask.shape
+    rows, columns = ys // cell, xs // cell
+    cells = np.zeros((-(-height // cell), -(-width // cell)), dtype=bool)
+    cells[rows, columns] = True
+    labels, _ = label_components(cells)
+    ids = labels[rows, columns]
+    order = np.argsort(ids, kind="stable")
+    ids, ys, xs = ids[order], ys[order], xs[order]
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    boxes = np.stack((
+        np.minimum.reduceat(xs, starts),
+        np.minimum.reduceat(ys, starts),
+        np.maximum.reduceat(xs, starts) + 1,
+        np.maximum.reduceat(ys, starts) + 1,
+        np.diff(np.r_[starts, len(ids)]),
+    ), axis=1)
+    boxes = boxes[boxes[:, 4] >= min_area]
+    return boxes[np.argsort(-boxes[:, 4], kind="stable")]
+
+class MotionResult:
+    """
+    The outcome of comparing two frames.
+
+    Parameters
+    ----------
+        count: int
+            The number of changed pixels inside the regions of interest.
+
+        tiles: np.ndarray
+            The (rows, columns) boolean grid of tiles which exceeded
+            their threshold.
+
+        score: int
+            The size of the largest group of adjacent active tiles.
+
+        motion: bool
+            Specifies whether the frames constitute motion.
+
+        boxes: List[List[float]]
+            The [left, top, right, bottom] boxes of the moving objects,
+            normalized between 0 and 1. Only extracted with motion.
+
+        shape: tuple
+            The (height, width) of the compared frames.
+    """
+    def __init__(
+            self,
+            count: int,
+            tiles: np.ndarray,
+            score: int,
+            motion: bool,
+            boxes: Optional[List[List[float]]]=None,
+            shape: Optional[Tuple[int, int]]=None
+        ) -> None:
+        self.count = count
+        self.tiles = tiles
+        self.score = score
+        self.motion = motion
+        self.boxes = boxes or []
+        self.shape = shape
+
+    def bounds(self) -> Optional[List[float]]:
+        """
+        Returns the box enclosing the active tiles.
+
+        Returns
+        -------
+            bounds: List[float]
+                The [left, top, right, bottom] edges normalized between
+                0 and 1, or None if no tile is active.
+        """
+        rows = np.flatnonzero(self.tiles.any(axis=1))
+        columns = np.flatnonzero(self.tiles.any(axis=0))
+        if len(rows) == 0:
+            return None
+        height, width = self.tiles.shape
+        return [
+            columns[0] / width, rows[0] / height,
+            (columns[-1] + 1) / width, (rows[-1] + 1) / height,
+        ]
+
+class MotionDetector:
+    """
+    Vectorized motion detection engine operating on luma (grayscale)
+    NumPy arrays at a reduced analysis resolution. Frames are scored
+    over a coarse grid of tiles. A tile is active when its changed
+    pixels exceed its threshold and motion is reported when enough
+    adjacent tiles are active. Only the box enclosing the tiles of
+    the regions of interest is differenced, and the pixels outside
+    of the regions within it are masked out.
+
+    Parameters
+    ----------
+        pixel_threshold: int
+            The minimum absolute luma difference for a pixel to be
+            considered changed. Higher is less sensitive.
+
+        tile_size: int
+            The size in pixels (at the analysis resolution)
+            of the square tiles.
+
+        tile_threshold: int
+            The number of changed pixels required to activate a tile.
+
+        min_tiles: int
+            The number of adjacent active tiles required to report motion.
+
+        regions: list
+            The regions of interest. Each region is a dictionary with a
+            "polygon" of [x, y] points normalized between 0 and 1, an
+            optional "exclude" flag to mask the region out instead, an
+            optional "tile_threshold" for the tiles inside it and an
+            optional "name" reported in the motion events. When only
+            excluded regions are set, the rest of the frame is used.
+
+        analysis_size: tuple
+            The (width, height) at which frames are analyzed. Set to
+            None to analyze frames at their original resolution.
+
+        blur: str
+            The smoothing filter applied before differencing.
+            Available filters are "box", "gaussian", or None.
+
+        blur_radius: int
+            The radius in pixels of the smoothing filter.
+
+        min_box_area: int
+            The minimum number of changed pixels of a motion box.
+
+        box_cell: int
+            The size in pixels of the cells grouping the changed pixels
+            into motion boxes. The pixels in the same or adjacent cells
+            belong to the same box.
+
+        max_boxes: int
+            The maximum number of motion boxes, the largest first.
+            No boxes are extracted if 0.
+    """
+    def __init__(
+            self,
+            pixel_threshold: int=40,
+            tile_size: int=16,
+            tile_threshold: int=32,
+            min_tiles: int=2,
+            regions: Optional[List[dict]]=None,
+            analysis_size: Optional[Tuple[int, int]]=(320, 240),
+            blur: Optional[str]="box",
+            blur_radius: int=2,
+            min_box_area: int=16,
+            box_cell: int=4,
+            max_boxes: int=16,
+        ) -> None:
+
+        if blur not in (None, "box", "gaussian"):
+            raise ValueError(f"Unsupported blur filter: {blur}")
+        self.pixel_threshold = int(pixel_threshold)
+        self.tile_size = int(tile_size)
+        self.tile_threshold = int(tile_threshold)
+        self.min_tiles = int(min_tiles)
+        self.regions = list(regions or [])
+        self.analysis_size = tuple(analysis_size) if analysis_size else None
+        self.blur = blur
+        self.blur_radius = int(blur_radius)
+        self.min_box_area = int(min_box_area)
+        self.box_cell = max(1, int(box_cell))
+        self.max_boxes = int(max_boxes)
+        self._kernel = self._gaussian_kernel(self.blur_radius)
+        self._indices = {}
+        self._buffers = {}
+        self._layouts = {}
+        if self.analysis_size is not None:
+            # Rasterize the regions of interest once at startup.
+            self.layout((self.analysis_size[1], self.analysis_size[0]))
+
+    @classmethod
+    def from_configuration(cls, configuration: dict) -> MotionDetector:
+        """
+        Creates a motion detector from the "motion" section
+        of the JSON configuration.
+
+        Parameters
+        ----------
+            configuration: dict
+                The motion settings. Missing keys use the defaults.
+
+        Returns
+        -------
+            detector: MotionDetector
+                The configured motion detector.
+        """
+        return cls(**configuration)
+
+    @staticmethod
+    def _gaussian_kernel(radius: int) -> np.ndarray:
+        """
+        Builds a normalized 1D gaussian kernel.
+
+        Parameters
+        ----------
+            radius: int
+                The standard deviation of the gaussian.
+
+        Returns
+        -------
+            kernel: np.ndarray
+                The float32 kernel of length 2 * ceil(2 * radius) + 1.
+        """
+        if radius <= 0:
+            return np.ones(1, dtype=np.float32)
+        half = int(math.ceil(2 * radius))
+        x = np.arange(-half, half + 1, dtype=np.float32)
+        kernel = np.exp(-(x * x) / (2.0 * radius * radius))
+        return (kernel / kernel.sum()).astype(np.float32)
+
+    def luma_from_jpeg(self, frame: bytes) -> np.ndarray:
+        """
+        Decodes the luma plane of a JPEG frame. The decoder is asked
+        for grayscale at the smallest DCT scale not below the analysis
+        resolution which avoids colour conversion and most of the
+        full resolution decode.
+
+        Parameters
+        ----------
+            frame: bytes
+                The JPEG encoded frame.
+
+        Returns
+        -------
+            luma: np.ndarray
+                The uint8 (height, width) luma array.
+        """
+        image = Image.open(io.BytesIO(frame))
+        if self.analysis_size is not None:
+            image.draft('L', self.analysis_size)
+        if image.mode != 'L':
+            image = image.convert('L')
+        return np.asarray(image)
+
+    def resize(self, luma: np.ndarray) -> np.ndarray:
+        """
+        Resamples a luma array to the analysis resolution using
+        nearest neighbour sampling with cached indices.
+
+        Parameters
+        ----------
+            luma: np.ndarray
+                The uint8 (height, width) luma array.
+
+        Returns
+        -------
+            luma: np.ndarray
+                The luma array at the analysis resolution.
+        """
+        if self.analysis_size is None:
+            return luma
+        width, height = self.analysis_size
+        if luma.shape == (height, width):
+            return luma
+        indices = self._indices.get(luma.shape)
+        if indices is None:
+            rows = (np.arange(height) * luma.shape[0]) // height
+            cols = (np.arange(width) * luma.shape[1]) // width
+            indices = np.ix_(rows, cols)
+            self._indices[luma.shape] = indices
+        return luma[indices]
+
+    def smooth(self, luma: np.ndarray) -> np.ndarray:
+        """
+        Applies the separable smoothing filter.
+
+        Parameters
+        ----------
+            luma: np.ndarray
+                The uint8 (height, width) luma array.
+
+        Returns
+        -------
+            luma: np.ndarray
+                The smoothed uint8 luma array.
+        """
+        if self.blur is None or self.blur_radius <= 0:
+            return luma
+        if self.blur == "box":
+            out = self._box_1d(luma.astype(np.float32), self.blur_radius, 0)
+            out = self._box_1d(out, self.blur_radius, 1)
+        else:
+            out = self._convolve_1d(luma.astype(np.float32), self._kernel, 0)
+            out = self._convolve_1d(out, self._kernel, 1)
+        return (out + 0.5).astype(np.uint8)
+
+    @staticmethod
+    def _box_1d(array: np.ndarray, radius: int, axis: int) -> np.ndarray:
+        """
+        Box filter along one axis computed with a running sum.
+        """
+        size = 2 * radius + 1
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (radius + 1, radius)
+        csum = np.cumsum(np.pad(array, pad, mode='edge'), axis=axis)
+        n = array.shape[axis]
+        if axis == 0:
+            return (csum[size:size + n] - csum[:n]) * (1.0 / size)
+        return (csum[:, size:size + n] - csum[:, :n]) * (1.0 / size)
+
+    @staticmethod
+    def _convolve_1d(array: np.ndarray, kernel: np.ndarray, axis: int) -> np.ndarray:
+        """
+        Convolves along one axis as a weighted sum of shifted views.
+        """
+        half = len(kernel) // 2
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (half, half)
+        padded = np.pad(array, pad, mode='edge')
+        n = array.shape[axis]
+        out = np.zeros_like(array)
+        for i, weight in enumerate(kernel):
+            if axis == 0:
+                out += weight * padded[i:i + n]
+            else:
+                out += weight * padded[:, i:i + n]
+        return out
+
+    def prepare(self, luma: np.ndarray) -> np.ndarray:
+        """
+        Prepares a luma frame for differencing by resizing it to the
+        analysis resolution and smoothing it.
+
+        Parameters
+        ----------
+            luma: np.ndarray
+                The uint8 (height, width) luma array.
+
+        Returns
+        -------
+            luma: np.ndarray
+                The prepared uint8 luma array.
+        """
+        with RESIZE.time():
+            luma = self.resize(luma)
+        with BLUR.time():
+            return self.smooth(luma)
+
+    def difference_mask(self, previous: np.ndarray, current: np.ndarray) -> np.ndarray:
+        """
+        Computes the mask of changed pixels between two prepared frames.
+        The absolute difference is computed in uint8 using preallocated
+        buffers to avoid integer promotion and per-frame allocations.
+
+        Parameters
+        ----------
+            previous: np.ndarray
+                The previous prepared luma frame.
+
+            current: np.ndarray
+                The current prepared luma frame.
+
+        Returns
+        -------
+            mask: np.ndarray
+                The boolean mask of pixels which changed above
+                the pixel threshold. The buffer is reused by the
+                next call.
+        """
+        buffers = self._buffers.get(current.shape)
+        if buffers is None:
+            buffers = (
+                np.empty(current.shape, dtype=np.uint8),
+                np.empty(current.shape, dtype=np.uint8),
+                np.empty(current.shape, dtype=bool)
+            )
+            self._buffers[current.shape] = buffers
+        high, low, mask = buffers
+        np.maximum(previous, current, out=high)
+        np.minimum(previous, current, out=low)
+        np.subtract(high, low, out=high)
+        return np.greater(high, self.pixel_threshold, out=mask)
+
+    def changed_pixels(self, previous: np.ndarray, current: np.ndarray) -> int:
+        """
+        Counts the pixels which changed between two prepared frames.
+
+        Parameters
+        ----------
+            previous: np.ndarray
+                The previous prepared luma frame.
+
+            current: np.ndarray
+                The current prepared luma frame.
+
+        Returns
+        -------
+            count: int
+                The number of changed pixels.
+        """
+        return int(np.count_nonzero(self.difference_mask(previous, current)))
+
+    def layout(self, shape: Tuple[int, int]) -> dict:
+        """
+        Rasterizes the regions of interest and builds the tile grid for
+        a frame shape. The layout is cached per frame shape.
+
+        Parameters
+        ----------
+            shape: tuple
+                The (height, width) of the prepared frames.
+
+        Returns
+        -------
+            layout: dict
+                The "grid" (rows, columns), the "crop" slices covering
+                the enabled tiles, the pixel "mask" inside the crop (None
+                when every pixel is used), the tile "edges" inside the
+                crop, the tile "thresholds" (infinite when disabled) and
+                the "tiles" slices of the crop within the grid and
+                the (name, tiles) grid of each included region.
+        """
+        layout = self._layouts.get(shape)
+        if layout is not None:
+            return layout
+        height, width = shape
+        size = self.tile_size
+        rows, columns = -(-height // size), -(-width // size)
+
+        def rasterize(polygon: list) -> np.ndarray:
+            image = Image.new('L', (width, height), 0)
+            points = [(x * width, y * height) for x, y in polygon]
+            ImageDraw.Draw(image).polygon(points, fill=1)
+            return np.asarray(image, dtype=bool)
+
+        included = [r for r in self.regions if not r.get("exclude", False)]
+        mask = np.zeros(shape, dtype=bool) if included else np.ones(shape, dtype=bool)
+        thresholds = np.full((rows, columns), float(self.tile_threshold))
+        centers_y = np.minimum(np.arange(rows) * size + size // 2, height - 1)
+        centers_x = np.minimum(np.arange(columns) * size + size // 2, width - 1)
+        y_edges = np.minimum(np.arange(rows + 1) * size, height)
+        x_edges = np.minimum(np.arange(columns + 1) * size, width)
+
+        def covered(area: np.ndarray) -> np.ndarray:
+            return np.add.reduceat(
+                np.add.reduceat(area.astype(np.int32), y_edges[:-1], axis=0),
+                x_edges[:-1], axis=1) > 0
+
+        regions = []
+        for index, region in enumerate(self.regions):
+            area = rasterize(region["polygon"])
+            if region.get("exclude", False):
+                mask &= ~area
+            else:
+                mask |= area
+                regions.append((region.get("name", f"region {index}"), covered(area)))
+            if "tile_threshold" in region:
+                inside = area[np.ix_(centers_y, centers_x)]
+                thresholds[inside] = float(region["tile_threshold"])
+
+        # Tiles without a single pixel of interest are disabled.
+        enabled = covered(mask)
+        thresholds[~enabled] = np.inf
+
+        if enabled.any():
+            tile_rows = np.flatnonzero(enabled.any(axis=1))
+            tile_columns = np.flatnonzero(enabled.any(axis=0))
+            r0, r1 = tile_rows[0], tile_rows[-1] + 1
+            c0, c1 = tile_columns[0], tile_columns[-1] + 1
+        else:
+            r0 = r1 = c0 = c1 = 0
+        crop = (slice(y_edges[r0], y_edges[r1]), slice(x_edges[c0], x_edges[c1]))
+        crop_mask = mask[crop]
+        layout = {
+            "grid": (rows, columns),
+            "crop": crop,
+            "mask": None if crop_mask.all() else crop_mask,
+            "edges": (y_edges[r0:r1 + 1] - y_edges[r0], x_edges[c0:c1 + 1] - x_edges[c0]),
+            "thresholds": thresholds[r0:r1, c0:c1],
+            "tiles": (slice(r0, r1), slice(c0, c1)),
+            "regions": regions,
+        }
+        self._layouts[shape] = layout
+        return layout
+
+    def affected_regions(self, tiles: np.ndarray, shape: Tuple[int, int]) -> List[str]:
+        """
+        Lists the regions of interest overlapping the active tiles.
+
+        Parameters
+        ----------
+            tiles: np.ndarray
+                The (rows, columns) grid of active tiles of a result.
+
+            shape: tuple
+                The (height, width) of the frames of the result.
+
+        Returns
+        -------
+            names: List[str]
+                The "name" of each included region with an active tile,
+                "region <index>" for the regions without a name.
+        """
+        layout = self.layout(tuple(shape))
+        return [name for name, area in layout["regions"] if (area & tiles).any()]
+
+    def tile_counts(self, changed: np.ndarray, edges: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+        """
+        Counts the changed pixels of each tile with a summed-area table.
+
+        Parameters
+        ----------
+            changed: np.ndarray
+                The boolean mask of changed pixels.
+
+            edges: tuple
+                The row and column pixel edges of the tiles.
+
+        Returns
+        -------
+            counts: np.ndarray
+                The (rows, columns) changed pixel counts per tile.
+        """
+        height, width = changed.shape
+        table = self._buffers.get(("table", changed.shape))
+        if table is None:
+            table = np.zeros((height + 1, width + 1), dtype=np.int32)
+            self._buffers[("table", changed.shape)] = table
+        np.cumsum(changed, axis=0, dtype=np.int32, out=table[1:, 1:])
+        np.cumsum(table[1:, 1:], axis=1, dtype=np.int32, out=table[1:, 1:])
+        corners = table[np.ix_(*edges)]
+        return corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+
+    def motion_boxes(
+            self,
+            changed: np.ndarray,
+            crop: Tuple[slice, slice],
+            shape: Tuple[int, int]
+        ) -> List[List[float]]:
+        """
+        Extracts the boxes of the moving objects from the changed pixels.
+
+        Parameters
+        ----------
+            changed: np.ndarray
+                The boolean mask of changed pixels inside the crop.
+
+            crop: tuple
+                The row and column slices of the crop in the frame.
+
+            shape: tuple
+                The (height, width) of the prepared frames.
+
+        Returns
+        -------
+            boxes: List[List[float]]
+                The [left, top, right, bottom] boxes normalized between
+                0 and 1, the largest first.
+        """
+        height, width = shape
+        boxes = component_boxes(changed, self.min_box_area, self.box_cell)[:self.max_boxes]
+        x, y = crop[1].start or 0, crop[0].start or 0
+        return [
+            [round((x + left) / width, 4), round((y + top) / height, 4),
+             round((x + right) / width, 4), round((y + bottom) / height, 4)]
+            for left, top, right, bottom, _ in boxes.tolist()
+        ]
+
+    def analyze(self, previous: np.ndarray, current: np.ndarray) -> MotionResult:
+        """
+        Compares two prepared frames over the tiles of interest.
+
+        Parameters
+        ----------
+            previous: np.ndarray
+                The previous prepared luma frame.
+
+            current: np.ndarray
+                The current prepared luma frame.
+
+        Returns
+        -------
+            result: MotionResult
+                The changed pixels, active tiles, motion decision and
+                the boxes of the moving objects.
+        """
+        layout = self.layout(current.shape)
+        tiles = np.zeros(layout["grid"], dtype=bool)
+        thresholds = layout["thresholds"]
+        if thresholds.size == 0:
+            return MotionResult(0, tiles, 0, False, shape=current.shape)
+        with DIFF.time():
+            changed = self.difference_mask(previous[layout["crop"]], current[layout["crop"]])
+            if layout["mask"] is not None:
+                np.logical_and(changed, layout["mask"], out=changed)
+        with TILES.time():
+            counts = self.tile_counts(changed, layout["edges"])
+            active = counts > thresholds
+            tiles[layout["tiles"]] = active
+
+            score = 0
+            if active.any():
+                labels, _ = label_components(active)
+                score = int(np.bincount(labels.ravel())[1:].max())
+        motion = score >= self.min_tiles
+        boxes = []
+        if motion and self.max_boxes > 0:
+            with BOXES.time():
+                boxes = self.motion_boxes(changed, layout["crop"], current.shape)
+        return MotionResult(int(counts.sum()), tiles, score, motion, boxes, current.shape)
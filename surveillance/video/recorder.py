@@ -0,0 +1,213 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Callable, Optional
+if TYPE_CHECKING:
+    from picamera2.outputs import CircularOutput
+
+from surveillance.video.segments import SegmentWriter
+from surveillance.video.utils import show_time
+from surveillance import logger
+import threading
+import time
+import os
+
+class EventRecorder:
+    """
+    Records bounded video clips from the circular output. The frames
+    held by the circular buffer are written first, so each clip
+    includes the pre-roll seconds before it was started. In automatic
+    mode motion starts a clip which stops after a quiet period without
+    motion, or is split once it reaches the maximum duration.
+
+    Parameters
+    ----------
+        output: CircularOutput
+            The output of the video encoder holding the pre-roll buffer.
+
+        videos_directory: str
+            The directory to store the clips.
+
+        auto: bool
+            Specify whether motion starts recordings.
+
+        quiet_period: float
+            The time in seconds without motion before a clip is stopped.
+
+        max_duration: float
+            The maximum duration in seconds of a single clip.
+
+        on_finished: Callable[[str], None]
+            Called with the path of each finished clip: the .h264 file,
+            or the manifest of a segmented recording.
+
+        container: str
+            "h264" writes a raw .h264 file to convert once stopped.
+            "hls" writes fragmented MP4 segments and a manifest in a
+            directory per clip, playable while it is being recorded.
+
+        segment_duration: float
+            The target duration in seconds of the "hls" segments.
+
+        framerate: float
+            The frame rate of the encoded stream.
+
+        on_started: Callable[[str], None]
+            Called with the path of each clip when it starts.
+    """
+    def __init__(
+            self,
+            output: CircularOutput,
+            videos_directory: str,
+            auto: bool=False,
+            quiet_period: float=10,
+            max_duration: float=120,
+            on_finished: Optional[Callable[[str], None]]=None,
+            container: str="h264",
+            segment_duration: float=2,
+            framerate: float=30,
+            on_started: Optional[Callable[[str], None]]=None
+        ) -> None:
+
+        if container not in ("h264", "hls"):
+            raise ValueError(f"Unsupported recording container: {container}")
+
+        self.output = output
+        self.videos_directory = videos_directory
+        self.auto = auto
+        self.quiet_period = quiet_period
+        self.max_duration = max_duration
+        self.on_finished = on_finished
+        self.container = container
+        self.segment_duration = segment_duration
+        self.framerate = framerate
+        self.on_started = on_started
+        self.writer = None
+        self.current_file = None
+        self.manual = False
+        self.started_time = None
+        self.last_motion_time = None
+        self.lock = threading.Lock()
+
+    @property
+    def recording(self) -> bool:
+        """
+        Specifies whether a clip is being recorded.
+
+        Returns
+        -------
+            recording: bool
+                True if a clip is being recorded.
+        """
+        return self.current_file is not None
+
+    def _start(self, prefix: str, now: float) -> str:
+        """
+        Opens a new clip. The lock must be held.
+        """
+        basename = os.path.join(self.videos_directory, f"{prefix}_{show_time()}")
+        path, suffix = basename, 1
+        # Clips started within the same second must not overwrite each other.
+        while (os.path.exists(f"{path}.h264") or os.path.exists(f"{path}.mp4") or
+               os.path.exists(path)):
+            path = f"{basename}_{suffix}"
+            suffix += 1
+        if self.container == "hls":
+            self.writer = SegmentWriter(path, self.segment_duration, self.framerate)
+            self.current_file = self.writer.manifest
+            self.output.fileoutput = self.writer
+        else:
+            self.current_file = f"{path}.h264"
+            self.output.fileoutput = self.current_file
+        self.output.start()
+        self.started_time = now
+        if self.on_started is not None:
+            self.on_started(self.current_file)
+        return self.current_file
+
+    def _stop(self) -> Optional[str]:
+        """
+        Closes the current clip. The lock must be held.
+        """
+        if self.current_file is None:
+            return None
+        self.output.stop()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        path = self.current_file
+        self.current_file = None
+        self.manual = False
+        self.started_time = None
+        if self.on_finished is not None:
+            self.on_finished(path)
+        return path
+
+    def start(self) -> str:
+        """
+        Starts a manual recording which lasts until stop is called.
+        An automatic clip in progress becomes manual.
+
+        Returns
+        -------
+            path: str
+                The path of the clip.
+        """
+        with self.lock:
+            self.manual = True
+            if self.current_file is None:
+                self._start("vid", time.time())
+            return self.current_file
+
+    def stop(self) -> Optional[str]:
+        """
+        Stops the current recording.
+
+        Returns
+        -------
+            path: str
+                The path of the finished clip or None
+                if nothing was recorded.
+        """
+        with self.lock:
+            return self._stop()
+
+    def motion(self, now: Optional[float]=None):
+        """
+        Notifies the recorder that motion was detected. Starts a clip
+        in automatic mode or extends the clip in progress.
+
+        Parameters
+        ----------
+            now: float
+                The time of the motion. The current time if None.
+        """
+        if not self.auto:
+            return
+        now = time.time() if now is None else now
+        with self.lock:
+            self.last_motion_time = now
+            if self.current_file is None:
+                path = self._start("event", now)
+                logger(f"Motion recording started: {os.path.basename(path)}")
+
+    def update(self, now: Optional[float]=None):
+        """
+        Stops or splits the automatic clip in progress once the quiet
+        period or the maximum duration has elapsed. Called once per frame.
+
+        Parameters
+        ----------
+            now: float
+                The current time. The current time if None.
+        """
+        if self.current_file is None or self.manual:
+            return
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.current_file is None or self.manual:
+                return
+            if now - self.last_motion_time > self.quiet_period:
+                path = self._stop()
+                logger(f"Motion recording stopped: {os.path.basename(path)}")
+            elif now - self.started_time > self.max_duration:
+                self._stop()
+                self._start("event", now)
@@ -0,0 +1,153 @@
+from surveillance import logger
+import subprocess
+import threading
+import time
+import os
+
+MANIFEST = "index.m3u8"
+
+class SegmentWriter:
+    """
+    A file-like output remuxing the H264 stream of the encoder into
+    fragmented MP4 segments and an HLS manifest as it is produced.
+    The recording is playable and seekable while it is in progress
+    and needs no conversion once it is stopped.
+
+    Parameters
+    ----------
+        directory: str
+            The directory of the recording. It holds the manifest, the
+            initialization segment and the media segments.
+
+        segment_duration: float
+            The target duration in seconds of each segment. Segments
+            are cut at keyframes.
+
+        framerate: float
+            The frame rate of the H264 stream.
+    """
+    def __init__(self, directory: str, segment_duration: float=2, framerate: float=30) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.manifest = os.path.join(directory, MANIFEST)
+        command = [
+            'ffmpeg', '-loglevel', 'error', '-fflags', '+genpts',
+            # Start segmenting without buffering seconds of the stream.
+            '-probesize', '32768', '-analyzeduration', '0',
+            '-f', 'h264', '-framerate', str(framerate), '-i', 'pipe:0',
+            '-c', 'copy', '-f', 'hls',
+            '-hls_time', str(segment_duration),
+            '-hls_playlist_type', 'event',
+            '-hls_segment_type', 'fmp4',
+            '-hls_fmp4_init_filename', 'init.mp4',
+            '-hls_segment_filename', os.path.join(directory, 'seg_%05d.m4s'),
+            self.manifest,
+        ]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        """
+        Passes encoded frames to ffmpeg.
+
+        Parameters
+        ----------
+            data: bytes
+                The H264 encoded frames.
+
+        Returns
+        -------
+            count: int
+                The number of bytes written.
+        """
+        if self.closed:
+            return 0
+        try:
+            return self.process.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            self.closed = True
+            logger(f"The segmenter of {self.directory} exited early.", code="WARNING")
+            return 0
+
+    def flush(self):
+        """
+        Flushes the frames written to ffmpeg.
+        """
+        if not self.closed:
+            try:
+                self.process.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                self.closed = True
+
+    def close(self):
+        """
+        Ends the stream so ffmpeg writes the last segment and closes the
+        manifest. The process is reaped from a background thread.
+        """
+        if self.closed and self.process.stdin.closed:
+            return
+        self.closed = True
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+        def reap():
+            if self.process.wait() != 0:
+                logger(f"ffmpeg failed to segment {self.directory}.", code="WARNING")
+
+        threading.Thread(target=reap, name="segment-reaper", daemon=True).start()
+
+def wait_for_manifest(manifest: str, timeout: float=30) -> bool:
+    """
+    Waits until ffmpeg has closed the manifest of a stopped recording.
+
+    Parameters
+    ----------
+        manifest: str
+            The path to the HLS manifest.
+
+        timeout: float
+            The maximum time in seconds to wait.
+
+    Returns
+    -------
+        closed: bool
+            True if the manifest lists all the segments.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with open(manifest) as f:
+                if "#EXT-X-ENDLIST" in f.read():
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+def close_manifest(manifest: str) -> bool:
+    """
+    Ends the manifest of a recording interrupted by a crash, so the
+    segments it lists play as a finished recording. The segments are
+    only listed once they are complete.
+
+    Parameters
+    ----------
+        manifest: str
+            The path to the HLS manifest.
+
+    Returns
+    -------
+        closed: bool
+            True if the end tag was appended, False if the manifest
+            was already closed.
+    """
+    with open(manifest, "r+") as f:
+        content = f.read()
+        if "#EXT-X-ENDLIST" in content:
+            return False
+        if content and not content.endswith("\n"):
+            f.write("\n")
+        f.write("#EXT-X-ENDLIST\n")
+    return True
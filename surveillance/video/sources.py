@@ -0,0 +1,657 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, List, Optional, Tuple
+if TYPE_CHECKING:
+    from picamera2.outputs import CircularOutput
+    from picamera2.encoders import H264Encoder
+
+from PIL import Image
+import numpy as np
+import subprocess
+import threading
+import inspect
+import glob
+import time
+import io
+import os
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+class StreamingOutput(io.BufferedIOBase):
+    """
+    The object to direct video streaming. Each encoded frame is
+    numbered and stored with the luma plane of its capture request.
+    """
+    def __init__(self):
+        self.frame = None
+        self.luma = None
+        self.pending_luma = None
+        self.sequence = 0
+        self.condition = threading.Condition()
+
+    def set_luma(self, luma: np.ndarray):
+        """
+        Stores the luma plane of a completed request until its
+        encoded frame is written.
+
+        Parameters
+        ----------
+            luma: np.ndarray
+                The uint8 (height, width) luma array.
+        """
+        with self.condition:
+            self.pending_luma = luma
+
+    def write(self, buf: bytes):
+        """
+        Write to the current frame.
+
+        Parameters
+        ----------
+            buf: bytes
+                The current frame stored in a buffer.
+        """
+        with self.condition:
+            self.frame = buf
+            self.luma = self.pending_luma
+            self.sequence += 1
+            self.condition.notify_all()
+
+class FrameSource:
+    """
+    Base class of the frame sources feeding the camera pipeline.
+    A source provides MJPEG encoded frames for streaming and luma
+    (grayscale) frames as uint8 NumPy arrays of shape (height, width)
+    for motion analysis.
+    """
+    def start(self):
+        """
+        Starts producing frames.
+        """
+        pass
+
+    def read_jpeg(self) -> bytes:
+        """
+        Waits for the next JPEG encoded frame.
+
+        Returns
+        -------
+            frame: bytes
+                The JPEG encoded frame.
+        """
+        raise NotImplementedError
+
+    def read_luma(self) -> np.ndarray:
+        """
+        Retrieves the luma frame matching the last JPEG frame.
+
+        Returns
+        -------
+            luma: np.ndarray
+                The uint8 (height, width) luma array.
+        """
+        raise NotImplementedError
+
+    def start_recording(self, encoder: H264Encoder, output: CircularOutput):
+        """
+        Starts the video encoder used for recordings. Sources
+        without an encoder ignore this call.
+
+        Parameters
+        ----------
+            encoder: H264Encoder
+                The encoder of the recordings.
+
+            output: CircularOutput
+                The output of the recordings.
+        """
+        pass
+
+    def capture_still(self, path: str):
+        """
+        Stores a still picture of the current frame.
+
+        Parameters
+        ----------
+            path: str
+                The path of the JPEG file to write.
+        """
+        with open(path, "wb") as fp:
+            fp.write(self.read_jpeg())
+
+    def close(self):
+        """
+        Releases any resources held by the source.
+        """
+        pass
+
+class PicameraSource(FrameSource):
+    """
+    Raspberry Pi camera module source using the picamera2 library.
+    The main stream is MJPEG encoded for streaming and the Y plane of
+    the low resolution YUV420 stream is read for motion analysis, so
+    no JPEG decoding or colour conversion is required. The Y plane is
+    taken from the capture request of each encoded frame, so a frame
+    is captured once.
+
+    Parameters
+    ----------
+        width: int
+            The width of the main stream.
+
+        height: int
+            The height of the main stream.
+
+        lores_size: tuple
+            The (width, height) of the lores stream.
+
+        bitrate: int
+            The bitrate of the MJPEG encoder.
+
+        camera_num: int
+            The index of the camera module on a device with several.
+
+        frame_timeout: float
+            The time in seconds to wait for a frame before the camera
+            is considered stalled.
+    """
+    def __init__(
+            self,
+            width: int=800,
+            height: int=600,
+            lores_size: Tuple[int, int]=(320, 240),
+            bitrate: int=10000000,
+            camera_num: int=0,
+            frame_timeout: float=5.0
+        ) -> None:
+
+        from picamera2.encoders import MJPEGEncoder
+        from picamera2.outputs import FileOutput
+        from picamera2 import Picamera2
+
+        self.lores_width, self.lores_height = lores_size
+        self.camera = Picamera2(camera_num)
+        self.camera.configure(
+            self.camera.create_video_configuration(
+                main={
+                    "size": (width, height)
+                },
+                lores={
+                    "size": lores_size,
+                    "format": "YUV420"
+                }))
+
+        self.encoder = MJPEGEncoder(bitrate)
+        self.streamOut = StreamingOutput()
+        self.streamOut2 = FileOutput(self.streamOut)
+        self.encoder.output = [self.streamOut2]
+        self.frame_timeout = frame_timeout
+        self.sequence = 0
+        self.luma = None
+        # Runs on the camera thread for each completed request.
+        self.camera.post_callback = self._on_request
+
+    def _on_request(self, request):
+        """
+        Keeps the Y plane of the lores stream of a completed request.
+        The rows of the YUV420 buffer may be padded so the plane is
+        cropped to size. The requests of the still mode, which has no
+        lores stream, are skipped.
+        """
+        if request.config.get("lores") is None:
+            return
+        array = request.make_array("lores")
+        self.streamOut.set_luma(array[:self.lores_height, :self.lores_width])
+
+    def start(self):
+        """
+        Starts the MJPEG encoder and the camera.
+        """
+        self.camera.start_encoder(self.encoder)
+        self.camera.start()
+
+    def start_recording(self, encoder: H264Encoder, output: CircularOutput):
+        """
+        Starts the video encoder used for recordings.
+
+        Parameters
+        ----------
+            encoder: H264Encoder
+                The encoder of the recordings.
+
+            output: CircularOutput
+                The output of the recordings.
+        """
+        self.camera.start_recording(encoder, output)
+
+    def read_jpeg(self) -> bytes:
+        """
+        Waits for the next MJPEG frame and keeps the luma plane of
+        its capture request.
+
+        Returns
+        -------
+            frame: bytes
+                The JPEG encoded frame.
+
+        Raises
+        ------
+            TimeoutError
+                If the camera produced no frame within frame_timeout.
+        """
+        output = self.streamOut
+        with output.condition:
+            if not output.condition.wait_for(
+                    lambda: output.sequence > self.sequence and output.luma is not None,
+                    self.frame_timeout):
+                raise TimeoutError(f"The camera produced no frame in {self.frame_timeout} seconds.")
+            self.sequence = output.sequence
+            self.luma = output.luma
+            return output.frame
+
+    def read_luma(self) -> np.ndarray:
+        """
+        Retrieves the Y plane of the lores stream captured with the
+        last JPEG frame, without another capture.
+
+        Returns
+        -------
+            luma: np.ndarray
+                The uint8 (height, width) luma array.
+        """
+        return self.luma
+
+    def capture_still(self, path: str):
+        """
+        Switches the sensor to the full resolution still mode
+        and captures a picture.
+
+        Parameters
+        ----------
+            path: str
+                The path of the JPEG file to write.
+        """
+        still_config = self.camera.create_still_configuration()
+        job = self.camera.switch_mode_and_capture_file(
+            still_config, path, wait=False)
+        self.camera.wait(job)
+
+    def close(self):
+        """
+        Stops the camera.
+        """
+        self.camera.stop()
+
+class _PacedSource(FrameSource):
+    """
+    Base class of the sources which replay prepared frames
+    at a target frame rate.
+
+    Parameters
+    ----------
+        fps: float
+            The rate at which frames are returned. Set to 0 to
+            return frames as fast as they are requested.
+
+        loop: bool
+            Specify whether to restart from the first frame
+            at the end of the frames.
+    """
+    def __init__(self, fps: float=0, loop: bool=True) -> None:
+        self.interval = 1.0 / fps if fps > 0 else 0
+        self.loop = loop
+        self.index = 0
+        self._next_time = None
+
+    def _pace(self):
+        """
+        Sleeps until the next frame is due.
+        """
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next_time is None or self._next_time < now:
+            self._next_time = now
+        else:
+            time.sleep(self._next_time - now)
+        self._next_time += self.interval
+
+    def _advance(self, count: int) -> int:
+        """
+        Moves to the next frame and returns its index.
+
+        Parameters
+        ----------
+            count: int
+                The number of available frames.
+
+        Returns
+        -------
+            index: int
+                The index of the frame to return.
+        """
+        if self.index >= count:
+            if not self.loop:
+                raise EOFError("No more frames in the recording.")
+            self.index = 0
+        self._pace()
+        self.index += 1
+        return self.index - 1
+
+class RawFileSource(_PacedSource):
+    """
+    Replays luma frames from a recorded raw YUV420 or grayscale file
+    such as the output of `rpicam-vid --codec yuv420`. The file is
+    memory mapped so frames are never copied into Python objects.
+    This source only provides luma frames for analysis.
+
+    Parameters
+    ----------
+        path: str
+            The path to the raw file.
+
+        size: tuple
+            The (width, height) of the recorded frames.
+
+        pixel_format: str
+            The layout of the file. Available formats are
+            "yuv420" and "gray".
+
+        fps: float
+            The rate at which frames are returned. Set to 0 to
+            return frames as fast as they are requested.
+
+        loop: bool
+            Specify whether to restart from the first frame
+            at the end of the file.
+    """
+    def __init__(
+            self,
+            path: str,
+            size: Tuple[int, int],
+            pixel_format: str="yuv420",
+            fps: float=0,
+            loop: bool=True
+        ) -> None:
+
+        super().__init__(fps, loop)
+        if pixel_format not in ("yuv420", "gray"):
+            raise ValueError(f"Unsupported pixel format: {pixel_format}")
+        self.width, self.height = size
+        plane = self.width * self.height
+        self.frame_size = plane * 3 // 2 if pixel_format == "yuv420" else plane
+        self.count = os.path.getsize(path) // self.frame_size
+        if self.count == 0:
+            raise ValueError(f"The file {path} does not contain a full frame.")
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+
+    def read_luma(self) -> np.ndarray:
+        """
+        Retrieves the Y plane of the next recorded frame.
+
+        Returns
+        -------
+            luma: np.ndarray
+                The uint8 (height, width) luma array.
+        """
+        start = self._advance(self.count) * self.frame_size
+        plane = self.data[start:start + self.width * self.height]
+        return plane.reshape(self.height, self.width)
+
+    def close(self):
+        """
+        Releases the memory map.
+        """
+        self.data = None
+
+class _PreparedSource(_PacedSource):
+    """
+    Base class of the sources which hold a list of prepared JPEG and
+    luma frame pairs. Frames are encoded once so replaying them does
+    not add CPU work to the measured pipeline.
+    """
+    def __init__(self, fps: float=0, loop: bool=True) -> None:
+        super().__init__(fps, loop)
+        self.frames: List[Tuple[bytes, np.ndarray]] = []
+        self.current = None
+
+    def _append(self, image: Image.Image, size: Tuple[int, int], lores_size: Tuple[int, int], quality: int):
+        """
+        Encodes an image as a JPEG and luma frame pair.
+
+        Parameters
+        ----------
+            image: Image.Image
+                The image to append.
+
+            size: tuple
+                The (width, height) of the JPEG frames.
+
+            lores_size: tuple
+                The (width, height) of the luma frames.
+
+            quality: int
+                The JPEG quality.
+        """
+        image = image.convert('RGB')
+        if size is not None and image.size != tuple(size):
+            image = image.resize(tuple(size))
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality)
+        luma = np.asarray(image.convert('L').resize(tuple(lores_size)))
+        self.frames.append((buffer.getvalue(), luma))
+
+    def read_jpeg(self) -> bytes:
+        """
+        Waits for the next frame.
+
+        Returns
+        -------
+            frame: bytes
+                The JPEG encoded frame.
+        """
+        if not self.frames:
+            raise EOFError("The source does not contain any frames.")
+        self.current = self.frames[self._advance(len(self.frames))]
+        return self.current[0]
+
+    def read_luma(self) -> np.ndarray:
+        """
+        Retrieves the luma frame matching the last JPEG frame.
+
+        Returns
+        -------
+            luma: np.ndarray
+                The uint8 (height, width) luma array.
+        """
+        if self.current is None:
+            self.read_jpeg()
+        return self.current[1]
+
+class ReplaySource(_PreparedSource):
+    """
+    Replays an image sequence or a video file as if it were the
+    camera. Video files are decoded through an ffmpeg pipe.
+
+    Parameters
+    ----------
+        path: str
+            A directory of images, a glob pattern of images, or
+            the path to a video file.
+
+        size: tuple
+            The (width, height) of the JPEG frames. The original
+            size is kept if None.
+
+        lores_size: tuple
+            The (width, height) of the luma frames.
+
+        fps: float
+            The rate at which frames are returned. Set to 0 to
+            return frames as fast as they are requested.
+
+        loop: bool
+            Specify whether to restart from the first frame
+            at the end of the sequence.
+
+        quality: int
+            The JPEG quality of the replayed frames.
+
+        max_frames: int
+            The maximum number of frames loaded from the input.
+    """
+    def __init__(
+            self,
+            path: str,
+            size: Optional[Tuple[int, int]]=None,
+            lores_size: Tuple[int, int]=(320, 240),
+            fps: float=0,
+            loop: bool=True,
+            quality: int=85,
+            max_frames: int=300
+        ) -> None:
+
+        super().__init__(fps, loop)
+        if os.path.isdir(path):
+            paths = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif path.lower().endswith(IMAGE_EXTENSIONS) or glob.has_magic(path):
+            paths = sorted(glob.glob(path))
+        else:
+            paths = None
+
+        if paths is not None:
+            for image_path in paths[:max_frames]:
+                with Image.open(image_path) as image:
+                    self._append(image, size, lores_size, quality)
+        else:
+            for frame in self.decode_video(path, size, max_frames):
+                self._append(Image.open(io.BytesIO(frame)), None, lores_size, quality)
+        if not self.frames:
+            raise ValueError(f"No frames could be loaded from {path}.")
+
+    @staticmethod
+    def decode_video(path: str, size: Optional[Tuple[int, int]], max_frames: int) -> List[bytes]:
+        """
+        Decodes a video file into JPEG frames through an ffmpeg pipe.
+
+        Parameters
+        ----------
+            path: str
+                The path to the video file.
+
+            size: tuple
+                The (width, height) to scale the frames to.
+
+            max_frames: int
+                The maximum number of frames to decode.
+
+        Returns
+        -------
+            frames: List[bytes]
+                The JPEG encoded frames.
+        """
+        command = ['ffmpeg', '-v', 'error', '-nostdin', '-i', path,
+                   '-frames:v', str(max_frames)]
+        if size is not None:
+            command += ['-vf', f'scale={size[0]}:{size[1]}']
+        command += ['-f', 'image2pipe', '-c:v', 'mjpeg', '-q:v', '3', '-']
+        data = subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout
+        frames = []
+        start = data.find(b'\xff\xd8')
+        while start != -1:
+            end = data.find(b'\xff\xd9', start)
+            if end == -1:
+                break
+            frames.append(data[start:end + 2])
+            start = data.find(b'\xff\xd8', end + 2)
+        return frames
+
+class SyntheticSource(_PreparedSource):
+    """
+    Generates a noisy scene with a moving square. Useful to profile
+    the pipeline without any camera or recording.
+
+    Parameters
+    ----------
+        size: tuple
+            The (width, height) of the JPEG frames.
+
+        lores_size: tuple
+            The (width, height) of the luma frames.
+
+        fps: float
+            The rate at which frames are returned. Set to 0 to
+            return frames as fast as they are requested.
+
+        frames: int
+            The number of distinct frames generated and looped.
+
+        quality: int
+            The JPEG quality of the frames.
+
+        seed: int
+            The seed of the random noise.
+    """
+    def __init__(
+            self,
+            size: Tuple[int, int]=(800, 600),
+            lores_size: Tuple[int, int]=(320, 240),
+            fps: float=0,
+            frames: int=60,
+            quality: int=85,
+            seed: int=0
+        ) -> None:
+
+        super().__init__(fps, loop=True)
+        width, height = size
+        rng = np.random.default_rng(seed)
+        background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        square = max(8, min(width, height) // 8)
+        for i in range(frames):
+            frame = background.copy()
+            x = (i * 7) % max(1, width - square)
+            y = (i * 3) % max(1, height - square)
+            frame[y:y + square, x:x + square] = 255
+            noise = rng.integers(-4, 5, frame.shape, dtype=np.int16)
+            frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+            self._append(Image.fromarray(frame), None, lores_size, quality)
+
+def source_from_configuration(configuration: dict, **defaults) -> FrameSource:
+    """
+    Creates a frame source from a "source" or "analysis_source"
+    section of the JSON configuration.
+
+    Parameters
+    ----------
+        configuration: dict
+            The source settings. The "type" key selects the source,
+            "picamera" if missing, the remaining keys are passed to
+            its constructor.
+
+        defaults: dict
+            Default constructor arguments such as the frame sizes,
+            overridden by the configuration.
+
+    Returns
+    -------
+        source: FrameSource
+            The configured frame source.
+    """
+    settings = dict(configuration)
+    kind = settings.pop("type", "picamera")
+    sources = {
+        "picamera": PicameraSource,
+        "raw": RawFileSource,
+        "replay": ReplaySource,
+        "synthetic": SyntheticSource,
+    }
+    if kind not in sources:
+        raise ValueError(f"Unsupported frame source: {kind}")
+    source = sources[kind]
+    arguments = inspect.signature(source).parameters
+    settings = {
+        **{key: value for key, value in defaults.items() if key in arguments},
+        **settings
+    }
+    return source(**settings)
@@ -0,0 +1,111 @@
+from surveillance.video.broadcast import FrameBroadcaster
+from surveillance.metrics import stage
+from typing import Dict, Optional
+from PIL import Image
+import time
+import io
+
+DEFAULT_TIERS = {
+    "low": {"width": 320, "quality": 50},
+    "medium": {"width": 640, "quality": 70},
+}
+
+class TierEncoder:
+    """
+    Re-encodes the frames of a broadcaster at a lower resolution and
+    JPEG quality, once per frame for all the viewers of the tier. The
+    frames are decoded at a reduced scale and are only re-encoded
+    while the tier has viewers.
+
+    Parameters
+    ----------
+        source: FrameBroadcaster
+            The broadcaster of the full quality frames.
+
+        name: str
+            The name of the tier, i.e. "low".
+
+        width: int
+            The maximum width of the frames. The aspect ratio is kept.
+
+        quality: int
+            The JPEG quality of the frames.
+    """
+    def __init__(self, source: FrameBroadcaster, name: str, width: int, quality: int) -> None:
+        self.source = source
+        self.name = name
+        self.width = width
+        self.quality = quality
+        self.sequence = 0
+        self.timer = stage(f"tier_{name}")
+        self.broadcaster = FrameBroadcaster(self.next_frame, name=f"tier-{name}")
+
+    def next_frame(self) -> Optional[bytes]:
+        """
+        Waits for the next source frame and encodes it if the tier
+        has viewers.
+
+        Returns
+        -------
+            frame: bytes
+                The encoded frame or None if there was nothing to encode.
+        """
+        if not self.source.running:
+            time.sleep(0.1)
+            return None
+        self.sequence, frame = self.source.wait_for_frame(self.sequence, timeout=1.0)
+        if frame is None or self.broadcaster.clients == 0:
+            return None
+        with self.timer.time():
+            return self.encode(frame)
+
+    def encode(self, frame: bytes) -> bytes:
+        """
+        Scales down and re-encodes a JPEG frame.
+
+        Parameters
+        ----------
+            frame: bytes
+                The full quality JPEG frame.
+
+        Returns
+        -------
+            frame: bytes
+                The JPEG frame of the tier.
+        """
+        image = Image.open(io.BytesIO(frame))
+        width, height = image.size
+        size = (self.width, max(1, round(height * self.width / width)))
+        # Decode at the smallest DCT scale at least as large as the tier.
+        image.draft('RGB', size)
+        image = image.convert('RGB')
+        if image.width > self.width:
+            image = image.resize(size, Image.BILINEAR)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=self.quality)
+        return buffer.getvalue()
+
+def build_tiers(broadcaster: FrameBroadcaster, configuration: dict) -> Dict[str, FrameBroadcaster]:
+    """
+    Starts the quality tiers of the stream.
+
+    Parameters
+    ----------
+        broadcaster: FrameBroadcaster
+            The broadcaster of the full quality frames, served as
+            the "high" tier.
+
+        configuration: dict
+            The "width" and "quality" of each lower tier by name.
+
+    Returns
+    -------
+        tiers: Dict[str, FrameBroadcaster]
+            The broadcaster of each tier.
+    """
+    tiers = {"high": broadcaster}
+    for name, tier in configuration.items():
+        encoder = TierEncoder(broadcaster, name, tier.get("width", 320), tier.get("quality", 60))
+        encoder.broadcaster.start()
+        tiers[name] = encoder.broadcaster
+    return tiers
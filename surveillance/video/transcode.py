@@ -0,0 +1,139 @@
+from surveillance.video.segments import MANIFEST, close_manifest, wait_for_manifest
+from surveillance.video.utils import convert_h264_to_mp4
+from typing import Callable, Optional
+from surveillance.jobs import Job, JobQueue
+from surveillance import logger
+import threading
+import queue
+import os
+
+class Transcoder:
+    """
+    Converts finished .h264 recordings to mp4 through a bounded job
+    queue so requests never wait for ffmpeg, and the number of
+    concurrent ffmpeg processes is limited by the queue workers.
+    Segmented recordings need no conversion and are only finalized.
+
+    Parameters
+    ----------
+        jobs: JobQueue
+            The queue running the conversions.
+
+        silent: bool
+            Specify whether to print status messages on the terminal.
+
+        on_converted: Callable[[str], None]
+            Called with the path of each converted mp4 file or
+            finalized manifest.
+    """
+    def __init__(
+            self,
+            jobs: JobQueue,
+            silent: bool=False,
+            on_converted: Optional[Callable[[str], None]]=None
+        ) -> None:
+
+        self.jobs = jobs
+        self.silent = silent
+        self.on_converted = on_converted
+
+    def submit(self, source_path: str, block: bool=False) -> Optional[Job]:
+        """
+        Queues the conversion of a recording.
+
+        Parameters
+        ----------
+            source_path: str
+                The path to the .h264 recording or to the
+                manifest of a segmented recording.
+
+            block: bool
+                Specify whether to wait for room in a full queue.
+
+        Returns
+        -------
+            job: Job
+                The conversion job, or None if the queue is full. The
+                recording is kept and recovered at the next startup.
+        """
+        try:
+            if source_path.endswith('.m3u8'):
+                return self.jobs.submit(
+                    "finalize", source_path, self.finalize, source_path, block=block)
+            return self.jobs.submit(
+                "transcode", source_path, self.convert, source_path, block=block)
+        except queue.Full:
+            logger(f"The conversion queue is full, {source_path} is deferred.", code="WARNING")
+            return None
+
+    def convert(self, source_path: str):
+        """
+        Remuxes a recording to mp4 and deletes the .h264 source
+        once the conversion succeeded.
+
+        Parameters
+        ----------
+            source_path: str
+                The path to the .h264 recording.
+        """
+        output_path = os.path.splitext(source_path)[0] + '.mp4'
+        if not convert_h264_to_mp4(source_path, output_path, self.silent):
+            raise RuntimeError(f"ffmpeg could not convert {source_path}")
+        os.remove(source_path)
+        if self.on_converted is not None:
+            self.on_converted(output_path)
+
+    def finalize(self, manifest: str):
+        """
+        Waits for the segmenter to close the manifest of a stopped
+        recording.
+
+        Parameters
+        ----------
+            manifest: str
+                The path to the HLS manifest.
+        """
+        if not wait_for_manifest(manifest):
+            raise RuntimeError(f"The manifest {manifest} was not closed")
+        if self.on_converted is not None:
+            self.on_converted(manifest)
+
+    def recover(self, directory: str) -> threading.Thread:
+        """
+        Queues the recordings left unconverted, i.e. by a crash or a
+        full queue, and closes the manifests of the segmented recordings
+        interrupted by a crash. Must be called before any recording
+        starts. The files are submitted from a background thread which
+        waits for room in the queue, so none of them is deferred again.
+
+        Parameters
+        ----------
+            directory: str
+                The directory of the recordings.
+
+        Returns
+        -------
+            thread: threading.Thread
+                The thread submitting the conversions.
+        """
+        paths = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if name.endswith('.h264'):
+                paths.append(path)
+            elif os.path.isfile(os.path.join(path, MANIFEST)):
+                try:
+                    if close_manifest(os.path.join(path, MANIFEST)):
+                        paths.append(os.path.join(path, MANIFEST))
+                except OSError as e:
+                    logger(f"Could not close the manifest of {name}: {e}", code="WARNING")
+
+        def submit_all():
+            for path in paths:
+                if not self.silent:
+                    logger(f"Recovering the recording {os.path.relpath(path, directory)}.")
+                self.submit(path, block=True)
+
+        thread = threading.Thread(target=submit_all, name="transcode-recovery", daemon=True)
+        thread.start()
+        return thread
@@ -1,12 +1,12 @@
 from surveillance import logger
 from datetime import datetime
-from PIL import Image
+from typing import Optional
 import subprocess
-import io
 
-def convert_h264_to_mp4(source_file_path: str, output_file_path: str, silent: bool=False):
+def convert_h264_to_mp4(source_file_path: str, output_file_path: str, silent: bool=False) -> bool:
     """
-    H264 to MP4 converter.
+    H264 to MP4 converter. The stream is remuxed without re-encoding
+    and an existing output file is overwritten.
 
     Parameters
     ----------
@@ -18,35 +18,46 @@ def convert_h264_to_mp4(source_file_path: str, output_file_path: str, silent: bo
 
         silent: bool
             Specify whether to print status messages on the terminal.
+
+    Returns
+    -------
+        success: bool
+            True if the conversion succeeded.
     """
     try:
         # Command to convert h264 to mp4
-        command = ['ffmpeg', '-i', source_file_path, '-c', 'copy', output_file_path]
+        command = ['ffmpeg', '-nostdin', '-y', '-loglevel', 'error',
+                   '-i', source_file_path, '-c', 'copy', output_file_path]
         subprocess.run(command, check=True)
         if not silent:
             logger(f"Conversion successful: {output_file_path}", code="SUCCESS")
-    except subprocess.CalledProcessError as e:
+        return True
+    except (subprocess.CalledProcessError, OSError) as e:
         if not silent:
             logger(f"Error during conversion: {e}", code="WARNING")
+        return False
 
-def image2bytes(image: Image.Image) -> bytes:
+def probe_duration(file_path: str) -> Optional[float]:
     """
-    Convert a Pillow Image object to bytes.
+    Reads the duration of a video file with ffprobe.
 
     Parameters
     ----------
-        image: Image.Image
-            A pillow Image object.
+        file_path: str
+            This is the path to the video file.
 
     Returns
     -------
-        img_byte_arr: bytes
-            The image as bytes.
+        duration: float
+            The duration in seconds or None if it could not be read.
     """
-    img_byte_arr = io.BytesIO()
-    image.save(img_byte_arr, format='PNG')
-    img_byte_arr = img_byte_arr.getvalue()
-    return img_byte_arr
+    try:
+        command = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                   '-of', 'default=noprint_wrappers=1:nokey=1', file_path]
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+        return float(result.stdout.strip())
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return None
 
 def show_time() -> str:
     """
@@ -0,0 +1,256 @@
+from typing import Callable, Optional
+from surveillance.video.broadcast import FrameBroadcaster
+from surveillance.video.sources import source_from_configuration
+from surveillance.video.motion import MotionDetector
+from surveillance import logger
+from datetime import datetime
+import multiprocessing
+import threading
+import queue
+import time
+import os
+
+def capture(
+        camera_id: str,
+        configuration: dict,
+        defaults: dict,
+        frames,
+        events,
+        stop
+    ):
+    """
+    The worker process of a camera. It captures the frames, sends them
+    to the server and reports the motion detected in them.
+
+    Parameters
+    ----------
+        camera_id: str
+            The identifier of the camera.
+
+        configuration: dict
+            The camera settings with its "source" and "motion" sections.
+
+        defaults: dict
+            The default frame source arguments such as the frame sizes.
+
+        frames: multiprocessing.connection.Connection
+            The pipe end the JPEG frames are sent to.
+
+        events: multiprocessing.Queue
+            The queue of the motion events.
+
+        stop: multiprocessing.Event
+            Set to stop the worker.
+    """
+    motion = MotionDetector.from_configuration(configuration.get("motion", {}))
+    source = source_from_configuration(
+        configuration.get("source", {"type": "picamera"}),
+        **dict(defaults, lores_size=motion.analysis_size or (320, 240)))
+    source.start()
+    interval = configuration.get("event_interval", 1.0)
+    previous = None
+    last_event = 0
+    try:
+        while not stop.is_set():
+            frame = source.read_jpeg()
+            image = motion.prepare(source.read_luma())
+            frames.send_bytes(frame)
+            if previous is not None:
+                result = motion.analyze(previous, image)
+                now = time.time()
+                # The events of a continuous motion are spaced out.
+                if result.motion and now - last_event >= interval:
+                    last_event = now
+                    try:
+                        events.put_nowait((
+                            camera_id, now, result.score, frame,
+                            motion.affected_regions(result.tiles, result.shape), result.bounds()))
+                    except queue.Full:
+                        pass
+            previous = image
+    except (BrokenPipeError, EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        source.close()
+
+class CameraWorker:
+    """
+    Runs the capture and the motion analysis of a camera in its own
+    process, so several cameras use the cores of the device, and
+    serves its frames from a broadcaster in the server. The worker
+    is restarted if it exits unexpectedly.
+
+    Parameters
+    ----------
+        camera_id: str
+            The identifier of the camera, used in /cam/<camera_id>.
+
+        configuration: dict
+            The camera settings: its "name", "source" and "motion"
+            sections and the "event_interval" between motion events.
+
+        defaults: dict
+            The default frame source arguments such as the frame sizes.
+
+        on_motion: Callable[[str, float, int, bytes, list, list], None]
+            Called in the server with the camera identifier, the time,
+            the motion score, the JPEG frame, the affected regions and
+            the normalized bounds of each motion event.
+
+        restart_delay: float
+            The time in seconds to wait before restarting a worker.
+    """
+    def __init__(
+            self,
+            camera_id: str,
+            configuration: dict,
+            defaults: Optional[dict]=None,
+            on_motion: Optional[Callable[[str, float, int, bytes, list, list], None]]=None,
+            restart_delay: float=5.0
+        ) -> None:
+
+        self.camera_id = camera_id
+        self.name = configuration.get("name", camera_id)
+        self.configuration = configuration
+        self.defaults = defaults or {}
+        self.on_motion = on_motion
+        self.restart_delay = restart_delay
+        # The workers do not inherit the threads of the server.
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue(maxsize=16)
+        self.process = None
+        self.connection = None
+        self.stop_event = None
+        self.restarts = 0
+        self.broadcaster = FrameBroadcaster(self.next_frame, name=f"camera-{camera_id}")
+        self._running = False
+        self._events_thread = None
+
+    def start(self):
+        """
+        Starts the worker process and the broadcaster of its frames.
+        """
+        self._running = True
+        self._spawn()
+        self._events_thread = threading.Thread(
+            target=self._dispatch, name=f"camera-{self.camera_id}-events", daemon=True)
+        self._events_thread.start()
+        self.broadcaster.start()
+
+    def _spawn(self):
+        """
+        Starts a worker process.
+        """
+        receiver, sender = self.context.Pipe(duplex=False)
+        self.stop_event = self.context.Event()
+        self.process = self.context.Process(
+            target=capture,
+            args=(self.camera_id, self.configuration, self.defaults,
+                  sender, self.events, self.stop_event),
+            name=f"camera-{self.camera_id}",
+            daemon=True,
+        )
+        self.process.start()
+        # Only the worker keeps the sending end, so its exit closes the pipe.
+        sender.close()
+        self.connection = receiver
+        logger(f"Camera {self.name} started in process {self.process.pid}.")
+
+    def next_frame(self) -> Optional[bytes]:
+        """
+        Receives the next frame of the worker.
+
+        Returns
+        -------
+            frame: bytes
+                The JPEG frame or None if there was no frame in time.
+        """
+        try:
+            if self.connection.poll(1.0):
+                return self.connection.recv_bytes()
+            return None
+        except (EOFError, OSError):
+            pass
+        if not self._running:
+            time.sleep(0.1)
+            return None
+        self.process.join(1)
+        logger(
+            f"Camera {self.name} stopped (exit code {self.process.exitcode}), "
+            f"restarting it in {self.restart_delay} seconds.", code="WARNING")
+        time.sleep(self.restart_delay)
+        self.restarts += 1
+        self._spawn()
+        return None
+
+    def _dispatch(self):
+        """
+        Hands the motion events of the worker to the server.
+        """
+        while self._running:
+            try:
+                event = self.events.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if self.on_motion is not None:
+                try:
+                    self.on_motion(*event)
+                except Exception as e:
+                    logger(f"The motion event of camera {self.name} failed: {e}", code="WARNING")
+
+    def snap(self, directory: str) -> str:
+        """
+        Stores the latest frame of the camera.
+
+        Parameters
+        ----------
+            directory: str
+                The images directory.
+
+        Returns
+        -------
+            path: str
+                The path of the stored snapshot.
+        """
+        _, frame = self.broadcaster.wait_for_frame(0, timeout=2.0)
+        if frame is None:
+            raise TimeoutError("No frame was captured.")
+        path = os.path.join(directory, f"{self.camera_id}_snap_{datetime.now()}.jpg")
+        with open(path, "wb") as fp:
+            fp.write(frame)
+        return path
+
+    def stop(self, timeout: float=5.0):
+        """
+        Stops the worker process.
+
+        Parameters
+        ----------
+            timeout: float
+                The time in seconds to wait for the process to exit.
+        """
+        self._running = False
+        self.stop_event.set()
+        self.broadcaster.stop()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def status(self) -> dict:
+        """
+        Returns the state of the worker.
+
+        Returns
+        -------
+            status: dict
+                The name, the process id, whether it is alive, the
+                number of restarts and the number of viewers.
+        """
+        return {
+            "id": self.camera_id,
+            "name": self.name,
+            "pid": self.process.pid if self.process else None,
+            "alive": self.process.is_alive() if self.process else False,
+            "restarts": self.restarts,
+            "clients": self.broadcaster.clients,
+        }
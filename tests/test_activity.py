@@ -0,0 +1,81 @@
+from surveillance.video.activity import ActivityIndex, activity_segments, activity_timeline
+from surveillance.media import MediaIndex
+from surveillance.jobs import JobQueue
+import numpy as np
+import subprocess
+import shutil
+import pytest
+import os
+
+def chunks(frames: np.ndarray, size: int):
+    for start in range(0, len(frames), size):
+        yield frames[start:start + size]
+
+def test_timeline_keeps_the_peak_of_each_second():
+    frames = np.zeros((9, 10, 10), dtype=np.uint8)
+    # Half of the pixels change between frames 2 and 3, all between 6 and 7.
+    frames[3:, :5] = 200
+    frames[7:] = 200
+    frames[7:, :5] = 0
+    timeline = activity_timeline(chunks(frames, 4), fps=2, pixel_threshold=25)
+    # The seconds are padded with quiet frames and the permille saturates.
+    assert timeline.tolist() == [0, 255, 0, 255, 0]
+
+def test_timeline_of_chunks_matches_a_single_chunk():
+    frames = np.random.default_rng(0).integers(0, 255, (20, 12, 16), dtype=np.uint8)
+    frames[5:12] = frames[5]
+    whole = activity_timeline(iter([frames]), fps=4, pixel_threshold=100)
+    assert np.array_equal(activity_timeline(chunks(frames, 3), fps=4, pixel_threshold=100), whole)
+    assert whole[2] == 0 and whole[0] > 0
+    assert activity_timeline(iter([]), fps=2).tolist() == []
+
+def test_segments_join_the_short_gaps():
+    timeline = np.array([0, 9, 0, 0, 7, 0, 0, 0, 0, 20, 3, 0], dtype=np.uint8)
+    assert activity_segments(timeline, level=5, gap=2, pad=0) == [
+        {"start": 1, "end": 5, "peak": 9},
+        {"start": 9, "end": 10, "peak": 20},
+    ]
+    assert activity_segments(timeline, level=5, gap=4, pad=1) == [
+        {"start": 0, "end": 11, "peak": 20},
+    ]
+    assert activity_segments(np.zeros(5, dtype=np.uint8)) == []
+
+@pytest.fixture
+def media(tmp_path):
+    directories = {kind: str(tmp_path / kind) for kind in ("image", "video", "sound")}
+    for directory in directories.values():
+        os.makedirs(directory)
+    index = MediaIndex(str(tmp_path / "media.db"), directories, probe=lambda path: 2.0)
+    yield index
+    index.connection.close()
+
+def test_failed_recordings_are_retried_once_changed(media):
+    path = media.path("video", "broken.mp4")
+    with open(path, "wb") as f:
+        f.write(b"not a video")
+    media.add(path)
+    activity = ActivityIndex(media, JobQueue(workers=1))
+    assert [row[0] for row in activity.pending()] == ["broken.mp4"]
+    activity.index_pending()
+    assert activity.pending() == []
+    assert activity.timeline("broken.mp4") is None and activity.indexed == 0
+    with open(path, "ab") as f:
+        f.write(b" anymore")
+    media.add(path)
+    assert [row[0] for row in activity.pending()] == ["broken.mp4"]
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_recordings_are_indexed_once(media):
+    path = media.path("video", "clip.mp4")
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=160x120:rate=10",
+         "-t", "3", "-pix_fmt", "yuv420p", path], check=True)
+    media.add(path)
+    activity = ActivityIndex(media, JobQueue(workers=1))
+    activity.schedule()
+    activity.jobs.join()
+    timeline = activity.timeline("clip.mp4")
+    assert len(timeline) == 3 and timeline.max() > 0
+    assert activity.pending() == [] and activity.indexed == 1
+    media.delete(path)
+    assert activity.timeline("clip.mp4") is None
@@ -0,0 +1,42 @@
+from surveillance.video.analysis import LumaRing
+import numpy as np
+import pytest
+
+@pytest.fixture
+def ring():
+    ring = LumaRing((6, 8), slots=4)
+    yield ring
+    ring.close()
+
+def frame(value: int) -> np.ndarray:
+    return np.full((6, 8), value, dtype=np.uint8)
+
+def test_read_returns_a_copy_of_the_frame(ring):
+    ring.write(1, frame(7))
+    luma = ring.read(1)
+    ring.write(5, frame(9))
+    assert (luma == 7).all()
+
+def test_read_detects_overwritten_frames(ring):
+    for sequence in range(1, 6):
+        ring.write(sequence, frame(sequence))
+    # Frame 1 shared its slot with frame 5.
+    assert ring.read(1) is None
+    assert (ring.read(5) == 5).all()
+    assert (ring.read(2) == 2).all()
+
+def test_read_rejects_a_slot_being_written(ring):
+    ring.write(3, frame(3))
+    ring.sequences[3 % ring.slots] = -1
+    assert ring.read(3) is None
+
+def test_attached_ring_shares_the_frames(ring):
+    ring.write(2, frame(4))
+    attached = LumaRing(ring.shape, ring.slots, name=ring.name)
+    try:
+        assert (attached.read(2) == 4).all()
+        attached.write(6, frame(8))
+        assert ring.read(2) is None
+        assert (ring.read(6) == 8).all()
+    finally:
+        attached.close()
@@ -0,0 +1,124 @@
+from surveillance.audio.sources import SyntheticSource, WavSource
+from surveillance.audio.service import AudioService
+import numpy as np
+import pytest
+import wave
+import time
+import os
+
+def test_wav_source_replays_the_samples(tmp_path):
+    samples = (np.arange(400, dtype=np.int16) - 200).reshape(-1, 2)
+    path = str(tmp_path / "clip.wav")
+    with wave.open(path, "wb") as fp:
+        fp.setnchannels(2)
+        fp.setsampwidth(2)
+        fp.setframerate(100000)
+        fp.writeframes(samples.tobytes())
+    source = WavSource(path, loop=False)
+    assert (source.rate, source.channels, source.sample_format) == (100000, 2, "S16_LE")
+    blocks = [source.read(150), source.read(150)]
+    assert np.array_equal(np.concatenate(blocks), samples)
+    with pytest.raises(EOFError):
+        source.read(150)
+
+def test_synthetic_audio_source_bursts():
+    source = SyntheticSource(rate=8000, period=1.0, burst=0.5)
+    block = source.read(8000)
+    assert block.shape == (8000, 1) and block.dtype == np.int16
+    loud, quiet = np.abs(block[:4000]).max(), np.abs(block[4000:]).max()
+    assert loud > 10 * quiet
+
+class ReplaySource(WavSource):
+    """
+    Replays a WAV file as fast as it is read.
+    """
+    def _pace(self, frames: int):
+        pass
+
+def write_wav(path: str, samples: np.ndarray, rate: int):
+    with wave.open(path, "wb") as fp:
+        fp.setnchannels(samples.shape[1])
+        fp.setsampwidth(2)
+        fp.setframerate(rate)
+        fp.writeframes(samples.tobytes())
+
+def read_wav(path: str) -> np.ndarray:
+    with wave.open(path, "rb") as fp:
+        return np.frombuffer(fp.readframes(fp.getnframes()), dtype=np.int16).reshape(-1, fp.getnchannels())
+
+def wait_until(condition, timeout: float=5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_loud_sound_triggers_a_clip_with_its_pre_roll(tmp_path):
+    rate = 8000
+    samples = np.zeros((int(5.5 * rate), 1), dtype=np.int16)
+    # Half a second of sound at about -10 dBFS after two quiet seconds.
+    samples[2 * rate:int(2.5 * rate)] = 10000
+    write_wav(str(tmp_path / "input.wav"), samples, rate)
+    saved = []
+    service = AudioService(
+        ReplaySource(str(tmp_path / "input.wav"), loop=False), str(tmp_path), codec="wav",
+        pre_roll=0.5, trigger_db=-30, quiet_period=1.0, on_saved=lambda *clip: saved.append(clip))
+    service.start()
+    assert wait_until(lambda: not service.running and saved)
+    service.jobs.join()
+    (path, duration), = saved
+    # The clip runs from the pre-roll before the first loud block to
+    # the quiet period after the last one.
+    assert duration == pytest.approx(1.9)
+    assert np.array_equal(read_wav(path), samples[int(1.6 * rate):int(3.5 * rate)])
+    assert service.status()["clips"] == 1 and not service.status()["recording"]
+
+def test_quiet_sound_does_not_trigger_a_clip(tmp_path):
+    rate = 8000
+    samples = np.full((3 * rate, 1), 100, dtype=np.int16)
+    write_wav(str(tmp_path / "input.wav"), samples, rate)
+    service = AudioService(
+        ReplaySource(str(tmp_path / "input.wav"), loop=False), str(tmp_path), codec="wav",
+        trigger_db=-30)
+    service.start()
+    assert wait_until(lambda: not service.running)
+    assert service.status()["clips"] == 0
+    assert service.status()["level_db"] == pytest.approx(-50.3, abs=0.1)
+
+def test_requested_clips_are_stopped_and_limited(tmp_path):
+    saved = []
+    service = AudioService(
+        SyntheticSource(rate=8000), str(tmp_path), codec="wav", pre_roll=0.2,
+        max_duration=0.6, on_saved=lambda *clip: saved.append(clip))
+    service.start()
+    try:
+        time.sleep(0.3)
+        assert service.record(10)["recording"]
+        assert wait_until(lambda: len(saved) == 1)
+        # The clip is cut at max_duration, including the pre-roll.
+        assert saved[0][1] == pytest.approx(0.6)
+        service.record(10)
+        time.sleep(0.2)
+        assert not service.stop_clip()["remaining"]
+        assert wait_until(lambda: len(saved) == 2)
+        assert saved[1][1] < 0.6
+        assert saved[0][0] != saved[1][0]
+        assert all(os.path.exists(path) for path, _ in saved)
+    finally:
+        service.stop()
+
+def test_stopping_stores_the_clip_in_progress(tmp_path):
+    saved = []
+    service = AudioService(
+        SyntheticSource(rate=8000), str(tmp_path), codec="wav", pre_roll=0,
+        on_saved=lambda *clip: saved.append(clip))
+    service.start()
+    time.sleep(0.1)
+    service.record(30)
+    time.sleep(0.3)
+    service.stop()
+    service.jobs.join()
+    assert len(saved) == 1 and 0.1 < saved[0][1] < 1.0
+
+def test_unknown_codec_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        AudioService(SyntheticSource(), str(tmp_path), codec="mp3")
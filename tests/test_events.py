@@ -0,0 +1,58 @@
+from surveillance.events import ROLLUP, EventLog
+import pytest
+
+@pytest.fixture
+def log(tmp_path):
+    log = EventLog(str(tmp_path / "events.db"), quiet_period=0)
+    yield log
+    log.connection.close()
+
+def append(log: EventLog, camera: str, start: float, end: float, peak: int=10):
+    log.motion(camera, start, peak)
+    log.motion(camera, end, peak)
+    log.flush(float("inf"))
+
+def test_buckets_with_partial_last_hour(log):
+    day = 20000 * 86400
+    append(log, "main", day + 600, day + 660)
+    append(log, "main", day + ROLLUP + 600, day + ROLLUP + 610, peak=40)
+    append(log, "main", day + ROLLUP + 2400, day + ROLLUP + 2500)
+    buckets = log.buckets(day, day + ROLLUP + 1800, ROLLUP)
+    assert [bucket["events"] for bucket in buckets] == [1, 1]
+    assert buckets[1]["seconds"] == 10.0
+    assert buckets[1]["peak"] == 40
+    # The rollup and the event log agree on whole hours.
+    assert log.buckets(day, day + 2 * ROLLUP, ROLLUP)[1]["events"] == 2
+
+def test_buckets_partial_hour_within_a_larger_bucket(log):
+    day = 20000 * 86400
+    append(log, "main", day + 100, day + 200)
+    append(log, "main", day + 2 * ROLLUP + 100, day + 2 * ROLLUP + 200)
+    append(log, "main", day + 2 * ROLLUP + 3000, day + 2 * ROLLUP + 3100)
+    buckets = log.buckets(day, day + 2 * ROLLUP + 1800, 2 * ROLLUP)
+    assert [bucket["events"] for bucket in buckets] == [1, 1]
+    assert [bucket["start"] for bucket in buckets] == [day, day + 2 * ROLLUP]
+
+def test_buckets_filter_by_camera(log):
+    day = 20000 * 86400
+    append(log, "main", day + 10, day + 20)
+    append(log, "garage", day + 30, day + 40)
+    assert log.buckets(day, day + ROLLUP, ROLLUP, camera="garage")[0]["events"] == 1
+    assert log.buckets(day, day + 1800, 600, camera="main")[0]["events"] == 1
+
+def test_unaligned_buckets_use_the_event_log(log):
+    append(log, "main", 1000, 1010)
+    append(log, "main", 1700, 1750)
+    buckets = log.buckets(900, 1900, 500)
+    assert [bucket["events"] for bucket in buckets] == [1, 1]
+    assert buckets[1]["seconds"] == 50.0
+
+def test_events_are_split_after_max_duration(tmp_path):
+    log = EventLog(str(tmp_path / "events.db"), quiet_period=0, max_duration=60)
+    for timestamp in range(0, 150, 10):
+        log.motion("main", timestamp, 5)
+    log.flush(float("inf"))
+    events, total = log.query(0, 200)
+    assert total == 3
+    assert [event["start"] for event in events] == [120, 60, 0]
+    log.connection.close()
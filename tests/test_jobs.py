@@ -0,0 +1,86 @@
+from surveillance.video.transcode import Transcoder
+from surveillance.jobs import JobQueue
+import subprocess
+import threading
+import shutil
+import queue
+import pytest
+import time
+import os
+
+def wait_until(condition, timeout: float=2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_jobs_run_and_keep_their_status():
+    jobs = JobQueue(workers=2)
+    results = []
+    done = jobs.submit("sum", "a", lambda x, y: results.append(x + y), 1, 2)
+    failed = jobs.submit("sum", "b", lambda: 1 / 0)
+    jobs.join()
+    assert results == [3]
+    assert done.status == "done" and done.finished >= done.started
+    assert failed.status == "failed" and "division" in failed.error
+    assert [job["id"] for job in jobs.jobs()] == [failed.id, done.id]
+    assert jobs.pending() == []
+
+def test_full_queue_raises_and_forgets_the_job():
+    jobs = JobQueue(workers=1, max_pending=1)
+    release = threading.Event()
+    running = jobs.submit("wait", "first", release.wait)
+    assert wait_until(lambda: running.status == "running")
+    waiting = jobs.submit("wait", "second", release.wait)
+    with pytest.raises(queue.Full):
+        jobs.submit("wait", "third", release.wait)
+    assert {job.id for job in jobs.pending("wait")} == {running.id, waiting.id}
+    release.set()
+    jobs.join()
+    assert jobs.pending() == []
+
+def test_transcoder_defers_recordings_when_the_queue_is_full(tmp_path):
+    jobs = JobQueue(workers=1, max_pending=1)
+    release = threading.Event()
+    running = jobs.submit("wait", "first", release.wait)
+    assert wait_until(lambda: running.status == "running")
+    jobs.submit("wait", "second", release.wait)
+    transcoder = Transcoder(jobs, silent=True)
+    assert transcoder.submit(str(tmp_path / "clip.h264")) is None
+    release.set()
+    jobs.join()
+
+def test_finalize_waits_for_a_closed_manifest(tmp_path):
+    manifest = tmp_path / "index.m3u8"
+    manifest.write_text("#EXTM3U\n#EXTINF:2.0,\nsegment0.m4s\n#EXT-X-ENDLIST\n")
+    converted = []
+    jobs = JobQueue()
+    job = Transcoder(jobs, silent=True, on_converted=converted.append).submit(str(manifest))
+    jobs.join()
+    assert job.kind == "finalize" and job.status == "done"
+    assert converted == [str(manifest)]
+
+def test_failed_conversion_keeps_the_source(tmp_path):
+    source = tmp_path / "clip.h264"
+    source.write_bytes(b"not a video")
+    converted = []
+    jobs = JobQueue()
+    job = Transcoder(jobs, silent=True, on_converted=converted.append).submit(str(source))
+    jobs.join()
+    assert job.status == "failed"
+    assert source.exists() and converted == []
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_conversion_replaces_the_source(tmp_path):
+    source = str(tmp_path / "clip.h264")
+    subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-f", "lavfi", "-i",
+         "testsrc=size=64x48:rate=10:duration=1", "-c:v", "libx264", "-f", "h264", source],
+        check=True)
+    converted = []
+    jobs = JobQueue()
+    job = Transcoder(jobs, silent=True, on_converted=converted.append).submit(source)
+    jobs.join()
+    assert job.status == "done"
+    assert not os.path.exists(source)
+    assert converted == [str(tmp_path / "clip.mp4")]
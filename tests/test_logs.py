@@ -0,0 +1,99 @@
+from surveillance.logs import LogWriter
+import surveillance
+import threading
+import json
+import time
+import os
+
+def lines(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+def test_records_are_written_by_the_thread(tmp_path):
+    path = str(tmp_path / "surveillance.log")
+    writer = LogWriter(path=path, console=False, level="INFO")
+    writer.log("hidden", "DEBUG")
+    writer.log("first")
+    writer.log("second", "WARNING")
+    writer.close()
+    assert lines(path) == ["\t - [INFO]: first", "\t - [WARNING]: second"]
+    assert writer.file is None and not writer._thread.is_alive()
+    writer.log("after")
+    assert lines(path)[-1] == "\t - [WARNING]: second"
+
+def test_repeated_messages_are_summarized(tmp_path):
+    path = str(tmp_path / "surveillance.log")
+    writer = LogWriter(path=path, console=False, json_format=True, repeat_window=60)
+    for _ in range(4):
+        writer.log("Camera timeout", "WARNING")
+    writer.log("Other")
+    writer.close()
+    records = [json.loads(line) for line in lines(path)]
+    assert [record["message"] for record in records] == ["Camera timeout", "Other", "Camera timeout"]
+    assert "repeated" not in records[0]
+    assert records[2]["repeated"] == 3 and records[2]["level"] == "WARNING"
+
+def test_every_record_is_written_without_a_window(tmp_path):
+    path = str(tmp_path / "surveillance.log")
+    writer = LogWriter(path=path, console=False, repeat_window=0)
+    for _ in range(3):
+        writer.log("same")
+    writer.close()
+    assert lines(path) == ["\t - [INFO]: same"] * 3
+
+class BlockedWriter(LogWriter):
+    """
+    A writer whose thread waits before writing each record.
+    """
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.release = threading.Event()
+
+    def _write(self, record: tuple):
+        self.release.wait(5)
+        super()._write(record)
+
+def test_full_queue_drops_and_counts_records(tmp_path):
+    path = str(tmp_path / "surveillance.log")
+    writer = BlockedWriter(path=path, console=False, queue_size=1, repeat_window=0)
+    writer.log("written")
+    while not writer.queue.empty():
+        time.sleep(0.01)
+    writer.log("queued")
+    writer.log("dropped")
+    assert writer.dropped == 1
+    writer.release.set()
+    writer.close()
+    assert lines(path) == [
+        "\t - [INFO]: written",
+        "\t - [WARNING]: 1 log records were dropped.",
+        "\t - [INFO]: queued",
+    ]
+
+def test_log_file_is_rotated_by_its_encoded_size(tmp_path):
+    path = str(tmp_path / "surveillance.log")
+    writer = LogWriter(path=path, console=False, max_bytes=100, backups=2, repeat_window=0)
+    # Each line holds 35 characters but 55 bytes.
+    message = "é" * 20
+    for index in range(5):
+        writer.log(f"{index} {message}")
+    writer.close()
+    assert sorted(os.listdir(tmp_path)) == ["surveillance.log", "surveillance.log.1", "surveillance.log.2"]
+    for name in os.listdir(tmp_path):
+        assert os.path.getsize(tmp_path / name) <= 100
+    assert lines(path) == [f"\t - [INFO]: 4 {message}"]
+    assert lines(f"{path}.2") == [f"\t - [INFO]: 2 {message}"]
+
+def test_reconfiguring_closes_the_previous_writer(tmp_path):
+    try:
+        surveillance.configure_logging({"file": str(tmp_path / "a.log"), "console": False})
+        surveillance.logger("to a")
+        first = surveillance._writer
+        surveillance.configure_logging({"file": str(tmp_path / "b.log"), "console": False})
+        surveillance.logger("to b")
+        assert first.closed and first.file is None and not first._thread.is_alive()
+        surveillance._writer.close()
+        assert lines(str(tmp_path / "a.log")) == ["\t - [INFO]: to a"]
+        assert lines(str(tmp_path / "b.log")) == ["\t - [INFO]: to b"]
+    finally:
+        surveillance._writer = LogWriter()
@@ -0,0 +1,78 @@
+from surveillance.media import MediaIndex, parse_time
+import pytest
+import os
+
+def write(directory, name: str, size: int, timestamp: float) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (timestamp, timestamp))
+    return path
+
+@pytest.fixture
+def media(tmp_path):
+    directories = {kind: str(tmp_path / kind) for kind in ("image", "video", "sound")}
+    for directory in directories.values():
+        os.makedirs(directory)
+    for index in range(5):
+        write(directories["image"], f"snap_{index}.jpg", 100 + index, 1000 + index * 10)
+    write(directories["video"], "clip_a.mp4", 5000, 1005)
+    write(directories["video"], "clip_b.mp4", 3000, 1035)
+    write(directories["sound"], "clip.wav", 700, 1025)
+    write(directories["image"], "notes.txt", 10, 1000)
+    index = MediaIndex(str(tmp_path / "media.db"), directories, probe=lambda path: 12.5)
+    assert index.sync() == (8, 0)
+    yield index
+    index.connection.close()
+
+def names(items: list) -> list:
+    return [item["name"] for item in items]
+
+def test_query_pages_the_most_recent_first(media):
+    first, total = media.query(per_page=3)
+    second, _ = media.query(per_page=3, page=2)
+    last, _ = media.query(per_page=3, page=3)
+    assert total == 8
+    assert names(first) == ["snap_4.jpg", "clip_b.mp4", "snap_3.jpg"]
+    assert names(second) == ["clip.wav", "snap_2.jpg", "snap_1.jpg"]
+    assert names(last) == ["clip_a.mp4", "snap_0.jpg"]
+
+def test_query_filters_by_type_and_time(media):
+    videos, total = media.query(kind="video")
+    assert total == 2 and names(videos) == ["clip_b.mp4", "clip_a.mp4"]
+    assert videos[0]["duration"] == 12.5
+    _, total = media.query(kind=["image", "video"])
+    assert total == 7
+    items, total = media.query(start=1010, end=1030)
+    assert total == 3 and names(items) == ["clip.wav", "snap_2.jpg", "snap_1.jpg"]
+
+def test_query_sorts_by_a_column(media):
+    items, _ = media.query(kind="video", sort="size", order="asc")
+    assert names(items) == ["clip_b.mp4", "clip_a.mp4"]
+    items, _ = media.query(kind="image", sort="name", order="asc", per_page=2)
+    assert names(items) == ["snap_0.jpg", "snap_1.jpg"]
+    with pytest.raises(ValueError):
+        media.query(sort="size; DROP TABLE media")
+    with pytest.raises(ValueError):
+        media.query(order="sideways")
+
+def test_sync_removes_deleted_files_and_updates_usage(media):
+    os.remove(media.path("image", "snap_0.jpg"))
+    assert media.sync(["image"]) == (0, 1)
+    usage = media.usage()
+    assert usage["image"]["files"] == 4
+    assert usage["video"]["bytes"] == 8000
+
+def test_protection_survives_updates(media):
+    path = media.path("video", "clip_a.mp4")
+    assert media.protect(path)
+    media.add(path)
+    items, _ = media.query(kind="video", sort="name", order="asc")
+    assert items[0]["protected"] and not items[1]["protected"]
+
+def test_parse_time_accepts_epochs_and_dates():
+    assert parse_time(None) is None
+    assert parse_time("1700000000") == 1700000000.0
+    assert parse_time("2024-06-01") == parse_time("2024-06-01T00:00:00")
+    with pytest.raises(ValueError):
+        parse_time("yesterday")
@@ -0,0 +1,62 @@
+from surveillance.metrics import NULL_TIMER, Registry, format_labels
+
+def test_labels_are_escaped():
+    assert format_labels({}) == ""
+    assert format_labels({"stage": "capture"}) == '{stage="capture"}'
+    assert format_labels({"path": 'a"b\\c\nd'}) == '{path="a\\"b\\\\c\\nd"}'
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "The latency.", buckets=(0.1, 1.0), stage="a")
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.samples() == [
+        'latency_seconds_bucket{stage="a",le="0.1"} 2',
+        'latency_seconds_bucket{stage="a",le="1.0"} 3',
+        'latency_seconds_bucket{stage="a",le="+Inf"} 4',
+        'latency_seconds_sum{stage="a"} 2.65',
+        'latency_seconds_count{stage="a"} 4',
+    ]
+
+def test_series_are_shared_by_labels():
+    registry = Registry()
+    first = registry.counter("frames_total", "The frames.", camera="1")
+    assert registry.counter("frames_total", "The frames.", camera="1") is first
+    second = registry.counter("frames_total", "The frames.", camera="2")
+    first.inc()
+    second.inc(3)
+    assert registry.render() == (
+        "# HELP frames_total The frames.\n"
+        "# TYPE frames_total counter\n"
+        'frames_total{camera="1"} 1\n'
+        'frames_total{camera="2"} 3\n'
+    )
+
+def test_disabled_registry_records_nothing():
+    registry = Registry(enabled=False)
+    histogram = registry.histogram("latency_seconds", "The latency.")
+    counter = registry.counter("frames_total", "The frames.")
+    assert histogram.time() is NULL_TIMER
+    with histogram.time():
+        pass
+    histogram.observe(1.0)
+    counter.inc()
+    assert histogram.samples()[-1] == "latency_seconds_count 0"
+    assert counter.value == 0
+
+def test_timer_observes_the_block():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "The latency.")
+    with histogram.time():
+        pass
+    assert sum(histogram.counts) == 1 and histogram.sum >= 0
+
+def test_gauges_are_read_when_rendered():
+    registry = Registry()
+    value = [1]
+    registry.gauge("clients", "The clients.", lambda: value[0])
+    value[0] = 5
+    assert 'clients 5' in registry.render()
+    # A gauge registered again replaces the function, a failing one is omitted.
+    registry.gauge("clients", "The clients.", lambda: 1 / 0)
+    assert registry.render() == "# HELP clients The clients.\n# TYPE clients gauge\n"
@@ -0,0 +1,138 @@
+from collections import deque
+from surveillance.video.motion import MotionDetector, component_boxes, label_components
+import numpy as np
+import pytest
+
+def bfs_components(mask: np.ndarray) -> list:
+    """
+    Lists the 4-connected components of a mask as sets of pixels.
+    """
+    seen = np.zeros(mask.shape, dtype=bool)
+    components = []
+    height, width = mask.shape
+    for y, x in zip(*np.nonzero(mask)):
+        if seen[y, x]:
+            continue
+        seen[y, x] = True
+        pixels, pending = set(), deque([(y, x)])
+        while pending:
+            cy, cx = pending.popleft()
+            pixels.add((cy, cx))
+            for ny, nx in ((cy - 1, cx), (cy + 1, cx), (cy, cx - 1), (cy, cx + 1)):
+                if 0 <= ny < height and 0 <= nx < width and mask[ny, nx] and not seen[ny, nx]:
+                    seen[ny, nx] = True
+                    pending.append((ny, nx))
+        components.append(frozenset(pixels))
+    return components
+
+@pytest.mark.parametrize("density", [0.2, 0.45, 0.6])
+@pytest.mark.parametrize("seed", range(5))
+def test_label_components_matches_bfs(seed, density):
+    mask = np.random.default_rng(seed).random((37, 53)) < density
+    labels, count = label_components(mask)
+    expected = bfs_components(mask)
+    assert count == len(expected)
+    assert (labels[~mask] == 0).all()
+    found = {
+        frozenset(zip(*np.nonzero(labels == label)))
+        for label in range(1, count + 1)
+    }
+    assert found == set(expected)
+
+def test_label_components_empty_mask():
+    labels, count = label_components(np.zeros((4, 6), dtype=bool))
+    assert count == 0
+    assert not labels.any()
+
+def test_label_components_spiral():
+    # A long winding component takes many passes to merge.
+    mask = np.zeros((21, 21), dtype=bool)
+    top, left, bottom, right = 0, 0, 20, 20
+    while top <= bottom and left <= right:
+        mask[top, left:right + 1] = True
+        mask[top:bottom + 1, right] = True
+        mask[bottom, left:right + 1] = True
+        mask[top + 2:bottom + 1, left] = True
+        top, left, bottom, right = top + 2, left + 2, bottom - 2, right - 2
+        if top <= bottom:
+            mask[top - 1, left] = True
+    labels, count = label_components(mask)
+    assert count == len(bfs_components(mask)) == 1
+    assert (labels[mask] == 1).all()
+
+def detector(**settings) -> MotionDetector:
+    settings.setdefault("analysis_size", None)
+    settings.setdefault("blur", None)
+    return MotionDetector(pixel_threshold=20, tile_size=16, tile_threshold=8, **settings)
+
+def moved(shape: tuple, top: int, left: int, size: int) -> tuple:
+    """
+    Returns a still frame and a frame with a bright square.
+    """
+    previous = np.zeros(shape, dtype=np.uint8)
+    current = previous.copy()
+    current[top:top + size, left:left + size] = 255
+    return previous, current
+
+def test_adjacent_active_tiles_report_motion():
+    result = detector(min_tiles=2).analyze(*moved((64, 64), 0, 8, 16))
+    assert result.motion
+    assert result.tiles.sum() == 2
+    assert result.score == 2
+
+def test_isolated_active_tiles_are_not_motion():
+    motion = detector(min_tiles=2)
+    previous, current = moved((64, 64), 0, 0, 16)
+    current[48:64, 48:64] = 255
+    result = motion.analyze(previous, current)
+    assert result.tiles.sum() == 2
+    assert result.score == 1
+    assert not result.motion
+
+def test_excluded_region_is_ignored():
+    motion = detector(min_tiles=1, regions=[{"polygon": [[0, 0], [0.5, 0], [0.5, 1], [0, 1]], "exclude": True}])
+    assert not motion.analyze(*moved((64, 64), 16, 0, 32)).motion
+    assert motion.analyze(*moved((64, 64), 16, 32, 32)).motion
+
+def test_region_tile_threshold_overrides_the_default():
+    motion = detector(min_tiles=1, regions=[
+        {"polygon": [[0, 0], [1, 0], [1, 1], [0, 1]], "tile_threshold": 200},
+    ])
+    # 12 x 12 changed pixels exceed the default threshold but not the region's.
+    result = motion.analyze(*moved((64, 64), 2, 2, 12))
+    assert result.count == 144
+    assert not result.motion
+
+def test_affected_regions_of_a_frame_not_divisible_by_the_tile_size():
+    regions = [
+        {"name": "door", "polygon": [[0, 0], [0.4, 0], [0.4, 1], [0, 1]]},
+        {"name": "window", "polygon": [[0.6, 0], [1, 0], [1, 1], [0.6, 1]]},
+    ]
+    shape = (70, 100)
+    result = detector(min_tiles=1, regions=regions).analyze(*moved(shape, 40, 70, 24))
+    assert result.motion
+    assert result.shape == shape
+    # A detector of another process only receives the result.
+    other = detector(min_tiles=1, regions=regions)
+    assert other.affected_regions(result.tiles, result.shape) == ["window"]
+
+def test_component_boxes_encloses_each_object():
+    mask = np.zeros((60, 80), dtype=bool)
+    mask[10:20, 5:15] = True
+    mask[40:50, 50:75] = True
+    boxes = component_boxes(mask, min_area=1, cell=4)
+    assert boxes.tolist() == [[50, 40, 75, 50, 250], [5, 10, 15, 20, 100]]
+
+def test_component_boxes_merges_fragments_of_a_cell():
+    mask = np.zeros((16, 16), dtype=bool)
+    mask[4, 4] = mask[6, 6] = True
+    boxes = component_boxes(mask, min_area=1, cell=4)
+    assert boxes.tolist() == [[4, 4, 7, 7, 2]]
+
+def test_component_boxes_drops_small_groups():
+    mask = np.zeros((32, 32), dtype=bool)
+    mask[0, 0] = True
+    mask[20:24, 20:24] = True
+    boxes = component_boxes(mask, min_area=4, cell=4)
+    assert boxes.tolist() == [[20, 20, 24, 24, 16]]
+    assert component_boxes(np.zeros((8, 8), dtype=bool)).shape == (0, 5)
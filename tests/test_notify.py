@@ -0,0 +1,129 @@
+from surveillance.credentials import Credentials
+from surveillance.notify import Alert, EmailNotifier
+from PIL import Image
+import socketserver
+import threading
+import email
+import socket
+import pytest
+import time
+import io
+
+def jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Accepts the messages of a client without authentication, or
+    rejects its login when the server is set to.
+    """
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 test")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.decode().strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250-test")
+                self.reply("250 AUTH PLAIN")
+            elif command.startswith("AUTH"):
+                self.server.logins += 1
+                self.reply("535 rejected" if self.server.reject else "235 accepted")
+            elif command == "DATA":
+                self.reply("354 go on")
+                data = b""
+                while not data.endswith(b"\r\n.\r\n"):
+                    data += self.rfile.readline()
+                self.server.messages.append(email.message_from_bytes(data[:-5]))
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                break
+            else:
+                self.reply("250 ok")
+
+@pytest.fixture
+def smtp():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPHandler)
+    server.daemon_threads = True
+    server.messages, server.logins, server.reject = [], 0, False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def credentials(password: str="") -> Credentials:
+    return Credentials("camera@example.com", password, ["owner@example.com"], "lab", {})
+
+def notifier(smtp, **settings) -> EmailNotifier:
+    return EmailNotifier(
+        credentials(settings.pop("password", "")), host="127.0.0.1",
+        port=smtp.server_address[1], use_ssl=False, **settings)
+
+def wait_until(condition, timeout: float=5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_alerts_within_the_window_are_sent_as_one_digest(smtp):
+    sender = notifier(smtp, window=0.3)
+    for index in range(3):
+        assert sender.notify("Motion", f"Alert {index}", [jpeg()])
+    assert wait_until(lambda: sender.sent == 1)
+    time.sleep(0.2)
+    assert len(smtp.messages) == 1
+    message = smtp.messages[0]
+    assert message["Subject"] == "Motion (3 alerts)"
+    assert len([part for part in message.walk() if part.get_content_maintype() == "image"]) == 3
+    sender.stop()
+
+def test_connection_is_reused_between_messages(smtp):
+    sender = notifier(smtp, window=0, password="secret")
+    sender.notify("First", "body")
+    assert wait_until(lambda: sender.sent == 1)
+    sender.notify("Second", "body")
+    assert wait_until(lambda: sender.sent == 2)
+    assert smtp.logins == 1
+    sender.stop()
+
+def test_digest_limits_the_images():
+    sender = EmailNotifier(credentials(), max_images=2)
+    message = sender.digest([Alert("Motion", "a", [jpeg(), jpeg()]), Alert("Motion", "b", [jpeg()])])
+    assert message["Subject"] == "Motion (2 alerts)"
+    assert len([part for part in message.walk() if part.get_content_maintype() == "image"]) == 2
+
+def test_rejected_login_is_retried_then_dropped(smtp):
+    smtp.reject = True
+    sender = notifier(smtp, window=0, password="secret", max_attempts=2, max_backoff=1)
+    sender.notify("Motion", "body")
+    assert wait_until(lambda: smtp.logins == 2)
+    time.sleep(0.2)
+    assert sender.sent == 0 and sender.server is None
+    assert smtp.messages == []
+
+def test_unreachable_server_is_retried_with_backoff():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    sender = EmailNotifier(
+        credentials(), host="127.0.0.1", port=port, use_ssl=False, window=0, max_attempts=2)
+    started = time.monotonic()
+    with sender.lock:
+        sender._deliver(sender.digest([Alert("Motion", "body")]))
+    assert time.monotonic() - started >= 1.0
+    assert sender.sent == 0 and sender.server is None
+
+def test_full_queue_drops_alerts():
+    sender = EmailNotifier(credentials(), queue_size=1, window=5)
+    # The worker holds the lock while delivering, so hold it to keep the queue full.
+    with sender.lock:
+        results = [sender.notify("Motion", str(index)) for index in range(4)]
+    assert results.count(False) >= 2
+    assert sender.dropped == results.count(False)
@@ -0,0 +1,81 @@
+from surveillance.retention import RetentionManager, RetentionPolicy
+from surveillance.media import MediaIndex
+import shutil
+import pytest
+import os
+
+NOW = 100000
+
+def write(directory, name: str, size: int, timestamp: float) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (timestamp, timestamp))
+    return path
+
+@pytest.fixture
+def media(tmp_path):
+    directories = {kind: str(tmp_path / kind) for kind in ("image", "video", "sound")}
+    for directory in directories.values():
+        os.makedirs(directory)
+    for index in range(4):
+        write(directories["image"], f"snap_{index}.jpg", 1000, NOW - 4000 + index * 1000)
+    write(directories["video"], "clip.mp4", 5000, NOW - 100000)
+    index = MediaIndex(str(tmp_path / "media.db"), directories, probe=lambda path: None)
+    index.sync()
+    yield index
+    index.connection.close()
+
+def names(media: MediaIndex, kind: str) -> list:
+    items, _ = media.query(kind=kind, sort="name", order="asc")
+    return [item["name"] for item in items]
+
+def test_maximum_age_removes_the_old_files(media):
+    removed = []
+    manager = RetentionManager(
+        media, {"image": RetentionPolicy(max_age=2500)}, grace=0, on_removed=removed.append)
+    assert manager.check(now=NOW) == 2
+    assert names(media, "image") == ["snap_2.jpg", "snap_3.jpg"]
+    assert [os.path.basename(path) for path in removed] == ["snap_0.jpg", "snap_1.jpg"]
+    assert not os.path.exists(media.path("image", "snap_0.jpg"))
+    assert names(media, "video") == ["clip.mp4"]
+
+def test_quota_removes_the_oldest_files(media):
+    manager = RetentionManager(media, {"image": RetentionPolicy(max_bytes=2500)}, grace=0)
+    assert manager.check(now=NOW) == 2
+    assert names(media, "image") == ["snap_2.jpg", "snap_3.jpg"]
+    assert manager.status()["usage"]["image"]["bytes"] == 2000
+
+def test_protected_files_are_kept_and_not_counted(media):
+    for index in range(3):
+        assert media.protect(media.path("image", f"snap_{index}.jpg"))
+    # The protected files alone exceed the quota, the unprotected one is within it.
+    manager = RetentionManager(media, {"image": RetentionPolicy(max_bytes=1500)}, grace=0)
+    assert manager.check(now=NOW) == 0
+    assert len(names(media, "image")) == 4
+    manager = RetentionManager(media, {"image": RetentionPolicy(max_bytes=500)}, grace=0)
+    assert manager.check(now=NOW) == 1
+    assert names(media, "image") == ["snap_0.jpg", "snap_1.jpg", "snap_2.jpg"]
+
+def test_recent_files_are_kept(media):
+    manager = RetentionManager(media, {"image": RetentionPolicy(max_bytes=0)}, grace=1500)
+    assert manager.check(now=NOW) == 3
+    assert names(media, "image") == ["snap_3.jpg"]
+
+def test_minimum_free_space_removes_any_type(media):
+    free = shutil.disk_usage(media.directories["image"]).free
+    manager = RetentionManager(media, {}, min_free_bytes=free + 1024 ** 3, grace=0)
+    assert manager.check(now=NOW) == 5
+    assert media.usage()["image"]["files"] == 0
+    assert media.usage()["video"]["files"] == 0
+    assert manager.removed == 5 and manager.last_check == NOW
+
+def test_removal_deletes_the_attached_rows(media):
+    media.connection.execute("CREATE TABLE activity (name TEXT, score REAL)")
+    media.connection.executemany(
+        "INSERT INTO activity VALUES (?, ?)", [("clip.mp4", 0.5), ("other.mp4", 0.1)])
+    media.attach("video", "activity")
+    manager = RetentionManager(media, {"video": RetentionPolicy(max_age=3600)}, grace=0)
+    assert manager.check(now=NOW) == 1
+    rows = media.connection.execute("SELECT name FROM activity").fetchall()
+    assert rows == [("other.mp4",)]
@@ -0,0 +1,69 @@
+from surveillance.control.servo import ServoController
+import pytest
+import time
+
+class RecordingServo:
+    """
+    Records the values written to the servo.
+    """
+    def __init__(self):
+        self.values = []
+
+    @property
+    def value(self):
+        return self.values[-1] if self.values else None
+
+    @value.setter
+    def value(self, value):
+        self.values.append(value)
+
+def wait_until(condition, timeout: float=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_move_ramps_and_detaches():
+    servo = RecordingServo()
+    controller = ServoController(servo, speed=10.0, step_interval=0.01, idle_timeout=0.1)
+    controller.start()
+    try:
+        controller.move(-1)
+        assert wait_until(lambda: controller.position == -1.0)
+        controller.move(1)
+        assert wait_until(lambda: controller.position == 1.0)
+        assert wait_until(lambda: servo.values[-1] is None)
+    finally:
+        controller.stop()
+    positions = [value for value in servo.values if value is not None]
+    steps = [b - a for a, b in zip(positions, positions[1:])]
+    assert positions[-1] == 1.0
+    assert max(steps) <= 10.0 * 0.01 + 1e-9
+    assert not controller.attached
+
+def test_move_clamps_and_rejects_nan():
+    controller = ServoController(RecordingServo())
+    controller.move(5)
+    assert controller.targets.get_nowait() == 1.0
+    with pytest.raises(ValueError):
+        controller.move(float("nan"))
+
+def test_moves_are_coalesced():
+    controller = ServoController(RecordingServo())
+    for value in (0.1, 0.2, 0.3):
+        controller.move(value)
+    assert controller._latest(block=False) == 0.3
+    assert controller.coalesced == 2
+
+def test_gpiozero_servo_from_configuration():
+    gpiozero = pytest.importorskip("gpiozero")
+    from gpiozero.pins.mock import MockFactory, MockPWMPin
+    gpiozero.Device.pin_factory = MockFactory(pin_class=MockPWMPin)
+    controller = ServoController.from_configuration({"pin": 17, "speed": 50.0, "idle_timeout": 0.1})
+    controller.start()
+    try:
+        controller.move(0.5)
+        assert wait_until(lambda: controller.servo.value == pytest.approx(0.5))
+    finally:
+        controller.stop()
+        controller.servo.close()
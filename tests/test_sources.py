@@ -0,0 +1,25 @@
+from surveillance.video.sources import SyntheticSource, source_from_configuration
+from PIL import Image
+import numpy as np
+import pytest
+import io
+
+def test_synthetic_source_pairs_jpeg_and_luma():
+    source = SyntheticSource(size=(160, 120), lores_size=(80, 60), frames=4)
+    first = source.read_jpeg()
+    luma = source.read_luma()
+    assert Image.open(io.BytesIO(first)).size == (160, 120)
+    assert luma.shape == (60, 80) and luma.dtype == np.uint8
+    # The frames are looped.
+    for _ in range(3):
+        source.read_jpeg()
+    assert source.read_jpeg() == first
+    assert source.read_luma() is luma
+
+def test_source_from_configuration():
+    source = source_from_configuration(
+        {"type": "synthetic", "frames": 2}, size=(64, 48), lores_size=(32, 24))
+    assert isinstance(source, SyntheticSource)
+    assert source.read_luma().shape == (24, 32)
+    with pytest.raises(ValueError):
+        source_from_configuration({"type": "webcam"})
@@ -0,0 +1,95 @@
+from surveillance.video.broadcast import FrameBroadcaster, MetadataChannel
+from surveillance.streaming import AsyncStreamServer
+from flask import Flask
+import socket
+import pytest
+import time
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_until(condition, timeout: float=5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+@pytest.fixture
+def stream():
+    app = Flask(__name__)
+    app.secret_key = "secret"
+    broadcaster = FrameBroadcaster(lambda: None)
+    metadata = MetadataChannel(keepalive=0.2)
+    server = AsyncStreamServer(
+        app, broadcaster, metadata=metadata, host="127.0.0.1", port=free_port(),
+        max_buffer=1024, max_stall=0.5)
+    server.start()
+    cookie = server.serializer.dumps({"username": "user"})
+    yield server, broadcaster, metadata, f"session={cookie}"
+    server.stop()
+
+def connect(server: AsyncStreamServer, path: str, cookie: str="") -> socket.socket:
+    client = socket.create_connection(("127.0.0.1", server.port), timeout=5)
+    client.sendall(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nCookie: {cookie}\r\n\r\n".encode())
+    return client
+
+def read_until(client: socket.socket, marker: bytes) -> bytes:
+    data = b""
+    while marker not in data:
+        chunk = client.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def test_requests_need_a_session(stream):
+    server, _, _, _ = stream
+    with connect(server, "/cam", "session=forged") as client:
+        assert read_until(client, b"Login required.").startswith(b"HTTP/1.1 401")
+
+def test_viewers_receive_the_published_frames(stream):
+    server, broadcaster, _, cookie = stream
+    with connect(server, "/cam", cookie) as client:
+        assert wait_until(lambda: broadcaster.clients == 1)
+        broadcaster.publish(b"first-frame")
+        data = read_until(client, b"first-frame")
+        assert data.startswith(b"HTTP/1.1 200 OK")
+        assert b"Content-Length: 11\r\n\r\nfirst-frame" in data
+        broadcaster.publish(b"second-frame")
+        assert b"second-frame" in read_until(client, b"second-frame")
+    # A closed connection is noticed when the next frames are sent.
+    assert wait_until(
+        lambda: broadcaster.publish(b"frame") and broadcaster.clients == 0 and server.viewers == 0)
+
+def test_unknown_quality_is_rejected(stream):
+    server, _, _, cookie = stream
+    with connect(server, "/cam?quality=ultra", cookie) as client:
+        assert read_until(client, b"Unknown quality.").startswith(b"HTTP/1.1 400")
+
+def test_subscribers_receive_the_motion_boxes(stream):
+    server, _, metadata, cookie = stream
+    with connect(server, "/api/motion/boxes", cookie) as client:
+        assert wait_until(lambda: metadata.clients == 1)
+        assert b": keepalive" in read_until(client, b": keepalive")
+        metadata.publish({"boxes": [[1, 2, 3, 4]]})
+        assert b'data: {"boxes": [[1, 2, 3, 4]]}' in read_until(client, b"]]}")
+    assert wait_until(lambda: metadata.publish({}) and metadata.clients == 0)
+
+def test_stalled_viewers_are_disconnected(stream):
+    server, broadcaster, _, cookie = stream
+    client = connect(server, "/cam", cookie)
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    try:
+        assert wait_until(lambda: broadcaster.clients == 1)
+        frame = b"x" * (1024 * 1024)
+        # The viewer never reads, so its unsent data stays above the limit.
+        assert wait_until(
+            lambda: broadcaster.publish(frame) and server.disconnected == 1, timeout=10)
+        assert server.dropped > 0
+        assert wait_until(lambda: broadcaster.clients == 0 and server.viewers == 0)
+    finally:
+        client.close()
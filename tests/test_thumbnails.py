@@ -0,0 +1,89 @@
+from surveillance.thumbnails import ThumbnailCache
+from PIL import Image
+import numpy as np
+import os
+
+def picture(directory, name: str, seed: int=0) -> str:
+    # Noise keeps the thumbnails of a similar size.
+    pixels = np.random.default_rng(seed).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    path = os.path.join(directory, name)
+    Image.fromarray(pixels).save(path, quality=90)
+    return path
+
+class PosterCache(ThumbnailCache):
+    """
+    Counts the poster frames decoded instead of running ffmpeg.
+    """
+    posters = 0
+
+    def poster_frame(self, source_path: str) -> Image.Image:
+        self.posters += 1
+        return Image.new("RGB", (64, 48))
+
+def test_thumbnail_is_created_once_and_reused(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "cache"), size=(32, 24))
+    source = picture(tmp_path, "snap.jpg")
+    path = cache.get(source)
+    assert Image.open(path).size == (32, 24)
+    created = os.stat(path).st_ino
+    assert cache.get(source) == path
+    assert os.stat(path).st_ino == created
+
+def test_thumbnail_is_recreated_when_the_source_changes(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "cache"), size=(32, 24))
+    source = picture(tmp_path, "snap.jpg")
+    created = os.stat(cache.get(source)).st_ino
+    os.utime(source, (1, 1))
+    assert os.stat(cache.get(source)).st_ino != created
+
+def test_least_recently_used_thumbnails_are_evicted(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "cache"), size=(32, 24))
+    sources = [picture(tmp_path, f"snap_{index}.jpg", index) for index in range(3)]
+    paths = [cache.get(source) for source in sources[:2]]
+    cache.max_bytes = cache.total + 10
+    # The first thumbnail was used last, so the second one is evicted.
+    cache.get(sources[0])
+    cache.get(sources[2])
+    assert os.path.exists(paths[0]) and not os.path.exists(paths[1])
+    assert cache.total == sum(cache.entries.values()) <= cache.max_bytes
+
+def test_eviction_order_survives_a_restart(tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = ThumbnailCache(directory, size=(32, 24))
+    sources = [picture(tmp_path, f"snap_{index}.jpg", index) for index in range(2)]
+    for source in sources:
+        cache.get(source)
+    cache.get(sources[0])
+    restarted = ThumbnailCache(directory, size=(32, 24))
+    assert list(restarted.entries) == [
+        os.path.basename(cache.path(sources[1])), os.path.basename(cache.path(sources[0]))]
+    assert restarted.total == cache.total
+
+def test_removed_files_drop_their_thumbnail(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "cache"))
+    source = picture(tmp_path, "snap.jpg")
+    path = cache.get(source)
+    cache.remove(source)
+    assert not os.path.exists(path) and cache.total == 0
+    assert cache.get(str(tmp_path / "missing.jpg")) is None
+
+def test_poster_of_a_recording_in_progress_is_kept(tmp_path):
+    recording = tmp_path / "video" / "rec"
+    recording.mkdir(parents=True)
+    manifest = recording / "index.m3u8"
+    (recording / "seg_00000.m4s").write_bytes(b"segment")
+    manifest.write_text("#EXTM3U\n#EXT-X-MAP:URI=\"init.mp4\"\n#EXTINF:2.0,\nseg_00000.m4s\n")
+    cache = PosterCache(str(tmp_path / "cache"))
+    assert cache.get(str(manifest)) is not None
+    # A new segment changes the manifest but not the poster.
+    (recording / "seg_00001.m4s").write_bytes(b"segment")
+    with open(manifest, "a") as f:
+        f.write("#EXTINF:2.0,\nseg_00001.m4s\n")
+    os.utime(manifest, (1, 1))
+    cache.get(str(manifest))
+    assert cache.posters == 1
+    with open(manifest, "a") as f:
+        f.write("#EXT-X-ENDLIST\n")
+    cache.get(str(manifest))
+    cache.get(str(manifest))
+    assert cache.posters == 2